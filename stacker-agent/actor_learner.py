@@ -0,0 +1,514 @@
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from functools import partial
+from multiprocessing.managers import BaseManager
+
+import gym
+import numpy as np
+import torch as th
+from gym import spaces
+from stable_baselines3 import DDPG
+from stable_baselines3.common.utils import configure_logger
+
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+from model_catalog import ModelCatalog
+
+class SharedParameters:
+    """
+    Description:
+        The learner's actor parameters in shared memory, for actor processes
+        on the same host.  publish() copies the learner's actor into the
+        shared tensors; fetch() returns a copy of the parameters if they are
+        newer than the version an actor has.  The version is odd while the
+        learner is writing, so a fetch never sees a partial update (a seqlock).
+    """
+
+    def __init__(self, actor):
+        self.tensors = {key : value.detach().cpu().clone().share_memory_() for key, value in actor.state_dict().items()}
+        self.version = th.zeros((), dtype=th.int64).share_memory_()
+
+    def publish(self, actor):
+        self.version += 1
+        for key, value in actor.state_dict().items():
+            self.tensors[key].copy_(value)
+        self.version += 1
+
+    def fetch(self, version):
+        while True:
+            start = int(self.version)
+            if start == version:
+                return version, None
+            if start % 2 == 1:
+                time.sleep(0)
+                continue
+            state = {key : value.clone() for key, value in self.tensors.items()}
+            if int(self.version) == start:
+                return start, state
+
+class PendingParameters:
+    """The parameters of a local actor, which the learner hands over (through
+    a queue, which shares the tensors) once it has built its model."""
+
+    def __init__(self, handoff):
+        self.handoff = handoff
+        self.parameters = None
+
+    def fetch(self, version):
+        if self.parameters is None:
+            try:
+                self.parameters = self.handoff.get(timeout=0.1)
+            except queue.Empty:
+                return version, None
+        return self.parameters.fetch(version)
+
+class ParameterServer:
+    """The learner's actor parameters (as numpy arrays), served to actors on
+    other hosts by an ActorLearnerManager, with the interface of
+    SharedParameters."""
+
+    def __init__(self):
+        self.version = 0
+        self.arrays = None
+        self.lock = threading.Lock()
+
+    def publish_arrays(self, arrays):
+        with self.lock:
+            self.arrays = arrays
+            self.version += 1
+
+    def fetch_arrays(self, version):
+        with self.lock:
+            if self.version == version:
+                return version, None
+            return self.version, self.arrays
+
+class RemoteParameters:
+    """Adapts a ParameterServer proxy to the interface of SharedParameters."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def publish(self, actor):
+        self.server.publish_arrays({key : value.detach().cpu().numpy() for key, value in actor.state_dict().items()})
+
+    def fetch(self, version):
+        version, arrays = self.server.fetch_arrays(version)
+        if arrays is None:
+            return version, None
+        return version, {key : th.as_tensor(value) for key, value in arrays.items()}
+
+# served by the learner's ActorLearnerManager
+_transitions = None
+_parameter_server = None
+_stop = None
+
+def _get_transitions():
+    return _transitions
+
+def _get_parameter_server():
+    return _parameter_server
+
+def _get_stop():
+    return _stop
+
+def _init_manager_server(maxsize):
+    global _transitions, _parameter_server, _stop
+    _transitions = queue.Queue(maxsize)
+    _parameter_server = ParameterServer()
+    _stop = threading.Event()
+
+class ActorLearnerManager(BaseManager):
+    """Serves the transition queue, the parameter server and the stop event
+    of a learner over a socket, so actors can run on other hosts."""
+
+ActorLearnerManager.register("get_transitions", callable=_get_transitions)
+ActorLearnerManager.register("get_parameter_server", callable=_get_parameter_server)
+ActorLearnerManager.register("get_stop", callable=_get_stop)
+
+def parse_address(address):
+    host, port = address.rsplit(":", 1)
+    return (host, int(port))
+
+class SpacesEnv(gym.Env):
+    """A stand-in environment with the actors' spaces, so the learner can
+    build its model without opening an environment."""
+
+    def __init__(self, observation_space, action_space):
+        self.observation_space = observation_space
+        self.action_space = action_space
+
+    def reset(self):
+        raise NotImplementedError("The learner doesn't step an environment")
+
+    def step(self, action):
+        raise NotImplementedError("The learner doesn't step an environment")
+
+def _new_chunk(observation_space, action_space, chunk_size):
+    def obs_array():
+        if isinstance(observation_space, spaces.Dict):
+            return {key : np.zeros((chunk_size,) + space.shape, dtype=space.dtype) for key, space in observation_space.spaces.items()}
+        return np.zeros((chunk_size,) + observation_space.shape, dtype=observation_space.dtype)
+    return {
+        "observations" : obs_array(),
+        "next_observations" : obs_array(),
+        "actions" : np.zeros((chunk_size,) + action_space.shape, dtype=np.float32),
+        "rewards" : np.zeros((chunk_size,), dtype=np.float32),
+        "dones" : np.zeros((chunk_size,), dtype=bool)
+    }
+
+def _copy_obs(out, i, obs):
+    if isinstance(out, dict):
+        for key, value in out.items():
+            value[i] = obs[key]
+    else:
+        out[i] = obs
+
+def _slice_obs(obs, start, end):
+    if isinstance(obs, dict):
+        return {key : value[start:end] for key, value in obs.items()}
+    return obs[start:end]
+
+def run_actor(rank,
+    transitions,
+    parameters,
+    stop,
+    policy,
+    environment_filename=None,
+    worker_id=0,
+    seed=None,
+    chunk_size=64,
+    noise_sigma=0.1,
+    policy_kwargs=None,
+    **env_kwargs):
+    """Runs one actor: steps its own StackerEnv with the latest published
+    policy plus Gaussian exploration noise, and puts chunks of chunk_size
+    transitions on transitions until stop is set.  The policy is refreshed
+    from parameters after every chunk.  policy_kwargs must be the learner's,
+    so the actor's policy has the learner's architecture."""
+    th.set_num_threads(1)
+    env = StackerEnv(environment_filename=environment_filename, worker_id=worker_id, seed=seed, **env_kwargs)
+    try:
+        transitions.put(("spaces", rank, env.observation_space, env.action_space))
+        # the actor's model only provides a policy with the learner's architecture
+        model = DDPG(policy, env, buffer_size=1, device="cpu", seed=seed, policy_kwargs=policy_kwargs)
+        policy_net = model.policy
+        policy_net.set_training_mode(False)
+        rng = np.random.default_rng(seed)
+
+        version = 0
+        state = None
+        while not stop.is_set():
+            version, state = parameters.fetch(version)
+            if state is not None:
+                break
+            time.sleep(0.1)
+        if state is not None:
+            policy_net.actor.load_state_dict(state)
+
+        chunk = _new_chunk(env.observation_space, env.action_space, chunk_size)
+        episode_returns = []
+        episode_return = 0.0
+        n = 0
+        obs = env.reset()
+        while not stop.is_set():
+            _copy_obs(chunk["observations"], n, obs)
+            action, _states = policy_net.predict(obs, deterministic=True)
+            # exploration noise is added in the policy's [-1, 1] action range,
+            #  as in OffPolicyAlgorithm._sample_action
+            scaled_action = np.clip(policy_net.scale_action(action) + rng.normal(0, noise_sigma, size=action.shape), -1, 1)
+            obs, reward, done, info = env.step(policy_net.unscale_action(scaled_action))
+
+            _copy_obs(chunk["next_observations"], n, obs)
+            chunk["actions"][n] = scaled_action
+            chunk["rewards"][n] = reward
+            chunk["dones"][n] = done
+            episode_return += reward
+            n += 1
+            if done:
+                episode_returns.append(episode_return)
+                episode_return = 0.0
+                obs = env.reset()
+
+            if n == chunk_size:
+                while not stop.is_set():
+                    try:
+                        transitions.put(("transitions", rank, chunk, episode_returns), timeout=1.0)
+                        break
+                    except queue.Full:
+                        pass
+                chunk = _new_chunk(env.observation_space, env.action_space, chunk_size)
+                episode_returns = []
+                n = 0
+                version, state = parameters.fetch(version)
+                if state is not None:
+                    policy_net.actor.load_state_dict(state)
+    finally:
+        env.close()
+
+def _run_local_actor(rank, transitions, parameters, stop, policy, start_worker_id, seed, **kwargs):
+    run_actor(rank, transitions, parameters, stop, policy, worker_id=start_worker_id+rank,
+        seed=None if seed is None else seed+rank, **kwargs)
+
+def _transpose_images(obs, transpose_keys):
+    # VecTransposeImage's layout: the learner's policy expects channels first
+    if isinstance(obs, dict):
+        return {key : np.transpose(value, (0, 3, 1, 2)) if key in transpose_keys else value for key, value in obs.items()}
+    return np.transpose(obs, (0, 3, 1, 2)) if "" in transpose_keys else obs
+
+def _image_keys_to_transpose(actor_space, policy_space):
+    if isinstance(actor_space, spaces.Dict):
+        return [key for key, space in actor_space.spaces.items() if space.shape != policy_space[key].shape]
+    return [""] if actor_space.shape != policy_space.shape else []
+
+def train_actor_learner(policy,
+    total_timesteps,
+    n_actors=1,
+    environment_filename=None,
+    start_worker_id=0,
+    seed=0,
+    algorithm=DDPG,
+    model_kwargs=None,
+    learning_starts=100,
+    batch_size=100,
+    publish_interval=50,
+    min_updates_per_step=1.0,
+    max_updates_per_step=None,
+    chunk_size=64,
+    queue_size=64,
+    address=None,
+    authkey=b"stacker",
+    tensorboard_log=None,
+    verbose=1,
+    **env_kwargs):
+    """
+    Trains an off-policy model with n_actors actor processes that each step
+    their own StackerEnv (on worker id start_worker_id + rank, seeded with
+    seed + rank) and a learner (this process) that trains continuously on the
+    transitions they stream.
+
+    Actors put chunks of transitions on a bounded queue; the learner adds
+    them to its replay buffer, at most one chunk per gradient step, and
+    publishes its actor to the actors every publish_interval gradient steps.
+    The learner takes at least min_updates_per_step gradient steps per
+    environment step after learning_starts (1, as model.learn does for DDPG):
+    while it is behind, it trains without taking more transitions, so the
+    full queue slows the actors down, and it keeps training after the last
+    transition until it has caught up.  None trains only as fast as
+    transitions arrive.  With max_updates_per_step, the learner waits for
+    transitions rather than take more gradient steps than that per
+    environment step.
+
+    On a single host (address None), the queue is a multiprocessing queue and
+    the parameters are shared memory tensors.  With an address (host:port),
+    the queue and parameters are served over a socket instead, and actors on
+    other hosts can join with "python actor_learner.py --actor --address
+    <host:port> ..." (n_actors may then be 0).
+
+    Returns the trained model.
+    """
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    context = multiprocessing.get_context("spawn")
+
+    manager = None
+    if address is None:
+        transitions = context.Queue(queue_size)
+        stop = context.Event()
+    else:
+        manager = ActorLearnerManager(parse_address(address), authkey=authkey, ctx=context)
+        manager.start(_init_manager_server, (queue_size,))
+        transitions = manager.get_transitions()
+        stop = manager.get_stop()
+        print("Serving actors at %s" % address)
+
+    actors = []
+    handoff = context.Queue()
+    if manager is None:
+        actor_parameters = PendingParameters(handoff)
+    else:
+        # proxies get the manager's authkey only when passed to a new process
+        actor_parameters = RemoteParameters(manager.get_parameter_server())
+    try:
+        # the actors start first, since the learner's model is built with the
+        #  spaces of their environments
+        for rank in range(n_actors):
+            process = context.Process(target=_run_local_actor, daemon=True,
+                args=(rank, transitions, actor_parameters, stop, policy, start_worker_id, seed),
+                kwargs=dict(environment_filename=environment_filename, chunk_size=chunk_size,
+                    policy_kwargs=model_kwargs.get("policy_kwargs"), **env_kwargs))
+            process.start()
+            actors.append(process)
+
+        message = None
+        while message is None:
+            try:
+                message = transitions.get(timeout=1.0)
+            except queue.Empty:
+                if len(actors) > 0 and not any(process.is_alive() for process in actors):
+                    raise RuntimeError("All actors exited before sending their spaces")
+        observation_space, action_space = message[2], message[3]
+
+        model = algorithm(policy, SpacesEnv(observation_space, action_space), learning_starts=learning_starts,
+            batch_size=batch_size, seed=seed, verbose=verbose, device="auto", **model_kwargs)
+        model.set_logger(configure_logger(verbose, tensorboard_log, "actor_learner"))
+        if manager is None:
+            parameters = SharedParameters(model.actor)
+            for rank in range(n_actors):
+                handoff.put(parameters)
+        else:
+            parameters = actor_parameters
+        parameters.publish(model.actor)
+
+        transpose_keys = _image_keys_to_transpose(observation_space, model.observation_space)
+        replay_buffer = model.replay_buffer
+        episode_returns = deque(maxlen=100)
+        start_time = time.time()
+        last_log = start_time
+
+        def behind():
+            return (min_updates_per_step is not None and replay_buffer.size() >= learning_starts and
+                model._n_updates < min_updates_per_step * (model.num_timesteps - learning_starts))
+
+        while model.num_timesteps < total_timesteps or behind():
+            can_train = replay_buffer.size() >= learning_starts and (max_updates_per_step is None or
+                model._n_updates < max_updates_per_step * model.num_timesteps)
+            message = None
+            if model.num_timesteps < total_timesteps and not behind():
+                try:
+                    # wait for transitions only when there is nothing to train on
+                    message = transitions.get_nowait() if can_train else transitions.get(timeout=1.0)
+                except queue.Empty:
+                    if not can_train and len(actors) > 0 and not any(process.is_alive() for process in actors):
+                        raise RuntimeError("All actors exited")
+
+            if message is not None and message[0] == "transitions":
+                _, rank, chunk, returns = message
+                observations = _transpose_images(chunk["observations"], transpose_keys)
+                next_observations = _transpose_images(chunk["next_observations"], transpose_keys)
+                for i in range(len(chunk["rewards"])):
+                    replay_buffer.add(_slice_obs(observations, i, i+1), _slice_obs(next_observations, i, i+1),
+                        chunk["actions"][i:i+1], chunk["rewards"][i:i+1], chunk["dones"][i:i+1], [{}])
+                model.num_timesteps += len(chunk["rewards"])
+                episode_returns.extend(returns)
+                # at most one chunk per gradient step, so a full queue slows
+                #  the actors down rather than starving the learner
+
+            if can_train:
+                model._update_current_progress_remaining(model.num_timesteps, total_timesteps)
+                model.train(gradient_steps=1, batch_size=batch_size)
+                if model._n_updates % publish_interval == 0:
+                    parameters.publish(model.actor)
+
+            if verbose > 0 and time.time() - last_log >= 10:
+                last_log = time.time()
+                if len(episode_returns) > 0:
+                    model.logger.record("rollout/ep_rew_mean", float(np.mean(episode_returns)))
+                model.logger.record("time/fps", int(model.num_timesteps / (last_log - start_time)))
+                model.logger.record("time/updates_per_second", model._n_updates / (last_log - start_time))
+                model.logger.record("time/total_timesteps", model.num_timesteps)
+                model.logger.dump(step=model.num_timesteps)
+    finally:
+        stop.set()
+        # unblock actors waiting to put a chunk
+        deadline = time.time() + 30
+        while any(process.is_alive() for process in actors) and time.time() < deadline:
+            try:
+                transitions.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        for process in actors:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+        if manager is not None:
+            # give remote actors a moment to see the stop event
+            time.sleep(2)
+            manager.shutdown()
+
+    return model
+
+def model_filename(model_name, action_space, total_timesteps, priors):
+    # as in ddpg.py: model name + date + action space + training steps + priors
+    return model_name + "-" + datetime.now().strftime("%Y%m%d") + "-" + \
+        ",".join(map(str, action_space.low)) + "-" + ",".join(map(str, action_space.high)) + \
+        "-" + str(total_timesteps) + "-" + ".".join(priors)
+
+def main():
+    parser = argparse.ArgumentParser(description='Train DDPG with several actor processes, each stepping its own environment, that stream transitions to a learner training continuously.  (Example usage: "python actor_learner.py -l cube_stacking_model -m 2cubes -t 20000 --vector_obs -p COG HGT -n 4 -e <path to build>")')
+    parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='.', help='log directory')
+    parser.add_argument('--tb_name', '-b', metavar='TBNAME', default='.', help='TensorBoard path name')
+    parser.add_argument('--total_timesteps', '-t', metavar='TOTALTIMESTEPS', type=int, default=500, help='total timesteps over all actors')
+    parser.add_argument('--model_name', '-m', metavar='MODELNAME', default='ddpg_saved', help='name of model to save')
+    parser.add_argument('--visual_obs', action='store_true', default=False, help='use visual observations (leave blank to use both)')
+    parser.add_argument('--vector_obs', action='store_true', default=False, help='use vector observations (leave blank to use both)')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', required=True, help='set of priors to use: HGT = height; REL = relations; COG = center of gravity')
+    parser.add_argument('--n_actors', '-n', metavar='NACTORS', type=int, default=1, help='number of actor processes on this host, each with its own environment (requires --env_file or --sim if > 1)')
+    parser.add_argument('--env_file', '-e', metavar='ENVFILE', default=None, help='path to a Unity build of the environment (leave blank to connect to the Unity Editor)')
+    parser.add_argument('--worker_id', metavar='WORKERID', type=int, default=0, help='worker id of the first actor\'s environment')
+    parser.add_argument('--seed', metavar='SEED', type=int, default=0, help='base seed (actor i uses seed + i)')
+    parser.add_argument('--buffer_size', metavar='BUFFERSIZE', type=int, default=1000000, help='replay buffer size')
+    parser.add_argument('--publish_interval', metavar='UPDATES', type=int, default=50, help='gradient steps between sending the learner\'s policy to the actors')
+    parser.add_argument('--min_updates_per_step', metavar='RATIO', type=float, default=1.0, help='at least this many gradient steps per environment step, as model.learn takes 1; the actors wait while the learner catches up (0 = train only as fast as transitions arrive)')
+    parser.add_argument('--max_updates_per_step', metavar='RATIO', type=float, default=None, help='at most this many gradient steps per environment step (default: train continuously)')
+    parser.add_argument('--chunk_size', metavar='CHUNKSIZE', type=int, default=64, help='transitions per message from an actor; actors refresh their policy after each')
+    parser.add_argument('--address', metavar='HOST:PORT', default=None, help='serve the learner on this address so actors on other hosts can join; with --actor, the learner to join')
+    parser.add_argument('--authkey', metavar='AUTHKEY', default='stacker', help='shared secret of the learner and remote actors')
+    parser.add_argument('--actor', action='store_true', default=False, help='run a single remote actor for the learner at --address')
+    parser.add_argument('--fast', action='store_true', default=False, help='headless fast simulation (see ddpg.py)')
+    parser.add_argument('--sim', action='store_true', default=False, help='use the pure-Python stacking simulator instead of Unity')
+    parser.add_argument('--sim_objects', metavar='SIMOBJECTS', type=int, default=2, help='number of objects to stack in the simulator')
+
+    args = parser.parse_args()
+
+    priors = sorted(args.priors)
+    visual_obs = args.visual_obs
+    vector_obs = args.vector_obs
+    if not visual_obs and not vector_obs:
+        visual_obs = True
+        vector_obs = True
+    policy = "MultiInputPolicy" if visual_obs and vector_obs else "CnnPolicy" if visual_obs else "MlpPolicy"
+
+    env_kwargs = dict(visual_observation=visual_obs, vector_observation=vector_obs, priors=priors,
+        fast_simulation=args.fast)
+    if args.sim:
+        env_kwargs["backend"] = partial(StackerSimEnvironment, num_objects=args.sim_objects, priors=priors,
+            visual_observation=visual_obs, vector_observation=vector_obs)
+
+    if args.actor:
+        if args.address is None:
+            raise ValueError("--actor requires the --address of the learner")
+        manager = ActorLearnerManager(parse_address(args.address), authkey=args.authkey.encode())
+        manager.connect()
+        print("Joined the learner at %s" % args.address)
+        run_actor(args.worker_id, manager.get_transitions(), RemoteParameters(manager.get_parameter_server()),
+            manager.get_stop(), policy, environment_filename=args.env_file, worker_id=args.worker_id,
+            seed=args.seed, chunk_size=args.chunk_size, **env_kwargs)
+        return
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    start_time = time.time()
+    model = train_actor_learner(policy, args.total_timesteps, n_actors=args.n_actors,
+        environment_filename=args.env_file, start_worker_id=args.worker_id, seed=args.seed,
+        model_kwargs=dict(buffer_size=args.buffer_size, learning_rate=1e-4 if visual_obs else 1e-3),
+        publish_interval=args.publish_interval, min_updates_per_step=args.min_updates_per_step,
+        max_updates_per_step=args.max_updates_per_step,
+        chunk_size=args.chunk_size, address=args.address, authkey=args.authkey.encode(),
+        tensorboard_log="./" + args.tb_name + "/", **env_kwargs)
+    print("Done learning")
+    print("Training took %.4f seconds (%s timesteps, %s gradient steps)" % (time.time()-start_time,
+        model.num_timesteps, model._n_updates))
+
+    catalog = ModelCatalog(args.log_dir)
+    filename = catalog.unique_name(model_filename(args.model_name, model.action_space, args.total_timesteps, priors))
+    model.save(os.path.join(args.log_dir, filename))
+    catalog.add(filename)
+    print("Model saved at", os.path.join(args.log_dir, filename))
+
+if __name__ == "__main__":
+    main()
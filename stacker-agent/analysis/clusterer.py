@@ -35,6 +35,12 @@ def main():
     parser.add_argument('--elbow', action='store_true', default=False, help='use elbow k calculation')
     parser.add_argument('--silhouette', action='store_true', default=False, help='use silhouette k calculation')
     parser.add_argument('--mean', action='store_true', default=False, help='use mean of elbow and silhouette k calculation')
+    parser.add_argument('--epochs', metavar='EPOCHS', type=int, default=50, help='maximum number of training epochs (only meaningful if --retrain is true)')
+    parser.add_argument('--batch_size', metavar='BATCHSIZE', type=int, default=256, help='training mini-batch size (only meaningful if --retrain is true)')
+    parser.add_argument('--learning_rate', metavar='LR', type=float, default=0.003, help='initial learning rate, halved when the validation error plateaus (only meaningful if --retrain is true)')
+    parser.add_argument('--validation', metavar='FRACTION', type=float, default=0.1, help='fraction of the data held out to stop training early (only meaningful if --retrain is true)')
+    parser.add_argument('--compile', metavar='MODE', default=None, choices=['script', 'compile'], help='compile the autoencoder for embedding extraction with TorchScript (script) or torch.compile (compile)')
+    parser.add_argument('--patience', metavar='PATIENCE', type=int, default=10, help='epochs without validation improvement before training stops (only meaningful if --retrain is true)')
 
     args = parser.parse_args()
 
@@ -47,6 +53,12 @@ def main():
     elbow_k_calc = args.elbow
     silhouette_k_calc = args.silhouette
     mean_k_calc = args.mean
+    n_epochs = args.epochs
+    batch_size = args.batch_size
+    learning_rate = args.learning_rate
+    validation_fraction = args.validation
+    patience = args.patience
+    compile_mode = args.compile
     
     if not elbow_k_calc and not silhouette_k_calc and not mean_k_calc:
         elbow_k_calc = True
@@ -113,23 +125,28 @@ def main():
         nnet = nntorch.NeuralNetwork(n_in, hiddens, n_out, act_func_per_layer=act_funcs, device=device)
         
         start_time = time.time()
-        nnet.fit(X, X, 10000, 0.001, method='adam', verbose=True)
+        nnet.fit(X, X, n_epochs, learning_rate, method='adam', verbose=True, batch_size=batch_size,
+            validation_fraction=validation_fraction, patience=patience, lr_schedule='plateau', check_interval=1, seed=0)
         end_time = time.time()
         print("Training took %s sec." % (end_time-start_time))
-        plt.plot(nnet.error_trace)
+        plt.plot(nnet.error_trace, label='training')
+        if len(nnet.val_error_trace) > 0:
+            plt.plot(nnet.val_error_trace, label='validation')
+            plt.legend()
         plt.show()
         
+        nnet.prepare_inference(compile_mode)
         bottleneck = nnet.use_to_middle(X)
         print(bottleneck.shape)
         
         if modelpath is not None:
-            torch.save(nnet, modelpath)
+            nnet.save(modelpath)
     elif modelpath is not None:
-        nnet = torch.load(modelpath)
-        nnet.eval()
+        nnet = nntorch.load_network(modelpath)
         
         print(nnet)
     
+        nnet.prepare_inference(compile_mode)
         bottleneck = nnet.use_to_middle(X)
         print(bottleneck.shape)
             
@@ -1,9 +1,50 @@
+import argparse
+import copy
+import pickle
 import numpy as np
 import torch
 import pandas
 import matplotlib.pyplot as plt
 import time
 
+# samples per forward pass when streaming inputs of unknown length
+DEFAULT_BATCH_SIZE = 4096
+
+# version of the file format written by NeuralNetwork.save
+FORMAT_VERSION = 1
+
+class InferenceNetwork(torch.nn.Module):
+    '''Copy of a NeuralNetwork's layers for inference, with the input and output standardization
+    folded into the first and last Linear layers, so it maps raw inputs straight to raw outputs.
+    Without hidden layers, the middle layer output is the standardized input, so the input
+    standardization (Xmeans, Xstds) is applied by forward_to_middle_layer instead.'''
+
+    def __init__(self, hidden_layers, output_layer, Xmeans=None, Xstds=None):
+        super().__init__()
+        middle_layer = len(hidden_layers) // 2
+        self.middle_layers = torch.nn.ModuleList(hidden_layers[:middle_layer + 1])
+        self.rest_layers = torch.nn.ModuleList(hidden_layers[middle_layer + 1:])
+        self.output_layer = output_layer
+        self.standardize_input = Xmeans is not None
+        self.register_buffer('Xmeans', Xmeans.detach().clone() if Xmeans is not None else torch.zeros(0))
+        self.register_buffer('Xstds', Xstds.detach().clone() if Xstds is not None else torch.ones(0))
+
+    @torch.jit.export
+    def forward_to_middle_layer(self, X):
+        Y = X
+        if self.standardize_input:
+            Y = (Y - self.Xmeans) / self.Xstds
+        for hidden_layer in self.middle_layers:
+            Y = hidden_layer(Y)
+        return Y
+
+    def forward(self, X):
+        Y = self.forward_to_middle_layer(X)
+        for hidden_layer in self.rest_layers:
+            Y = hidden_layer(Y)
+        Y = self.output_layer(Y)
+        return Y
+
 class NeuralNetwork(torch.nn.Module):
     
     def __init__(self, n_inputs, n_hiddens_per_layer, n_outputs, act_func_per_layer, device='cpu'):
@@ -56,6 +97,9 @@ class NeuralNetwork(torch.nn.Module):
         self.Tstds = None
 
         self.error_trace = []
+        self._inference = None
+        # bumped whenever the weights change, to tell when the inference form is out of date
+        self._weights_version = 0
         
         self.device = device
         self.to(self.device)
@@ -74,7 +118,19 @@ class NeuralNetwork(torch.nn.Module):
         Y = self.output_layer(Y)
         return Y
 
-    def fit(self, X, T, n_epochs, learning_rate, method='adam', verbose=True, standardize='X T'):
+    def fit(self, X, T, n_epochs, learning_rate, method='adam', verbose=True, standardize='X T',
+            batch_size=None, validation_fraction=0, patience=None, lr_schedule=None, check_interval=None, seed=None):
+        '''Trains on shuffled mini-batches of batch_size samples (None = full batch).
+
+validation_fraction: fraction of the samples held out for validation.  With validation, training
+            ends with the weights of the best validation error, and stops early if it hasn't
+            improved for patience epochs (None = train for n_epochs).
+lr_schedule: None, 'cosine' (annealed to 0 over n_epochs) or 'plateau' (halved when the
+            validation error, or the training error without validation, hasn't improved for
+            max(1, patience // 2) epochs, or 10 without patience).
+check_interval: epochs between transfers of the errors from the device (default n_epochs // 100),
+            which is also how often the validation error is computed and patience is checked.
+        '''
 
         self.standardize = standardize
         
@@ -83,8 +139,10 @@ class NeuralNetwork(torch.nn.Module):
             X = torch.from_numpy(X).float().to(self.device)
         if not isinstance(T, torch.Tensor):
             T = torch.from_numpy(T).float().to(self.device)
+
+        X, T, Xval, Tval = self._split_validation(X, T, validation_fraction, seed)
             
-        # Calculate standardization parameters if not already calculated
+        # Calculate standardization parameters (on the training samples) if not already calculated
         if 'X' in self.standardize and self.Xmeans is None:
             self.Xmeans = X.mean(0)
             self.Xstds = X.std(0)
@@ -98,82 +156,355 @@ class NeuralNetwork(torch.nn.Module):
         # Standardize inputs and targets
         if 'X' in self.standardize:
             X = (X - self.Xmeans) / self.Xstds
+            if Xval is not None:
+                Xval = (Xval - self.Xmeans) / self.Xstds
         if 'T' in self.standardize:
             T = (T - self.Tmeans) / self.Tstds
-        
-        # Set optimizer to Adam and loss functions to MSELoss
+            if Tval is not None:
+                Tval = (Tval - self.Tmeans) / self.Tstds
+
+        # RMSE of the standardized outputs
+        self._train_loop(X, T, Xval, Tval, torch.nn.MSELoss(), torch.sqrt, 'RMSE', n_epochs, learning_rate,
+                         method, verbose, batch_size, patience, lr_schedule, check_interval, seed)
+
+    def _split_validation(self, X, T, validation_fraction, seed):
+        if not validation_fraction:
+            return X, T, None, None
+        generator = torch.Generator()
+        if seed is not None:
+            generator.manual_seed(seed)
+        n_val = max(1, int(round(X.shape[0] * validation_fraction)))
+        order = torch.randperm(X.shape[0], generator=generator).to(X.device)
+        return X[order[n_val:]], T[order[n_val:]], X[order[:n_val]], T[order[:n_val]]
+
+    def _train_loop(self, X, T, Xval, Tval, loss_func, error_func, error_name, n_epochs, learning_rate,
+                    method, verbose, batch_size, patience, lr_schedule, check_interval, seed):
+
+        # the optimizer updates the weights in place
+        self._weights_changed()
+
+        # Set optimizer to Adam or SGD, and the learning rate schedule
         if method == 'adam':
             optimizer = torch.optim.Adam(self.parameters(), lr=learning_rate)
         elif method == 'sgd':
             optimizer = torch.optim.SGD(self.parameters(), lr=learning_rate, momentum=0.5)
-        mse_func = torch.nn.MSELoss()
-
-        # For each epoch:
-        #   Do forward pass to calculate output Y.
-        #   Calculate mean squared error loss, mse.
-        #   Calculate gradient of mse with respect to all weights by calling mse.backward().
-        #   Take weight update step, then zero the gradient values.
-        #   Unstandardize the mse error and save in self.error_trace
-        #   Print epoch+1 and unstandardized error if verbose is True and
-        #             (epoch+1 is n_epochs or epoch+1 % (n_epochs // 10) == 0)
-        
-        for epoch in range(n_epochs):
 
-            Y = self(X)
-            
-            mse = mse_func(T, Y)
-            mse.backward()
-            
-            optimizer.step() 
-            optimizer.zero_grad()
-
-            err = torch.sqrt(mse)  # * self.Tstds
-            self.error_trace.append(err.item())  #.detach().cpu())
-
-            if verbose and ((epoch + 1) == n_epochs or (epoch + 1) % max(1, (n_epochs // 10)) == 0):
-                print(f'Epoch {epoch+1}: RMSE {err.item():.3f}')
-
-    def use(self, X):
- 
-        # Set input matrix to torch.tensors if not already.
-        if not isinstance(X, torch.Tensor):
-            X = torch.from_numpy(X).float().to(self.device)
-
-        # Standardize X
-
-        if 'X' in self.standardize:
-            X = (X - self.Xmeans) / self.Xstds
-        # Do forward pass and unstandardize resulting output
-        Y = self(X)
-        if 'T' in self.standardize:
-            Y = Y * self.Tstds + self.Tmeans
-
-        # Return output Y after detaching from computation graph and converting to numpy
-        return Y.detach().cpu().numpy()
-
-    def use_to_middle(self, X):
- 
-        # Set input matrix to torch.tensors if not already.
-        if not isinstance(X, torch.Tensor):
-            X = torch.from_numpy(X).float().to(self.device)
-
-        # Standardize X
-
-        if 'X' in self.standardize:
-            X = (X - self.Xmeans) / self.Xstds
+        if check_interval is None:
+            check_interval = max(1, n_epochs // 100)
+        checks_per_print = max(1, (n_epochs // 10) // check_interval)
+        scheduler = None
+        if lr_schedule == 'cosine':
+            scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, n_epochs)
+        elif lr_schedule == 'plateau':
+            lr_patience = max(1, patience // 2) if patience is not None else 10
+            scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(
+                optimizer, factor=0.5, patience=max(0, -(-lr_patience // check_interval) - 1))
+        elif lr_schedule is not None:
+            raise ValueError(f'Unknown lr_schedule {lr_schedule}')
+
+        n_samples = X.shape[0]
+        if batch_size is None or batch_size >= n_samples:
+            batch_size = n_samples
+        generator = None
+        if seed is not None:
+            generator = torch.Generator(device=X.device)
+            generator.manual_seed(seed)
+
+        # Per-epoch errors stay on the device until the next check, so training doesn't wait
+        #   for a transfer every epoch
+        epoch_losses = torch.zeros(check_interval, device=X.device)
+        self.val_error_trace = []
+        best_val_error = float('inf')
+        best_state = None
+        best_epoch = 0
 
-        # Do forward pass and unstandardize resulting output
-        Y = self.forward_to_middle_layer(X)
+        for epoch in range(n_epochs):
 
-        # Return output Y after detaching from computation graph and converting to numpy
-        return Y.detach().cpu().numpy()
+            # For each mini-batch of a random permutation of the samples:
+            #   Do forward pass to calculate output Y and the loss.
+            #   Calculate the gradient of the loss with respect to all weights, take a weight
+            #       update step, then zero the gradient values.
+            #   Accumulate the sample-weighted loss of the epoch on the device.
+            order = torch.randperm(n_samples, device=X.device, generator=generator) if batch_size < n_samples else None
+            epoch_loss = epoch_losses[epoch % check_interval]
+            epoch_loss.zero_()
+            for first in range(0, n_samples, batch_size):
+                if order is None:
+                    Xb, Tb = X, T
+                else:
+                    batch = order[first:first + batch_size]
+                    Xb, Tb = X[batch], T[batch]
+
+                Y = self(Xb)
+                loss = loss_func(Y, Tb)
+                loss.backward()
+
+                optimizer.step()
+                optimizer.zero_grad()
+
+                epoch_loss += loss.detach() * Xb.shape[0]
+            epoch_loss /= n_samples
+
+            if scheduler is not None and lr_schedule == 'cosine':
+                scheduler.step()
+
+            if (epoch + 1) % check_interval != 0 and (epoch + 1) != n_epochs:
+                continue
+
+            # Check: transfer the errors since the last check, and validate
+            n_checked = (epoch % check_interval) + 1
+            self.error_trace.extend(error_func(epoch_losses[:n_checked]).tolist())
+            check = (epoch + 1) // check_interval
+            message = f'Epoch {epoch+1}: {error_name} {self.error_trace[-1]:.3f}'
+
+            monitored_error = self.error_trace[-1]
+            if Xval is not None:
+                with torch.no_grad():
+                    val_error = error_func(loss_func(self(Xval), Tval)).item()
+                self.val_error_trace.append(val_error)
+                message += f' validation {val_error:.3f}'
+                monitored_error = val_error
+                if val_error < best_val_error:
+                    best_val_error = val_error
+                    best_epoch = epoch + 1
+                    best_state = {name: value.detach().clone() for name, value in self.state_dict().items()}
+
+            if scheduler is not None and lr_schedule == 'plateau':
+                scheduler.step(monitored_error)
+
+            stop = Xval is not None and patience is not None and (epoch + 1) - best_epoch >= patience
+            if verbose and (stop or (epoch + 1) == n_epochs or check % checks_per_print == 0):
+                print(message)
+            if stop:
+                if verbose:
+                    print(f'Stopping early: no improvement in validation {error_name} for {patience} epochs')
+                break
+
+        # Keep the weights with the best validation error
+        if best_state is not None:
+            self.load_state_dict(best_state)
+            if verbose:
+                print(f'Best validation {error_name} {best_val_error:.3f} at epoch {best_epoch}')
+        self.best_epoch = best_epoch if Xval is not None else n_epochs
+
+    def prepare_inference(self, compile=None):
+        '''Builds the inference form of the network used by use() and use_to_middle(): a copy
+of the layers with the standardization folded into the first and last Linear layers.
+
+compile: None, 'script' (TorchScript) or 'compile' (torch.compile) for both the full forward
+            pass and forward_to_middle_layer.
+
+It is rebuilt automatically (without compiling) when the weights or standardization
+parameters change by training, load_state_dict or moving the network (e.g., to()).  After
+changing parameters in place any other way, call prepare_inference again.'''
+
+        hidden_layers = copy.deepcopy(list(self.hidden_layers))
+        output_layer = copy.deepcopy(self.output_layer)
+        standardize_input = 'X' in self.standardize and self.Xmeans is not None
+
+        with torch.no_grad():
+            # W ((X - Xmeans) / Xstds) + b = (W / Xstds) X + (b - (W / Xstds) Xmeans)
+            if standardize_input and len(hidden_layers) > 0:
+                first_layer = hidden_layers[0][0]
+                first_layer.weight /= self.Xstds
+                first_layer.bias -= first_layer.weight @ self.Xmeans
+            # (W H + b) * Tstds + Tmeans = (Tstds W) H + (b * Tstds + Tmeans)
+            if 'T' in self.standardize and self.Tmeans is not None:
+                output_layer.weight *= self.Tstds.reshape(-1, 1)
+                output_layer.bias.mul_(self.Tstds).add_(self.Tmeans)
+
+        if standardize_input and len(hidden_layers) == 0:
+            network = InferenceNetwork(hidden_layers, output_layer, self.Xmeans, self.Xstds).eval()
+        else:
+            network = InferenceNetwork(hidden_layers, output_layer).eval()
+        for parameter in network.parameters():
+            parameter.requires_grad_(False)
+
+        if compile == 'script':
+            network = torch.jit.script(network)
+            forward, forward_to_middle_layer = network, network.forward_to_middle_layer
+        elif compile == 'compile':
+            forward, forward_to_middle_layer = torch.compile(network), torch.compile(network.forward_to_middle_layer)
+        elif compile is None:
+            forward, forward_to_middle_layer = network, network.forward_to_middle_layer
+        else:
+            raise ValueError(f'Unknown compile mode {compile}')
+
+        self._inference = (self._inference_key(), forward, forward_to_middle_layer)
+        return network
+
+    def _weights_changed(self):
+        self._weights_version = getattr(self, '_weights_version', 0) + 1
+
+    def load_state_dict(self, *args, **kwargs):
+        self._weights_changed()
+        return super().load_state_dict(*args, **kwargs)
+
+    def _apply(self, *args, **kwargs):
+        # to(), cuda(), float(), ... may replace the parameters
+        self._weights_changed()
+        return super()._apply(*args, **kwargs)
+
+    def _inference_key(self):
+        # walking parameters() on every use() would cost more than a small forward pass, so the
+        #   weights are tracked by _weights_version; the few standardization tensors are checked
+        stats = (self.Xmeans, self.Xstds, self.Tmeans, self.Tstds)
+        return (self.standardize, getattr(self, '_weights_version', 0),
+                tuple((id(stat), stat._version) for stat in stats if stat is not None))
+
+    def _inference_functions(self):
+        # models saved before the inference form was introduced lack _inference
+        inference = getattr(self, '_inference', None)
+        if inference is None or inference[0] != self._inference_key():
+            self.prepare_inference()
+            inference = self._inference
+        return inference[1], inference[2]
+
+    def config(self):
+        '''The constructor arguments of the network, read from its layers (so models pickled before
+the config existed have one too).'''
+        first_layer = self.hidden_layers[0][0] if len(self.hidden_layers) > 0 else self.output_layer
+        return {
+            'class': type(self).__name__,
+            'n_inputs': first_layer.in_features,
+            'n_hiddens_per_layer': [hidden_layer[0].out_features for hidden_layer in self.hidden_layers],
+            'n_outputs': self.output_layer.out_features,
+            # the activation modules' class names, lowercased, are the names the constructor takes
+            'act_func_per_layer': [type(hidden_layer[1]).__name__.lower() for hidden_layer in self.hidden_layers]
+        }
+
+    def save(self, path):
+        '''Saves the network as its config, standardization parameters, error trace and weights
+(a state_dict), without pickling any classes.  Load it with load_network.'''
+        torch.save(self.saved_state(), path)
+
+    def saved_state(self):
+        '''The dict of plain values and tensors that save writes, for saving the network inside
+another file.  Rebuild the network with network_from_saved_state.'''
+        stats = {name: getattr(self, name).detach().cpu() for name in ('Xmeans', 'Xstds', 'Tmeans', 'Tstds')
+                 if getattr(self, name) is not None}
+        return {
+            'format_version': FORMAT_VERSION,
+            'config': self.config(),
+            'standardize': self.standardize,
+            'stats': stats,
+            'error_trace': torch.tensor(self.error_trace, dtype=torch.float64),
+            'state_dict': {name: value.detach().cpu() for name, value in self.state_dict().items()}
+        }
+
+    def __getstate__(self):
+        # the inference form is rebuilt when needed, and scripted or compiled forms can't be pickled
+        state = self.__dict__.copy()
+        state['_inference'] = None
+        return state
+
+    def _input_chunks(self, X, batch_size):
+        '''Yields X in float32 chunks of up to batch_size rows on the device.  Array and memmap
+chunks are copied through one preallocated buffer, so only one chunk is in memory at a time;
+an iterator's rows (or arrays of rows) are gathered into full chunks.'''
+
+        if isinstance(X, torch.Tensor):
+            for first in range(0, X.shape[0], batch_size):
+                yield X[first:first + batch_size].float().to(self.device)
+            return
+
+        n_inputs = self.hidden_layers[0][0].in_features if len(self.hidden_layers) > 0 else self.output_layer.in_features
+        if hasattr(X, 'shape'):
+            batch_size = max(1, min(batch_size, X.shape[0]))
+        buffer = torch.empty((batch_size, n_inputs), dtype=torch.float32)
+        buffer_array = buffer.numpy()
+
+        if hasattr(X, 'shape'):
+            for first in range(0, X.shape[0], batch_size):
+                chunk = X[first:first + batch_size]
+                np.copyto(buffer_array[:len(chunk)], chunk, casting='unsafe')
+                yield buffer[:len(chunk)].to(self.device)
+            return
+
+        n_rows = 0
+        for rows in X:
+            rows = np.asarray(rows).reshape(-1, n_inputs)
+            while len(rows) > 0:
+                n_copied = min(batch_size - n_rows, len(rows))
+                np.copyto(buffer_array[n_rows:n_rows + n_copied], rows[:n_copied], casting='unsafe')
+                n_rows += n_copied
+                rows = rows[n_copied:]
+                if n_rows == batch_size:
+                    yield buffer.to(self.device)
+                    n_rows = 0
+        if n_rows > 0:
+            yield buffer[:n_rows].to(self.device)
+
+    def _output_chunks(self, X, batch_size, to_middle):
+        # Do forward passes through the network with the standardization folded in, which
+        #   returns unstandardized outputs
+        forward, forward_to_middle_layer = self._inference_functions()
+        forward = forward_to_middle_layer if to_middle else forward
+        for chunk in self._input_chunks(X, batch_size):
+            # not held across the yield, which would put the caller in inference mode
+            with torch.inference_mode():
+                Y = forward(chunk)
+            yield Y
+
+    def _n_outputs(self, to_middle):
+        if to_middle:
+            if len(self.hidden_layers) == 0:
+                # the middle layer output is the (standardized) input
+                return self.output_layer.in_features
+            return self.n_hiddens_per_layer[len(self.hidden_layers) // 2]
+        return self.output_layer.out_features
+
+    def _use(self, X, to_middle, batch_size, out):
+        if not hasattr(X, 'shape'):
+            batch_size = batch_size or DEFAULT_BATCH_SIZE
+        elif len(X.shape) == 1:
+            # a single sample
+            return self._use(X.reshape(1, -1), to_middle, None, None)[0]
+        elif batch_size is None:
+            batch_size = max(1, X.shape[0])
+
+        if out is None and hasattr(X, 'shape'):
+            out = np.empty((X.shape[0], self._n_outputs(to_middle)), dtype=np.float32)
+        if out is None:
+            # an iterator of unknown length
+            return np.concatenate([Y.cpu().numpy() for Y in self._output_chunks(X, batch_size, to_middle)])
+
+        n_rows = 0
+        for Y in self._output_chunks(X, batch_size, to_middle):
+            if n_rows + Y.shape[0] > out.shape[0]:
+                raise ValueError(f'out has {out.shape[0]} rows, but there are more inputs')
+            out[n_rows:n_rows + Y.shape[0]] = Y.cpu().numpy()
+            n_rows += Y.shape[0]
+        return out[:n_rows]
+
+    def use(self, X, batch_size=None, out=None):
+        '''Returns the outputs for X: an array (or memmap, or tensor) with one sample per row, or an
+iterator of samples or arrays of samples.
+
+batch_size: samples per forward pass (default: all samples of an array at once, and
+            DEFAULT_BATCH_SIZE for iterators).  Memory use is bounded by batch_size, plus the
+            returned outputs.
+out: preallocated array (e.g., a memmap) to write the outputs to; returns the part written.'''
+        return self._use(X, False, batch_size, out)
+
+    def use_to_middle(self, X, batch_size=None, out=None):
+        '''Returns the outputs of the middle hidden layer for X (see use).'''
+        return self._use(X, True, batch_size, out)
+
+    def use_chunks(self, X, batch_size=DEFAULT_BATCH_SIZE, to_middle=False):
+        '''Yields the outputs (or middle layer outputs) for X (see use) lazily, one chunk of up to
+batch_size samples at a time.'''
+        for Y in self._output_chunks(X, batch_size, to_middle):
+            yield Y.cpu().numpy()
     
 
 ######################################################################
 
 class NeuralNetwork_Classifier(NeuralNetwork):
     
-    def train(self, X, T, n_epochs, learning_rate, method='adam', verbose=True, standardize='X'):
+    def train(self, X, T, n_epochs, learning_rate, method='adam', verbose=True, standardize='X',
+              batch_size=None, validation_fraction=0, patience=None, lr_schedule=None, check_interval=None, seed=None):
+        '''Trains like NeuralNetwork.fit, with the cross-entropy loss.'''
 
         # T must be long ints
         # self.classes = np.unique(T)
@@ -185,47 +516,24 @@ class NeuralNetwork_Classifier(NeuralNetwork):
             X = torch.from_numpy(X).float().to(self.device)
         if not isinstance(T, torch.Tensor):
             T = torch.from_numpy(T).long().to(self.device)
+
+        X, T, Xval, Tval = self._split_validation(X, T, validation_fraction, seed)
             
-        # Calculate standardization parameters if not already calculated
+        # Calculate standardization parameters (on the training samples) if not already calculated
         if 'X' in self.standardize and self.Xmeans is None:
             self.Xmeans = X.mean(0)
             self.Xstds = X.std(0)
             self.Xstds[self.Xstds == 0] = 1
-
-        # if 'T' in self.standardize and self.Tmeans is None:
-        #     self.Tmeans = T.mean(0)
-        #     self.Tstds = T.std(0)
-        #     self.Tstds[self.Tstds == 0] = 1
             
-        # Standardize inputs and targets
+        # Standardize inputs
         if 'X' in self.standardize:
             X = (X - self.Xmeans) / self.Xstds
-        # if 'T' in self.standardize:
-        #     T = (T - self.Tmeans) / self.Tstds
-        
-        # Set optimizer to Adam and loss functions to MSELoss
-        if method == 'adam':
-            optimizer = torch.optim.Adam(self.parameters(), lr=learning_rate)
-        elif method == 'sgd':
-            optimizer = torch.optim.SGD(self.parameters(), lr=learning_rate, momentum=0.5)
+            if Xval is not None:
+                Xval = (Xval - self.Xmeans) / self.Xstds
 
         CE_func = torch.nn.CrossEntropyLoss(reduction='mean')
-        
-        for epoch in range(n_epochs):
-
-            Y = self(X)
-                        
-            ce = CE_func(Y, T)
-            ce.backward()
-            
-            optimizer.step() 
-            optimizer.zero_grad()
-
-            err = ce
-            self.error_trace.append(err.item())  #.detach().cpu())
-
-            if verbose and ((epoch + 1) == n_epochs or (epoch + 1) % (n_epochs // 10) == 0):
-                print(f'Epoch {epoch+1}: RMSE {err.item():.3f}')
+        self._train_loop(X, T, Xval, Tval, CE_func, lambda ce: ce, 'CE', n_epochs, learning_rate,
+                         method, verbose, batch_size, patience, lr_schedule, check_interval, seed)
 
         return self
 
@@ -238,14 +546,269 @@ class NeuralNetwork_Classifier(NeuralNetwork):
         Y = expY / denom
         return Y
 
-    def use(self, X):
-        # Set input matrix to torch.tensors if not already.
-        if not isinstance(X, torch.Tensor):
-            X = torch.from_numpy(X).float().to(self.device)
+    def _output_chunks(self, X, batch_size, to_middle):
+        if to_middle:
+            yield from super()._output_chunks(X, batch_size, to_middle)
+            return
+        # the logits of the inference form, which standardizes the inputs
+        forward = self._inference_functions()[0]
+        for chunk in self._input_chunks(X, batch_size):
+            with torch.inference_mode():
+                probs = self.softmax(forward(chunk))
+            yield probs
+
+    def use(self, X, batch_size=None, out=None):
+        '''Returns the classes and class probabilities for X, in chunks of batch_size samples (see
+NeuralNetwork.use).  out: preallocated (classes, probs) arrays to write to.'''
+
+        if hasattr(X, 'shape') and batch_size is None:
+            batch_size = max(1, X.shape[0])
+        elif batch_size is None:
+            batch_size = DEFAULT_BATCH_SIZE
+        if out is None and hasattr(X, 'shape'):
+            out = (np.empty((X.shape[0],), dtype=np.int64),
+                   np.empty((X.shape[0], self.output_layer.out_features), dtype=np.float32))
+        if out is None:
+            chunks = list(self.use_chunks(X, batch_size))
+            return (np.concatenate([classes for classes, _ in chunks]),
+                    np.concatenate([probs for _, probs in chunks]))
+
+        classes, probs = out
+        n_rows = 0
+        for chunk_classes, chunk_probs in self.use_chunks(X, batch_size):
+            if n_rows + len(chunk_classes) > len(classes):
+                raise ValueError(f'out has {len(classes)} rows, but there are more inputs')
+            classes[n_rows:n_rows + len(chunk_classes)] = chunk_classes
+            probs[n_rows:n_rows + len(chunk_classes)] = chunk_probs
+            n_rows += len(chunk_classes)
+        return classes[:n_rows], probs[:n_rows]
+
+    def use_chunks(self, X, batch_size=DEFAULT_BATCH_SIZE, to_middle=False):
+        '''Yields the classes and class probabilities for X lazily, one chunk at a time (see
+NeuralNetwork.use_chunks; to_middle yields middle layer outputs instead).'''
+        if to_middle:
+            yield from super().use_chunks(X, batch_size, to_middle=True)
+            return
+        for probs in self._output_chunks(X, batch_size, False):
+            yield torch.argmax(probs, axis=1).cpu().numpy(), probs.cpu().numpy()
+
+
+######################################################################
+
+def _masked_standardization(Xs, mask):
+    # per-member means and (unbiased) standard deviations over each member's own samples
+    n = mask.sum(1, keepdim=True).unsqueeze(-1)
+    weights = mask.unsqueeze(-1)
+    means = (Xs * weights).sum(1, keepdim=True) / n
+    stds = torch.sqrt((((Xs - means) * weights) ** 2).sum(1, keepdim=True) / (n - 1).clamp(min=1))
+    stds[stds == 0] = 1
+    return means, stds
+
+def train_ensemble(make_network, X, T, n_epochs, learning_rate, seeds, subsets=None, method='adam',
+                   verbose=True, standardize=None, batch_size=None, check_interval=None):
+    '''Trains len(seeds) networks built by make_network() (all with the same architecture) at once:
+their parameters are stacked, and every forward and backward pass runs on all of them together
+(torch.func.vmap), so an ensemble or a grid of experiments costs about as much as one training
+run of a network as wide as all of them.
+
+Member k is initialized with torch.manual_seed(seeds[k]) and trains on the samples subsets[k]
+(indices into X and T; default all samples), with its own standardization parameters, like
+NeuralNetwork.fit (or NeuralNetwork_Classifier.train if make_network builds classifiers) with
+the same arguments.  Since Adam and SGD update each weight independently, members trained on
+subsets of the same size end up as if trained separately; a member with fewer samples than the
+largest subset gets batches with no samples at the end of each epoch (shuffled mini-batches),
+which still apply the optimizer's momentum.  Shuffling uses seeds[0].
+
+The layers must be ones vmap can batch, which excludes the 'rrelu' activation (its random
+slopes have no batched implementation); a ValueError is raised before training otherwise.
+
+Returns the trained networks, each with its own error_trace.'''
+
+    from torch.func import functional_call, stack_module_state, vmap
+
+    n_members = len(seeds)
+    members = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        members.append(make_network())
+    if any(isinstance(module, torch.nn.RReLU) for module in members[0].modules()):
+        raise ValueError('train_ensemble cannot train networks with rrelu activations, which '
+                         'torch.func.vmap does not support; use leakyrelu or train them one by one')
+    classifier = isinstance(members[0], NeuralNetwork_Classifier)
+    if standardize is None:
+        standardize = 'X' if classifier else 'X T'
+    device = members[0].device
+
+    # Set data matrices to torch.tensors if not already.
+    if not isinstance(X, torch.Tensor):
+        X = torch.from_numpy(X).float()
+    if not isinstance(T, torch.Tensor):
+        T = torch.from_numpy(T).long() if classifier else torch.from_numpy(T).float()
+    X, T = X.to(device), T.to(device)
+
+    # Pad every member's samples to the size of the largest subset; mask marks real samples
+    if subsets is None:
+        subsets = [np.arange(X.shape[0])] * n_members
+    subsets = [torch.as_tensor(np.asarray(subset), dtype=torch.long, device=device) for subset in subsets]
+    n_max = max(len(subset) for subset in subsets)
+    padded = torch.stack([torch.cat([subset, subset.new_zeros(n_max - len(subset))]) for subset in subsets])
+    mask = (torch.arange(n_max, device=device) < torch.tensor([len(subset) for subset in subsets], device=device).unsqueeze(1)).float()
+    Xs, Ts = X[padded], T[padded]
+
+    # Standardize inputs and targets per member, and store the parameters in the members
+    if 'X' in standardize:
+        Xmeans, Xstds = _masked_standardization(Xs, mask)
+        Xs = (Xs - Xmeans) / Xstds
+    if 'T' in standardize and not classifier:
+        Tmeans, Tstds = _masked_standardization(Ts, mask)
+        Ts = (Ts - Tmeans) / Tstds
+    for k, member in enumerate(members):
+        member.standardize = standardize
+        if 'X' in standardize:
+            member.Xmeans, member.Xstds = Xmeans[k, 0], Xstds[k, 0]
+        if 'T' in standardize and not classifier:
+            member.Tmeans, member.Tstds = Tmeans[k, 0], Tstds[k, 0]
+
+    # Stack the members' parameters and run the forward pass of all members in one call
+    params, buffers = stack_module_state(members)
+    base = copy.deepcopy(members[0]).to('meta')
+    def member_forward(member_params, member_buffers, Xb):
+        return functional_call(base, (member_params, member_buffers), (Xb,))
+    ensemble_forward = vmap(member_forward, randomness='different')
+
+    if method == 'adam':
+        optimizer = torch.optim.Adam(params.values(), lr=learning_rate)
+    elif method == 'sgd':
+        optimizer = torch.optim.SGD(params.values(), lr=learning_rate, momentum=0.5)
+
+    def member_losses(Y, Tb, weights):
+        if classifier:
+            losses = torch.nn.functional.cross_entropy(Y.reshape(-1, Y.shape[-1]), Tb.reshape(-1), reduction='none')
+            losses = losses.reshape(Tb.shape)
+        else:
+            losses = ((Y - Tb) ** 2).mean(-1)
+        return (losses * weights).sum(1), weights.sum(1)
+
+    if check_interval is None:
+        check_interval = max(1, n_epochs // 100)
+    if batch_size is None or batch_size >= n_max:
+        batch_size = n_max
+    generator = torch.Generator(device=device)
+    generator.manual_seed(seeds[0])
+    members_range = torch.arange(n_members, device=device).unsqueeze(1)
+    epoch_losses = torch.zeros((check_interval, n_members), device=device)
+    error_traces = [[] for _ in range(n_members)]
+
+    for epoch in range(n_epochs):
+
+        # Shuffle each member's own samples, with the padding at the end
+        if batch_size < n_max:
+            keys = torch.rand((n_members, n_max), device=device, generator=generator) + (1 - mask) * 2
+            order = torch.argsort(keys, dim=1)
+
+        epoch_loss = epoch_losses[epoch % check_interval]
+        epoch_loss.zero_()
+        for first in range(0, n_max, batch_size):
+            if batch_size < n_max:
+                batch = order[:, first:first + batch_size]
+                Xb, Tb, weights = Xs[members_range, batch], Ts[members_range, batch], mask[members_range, batch]
+            else:
+                Xb, Tb, weights = Xs, Ts, mask
 
-        Y = self.forward(X)
-        probs = self.softmax(Y)  # .detach().cpu().numpy()
-        classes = torch.argmax(probs, axis=1)  # .detach().cpu().numpy()
-        return (classes.detach().cpu().numpy(),
-                probs.detach().cpu().numpy())
+            Y = ensemble_forward(params, buffers, Xb)
+            loss_sums, counts = member_losses(Y, Tb, weights)
+            # the mean loss of each member; summing them keeps the members' gradients separate
+            (loss_sums / counts.clamp(min=1)).sum().backward()
+
+            optimizer.step()
+            optimizer.zero_grad()
+
+            epoch_loss += loss_sums.detach()
+        epoch_loss /= mask.sum(1)
+
+        if (epoch + 1) % check_interval != 0 and (epoch + 1) != n_epochs:
+            continue
+
+        n_checked = (epoch % check_interval) + 1
+        errors = epoch_losses[:n_checked] if classifier else torch.sqrt(epoch_losses[:n_checked])
+        for k, member_errors in enumerate(errors.T.tolist()):
+            error_traces[k].extend(member_errors)
+        if verbose and ((epoch + 1) == n_epochs or (epoch + 1) % max(1, (n_epochs // 10)) < n_checked):
+            errors = np.array([trace[-1] for trace in error_traces])
+            print(f'Epoch {epoch+1}: {"CE" if classifier else "RMSE"} mean {errors.mean():.3f} '
+                  f'(min {errors.min():.3f}, max {errors.max():.3f})')
+
+    # Unstack the parameters into the members
+    for k, member in enumerate(members):
+        member.load_state_dict({name: value[k].detach().clone() for name, value in list(params.items()) + list(buffers.items())})
+        member.error_trace.extend(error_traces[k])
+    return members
+
+
+######################################################################
 
+NETWORK_CLASSES = {cls.__name__: cls for cls in (NeuralNetwork, NeuralNetwork_Classifier)}
+
+def load_network(path, device='cpu', mmap=True):
+    '''Loads a network saved by NeuralNetwork.save, without unpickling any classes.  With mmap (on
+the CPU), the weights are memory-mapped from the file and only read when used, and the network
+is built without initializing weights first.  Pickled networks (torch.save(nnet, path)) must be
+converted first (see convert_pickled_network).'''
+
+    mmap = mmap and torch.device(device).type == 'cpu'
+    try:
+        saved = torch.load(path, map_location=device, weights_only=True, mmap=mmap)
+    except pickle.UnpicklingError as e:
+        raise ValueError(f'{path} is a pickled network; convert it with '
+                         f'"python neuralnetworks_torch.py {path}" (only for files you trust)') from e
+    if not isinstance(saved, dict) or 'format_version' not in saved:
+        raise ValueError(f'{path} is not a network saved by NeuralNetwork.save')
+    return network_from_saved_state(saved, device)
+
+def network_from_saved_state(saved, device='cpu'):
+    '''Builds the network whose NeuralNetwork.saved_state is saved, on device.'''
+
+    if saved['format_version'] > FORMAT_VERSION:
+        raise ValueError(f'Network has format version {saved["format_version"]}; '
+                         f'this version of neuralnetworks_torch reads up to {FORMAT_VERSION}')
+
+    config = dict(saved['config'])
+    cls = NETWORK_CLASSES[config.pop('class')]
+    # layers built on the meta device aren't initialized and take no memory; the saved
+    #   weights replace their parameters
+    with torch.device('meta'):
+        nnet = cls(**config, device='meta')
+    nnet.load_state_dict(saved['state_dict'], assign=True)
+    nnet.device = device
+    nnet.to(device)
+
+    nnet.standardize = saved['standardize']
+    for name, value in saved['stats'].items():
+        setattr(nnet, name, value.to(device))
+    nnet.error_trace = saved['error_trace'].tolist()
+    return nnet
+
+def convert_pickled_network(path, output_path=None):
+    '''Converts a network pickled with torch.save(nnet, path) to the format of NeuralNetwork.save,
+in place unless output_path is given.  Unpickling runs arbitrary code, so only convert files you
+trust.'''
+    nnet = torch.load(path, map_location='cpu', weights_only=False)
+    nnet.save(path if output_path is None else output_path)
+    return nnet
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert networks pickled with torch.save(nnet, path) to the state_dict format of NeuralNetwork.save, which load_network reads without unpickling.  (Example usage: "python neuralnetworks_torch.py autoencoders/3_obj_modelC.pt")')
+    parser.add_argument('paths', metavar='PATH', type=str, nargs='+', help='pickled network files (converted in place; only convert files you trust)')
+    parser.add_argument('--output', '-o', metavar='OUTPUT', default=None, help='file name to save the converted network to (one input file only)')
+
+    args = parser.parse_args()
+
+    if args.output is not None and len(args.paths) > 1:
+        raise ValueError('--output requires a single input file')
+    for path in args.paths:
+        output_path = args.output if args.output is not None else path
+        convert_pickled_network(path, output_path)
+        print('Converted', path, 'to', output_path)
+
+if __name__ == "__main__":
+    main()
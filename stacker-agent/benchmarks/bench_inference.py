@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "analysis"))
+import neuralnetworks_torch as nntorch
+
+def time_calls(function, n_calls):
+    function()
+    start_time = time.perf_counter()
+    for _ in range(n_calls):
+        function()
+    return (time.perf_counter() - start_time) / n_calls
+
+def parameter_walk(nnet):
+    # how use() used to tell whether the inference form was out of date
+    return tuple((id(tensor), tensor._version) for tensor in nnet.parameters())
+
+def bench_inference(n_inputs, n_hiddens, n_outputs, batch_sizes, n_calls, seed=0):
+    """Times the check of whether a trained network's inference form is out of
+    date (the current version counter, and a walk over the parameters), and
+    use() against the eager forward pass on standardized inputs for each batch
+    size.  Returns (counter seconds, walk seconds, {batch size : (use seconds,
+    eager seconds)})."""
+    rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    nnet = nntorch.NeuralNetwork(n_inputs, n_hiddens, n_outputs, ['tanh'] * len(n_hiddens))
+    X = rng.normal(size=(max(batch_sizes), n_inputs)).astype(np.float32)
+    nnet.fit(X, rng.normal(size=(len(X), n_outputs)).astype(np.float32), 5, 0.01, verbose=False)
+
+    key_time = time_calls(nnet._inference_key, n_calls)
+    walk_time = time_calls(lambda: parameter_walk(nnet), n_calls)
+
+    def eager(Xb):
+        with torch.no_grad():
+            Y = nnet.forward((torch.from_numpy(Xb) - nnet.Xmeans) / nnet.Xstds)
+            return (Y * nnet.Tstds + nnet.Tmeans).numpy()
+
+    use_times = {}
+    for batch_size in batch_sizes:
+        Xb = X[:batch_size]
+        use_times[batch_size] = (time_calls(lambda: nnet.use(Xb), n_calls), time_calls(lambda: eager(Xb), n_calls))
+    return key_time, walk_time, use_times
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark NeuralNetwork.use (standardization folded into the layers, inference form cached) against the eager forward pass.  (Example usage: "python benchmarks/bench_inference.py -n 2000")')
+    parser.add_argument('--calls', '-n', metavar='CALLS', type=int, default=2000, help='calls to time per measurement')
+    parser.add_argument('--batch_sizes', metavar='BATCHSIZES', type=int, nargs='+', default=[1, 64, 4096], help='samples per call')
+    parser.add_argument('--hiddens', metavar='HIDDENS', type=int, nargs='+', default=[64, 64, 64], help='units per hidden layer')
+
+    args = parser.parse_args()
+
+    key_time, walk_time, use_times = bench_inference(8, args.hiddens, 4, args.batch_sizes, args.calls)
+    print("out-of-date check: %.1f us (version counter), %.1f us (parameter walk)" % (key_time*1e6, walk_time*1e6))
+    print("\n%-12s %12s %14s" % ("batch size", "use us/call", "eager us/call"))
+    for batch_size, (use_time, eager_time) in use_times.items():
+        print("%-12s %12.1f %14.1f" % (batch_size, use_time*1e6, eager_time*1e6))
+
+if __name__ == "__main__":
+    main()
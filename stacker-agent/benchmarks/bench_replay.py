@@ -0,0 +1,117 @@
+import argparse
+import os
+import sys
+import time
+from functools import partial
+
+import numpy as np
+from gym import spaces
+from stable_baselines3 import DDPG
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.noise import NormalActionNoise
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+from prioritized_replay import PrioritizedDDPG, PrioritizedReplayBuffer
+from evaluate import run_episodes
+
+def bench_sampling(buffer_size, batch_size=100, n_batches=1000, obs_dim=3, seed=0):
+    """Times sampling a batch from a full uniform ReplayBuffer and from a full
+    PrioritizedReplayBuffer (plus updating the batch's priorities).  Returns
+    (uniform seconds per batch, prioritized seconds per batch)."""
+    observation_space = spaces.Box(-1, 1, shape=(obs_dim,), dtype=np.float32)
+    action_space = spaces.Box(-1, 1, shape=(2,), dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+
+    times = []
+    for buffer_cls in [ReplayBuffer, PrioritizedReplayBuffer]:
+        buffer = buffer_cls(buffer_size, observation_space, action_space, device="cpu")
+        buffer.observations[:] = rng.uniform(-1, 1, size=buffer.observations.shape)
+        buffer.next_observations[:] = rng.uniform(-1, 1, size=buffer.next_observations.shape)
+        buffer.full = True
+        prioritized = isinstance(buffer, PrioritizedReplayBuffer)
+        if prioritized:
+            buffer.update_priorities(np.arange(buffer_size), rng.exponential(size=buffer_size))
+        td_errors = rng.exponential(size=(n_batches, batch_size))
+
+        start_time = time.perf_counter()
+        for i in range(n_batches):
+            samples = buffer.sample(batch_size)
+            if prioritized:
+                buffer.update_priorities(samples.indices, td_errors[i])
+        times.append((time.perf_counter() - start_time) / n_batches)
+
+    return tuple(times)
+
+def samples_to_solve(algorithm, seed, threshold, max_timesteps, eval_interval, eval_episodes, priors, sim_objects):
+    """Trains algorithm (DDPG or PrioritizedDDPG) on the simulator and
+    evaluates it every eval_interval steps on eval_episodes episodes.  Returns
+    the number of environment steps after which the mean evaluation return
+    first reached threshold, or None if it didn't within max_timesteps."""
+    def make_env(env_seed):
+        backend = partial(StackerSimEnvironment, num_objects=sim_objects, priors=priors,
+            visual_observation=False, vector_observation=True)
+        return StackerEnv(vector_observation=True, priors=priors, backend=backend, seed=env_seed)
+
+    env = make_env(seed)
+    eval_env = make_env(seed + 10000)
+    n_actions = env.action_space.shape[-1]
+    action_noise = NormalActionNoise(mean=np.zeros(n_actions), sigma=0.1 * np.ones(n_actions))
+    model = algorithm("MlpPolicy", env, learning_rate=1e-3, action_noise=action_noise, seed=seed, verbose=0)
+
+    solved_at = None
+    while model.num_timesteps < max_timesteps:
+        model.learn(total_timesteps=eval_interval, reset_num_timesteps=model.num_timesteps == 0)
+        returns, lengths, step_rewards = run_episodes(eval_env, model, eval_episodes)
+        if returns.mean() >= threshold:
+            solved_at = model.num_timesteps
+            break
+
+    env.close()
+    eval_env.close()
+    return solved_at
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prioritized against uniform experience replay: batch sampling time by buffer size, and environment steps until DDPG solves the stacking simulator.  (Example usage: "python benchmarks/bench_replay.py -s 0 1 2 -t 5000")')
+    parser.add_argument('--buffer_sizes', metavar='BUFFERSIZES', type=int, nargs='+', default=[10000, 100000, 1000000], help='buffer sizes to time sampling on')
+    parser.add_argument('--batch_size', metavar='BATCHSIZE', type=int, default=100, help='sampled batch size')
+    parser.add_argument('--seeds', '-s', metavar='SEEDS', type=int, nargs='+', default=[0, 1, 2], help='training seeds')
+    parser.add_argument('--max_timesteps', '-t', metavar='MAXTIMESTEPS', type=int, default=5000, help='training budget per run')
+    parser.add_argument('--eval_interval', metavar='EVALINTERVAL', type=int, default=250, help='training steps between evaluations')
+    parser.add_argument('--eval_episodes', '-E', metavar='EPISODES', type=int, default=20, help='episodes per evaluation')
+    parser.add_argument('--threshold', metavar='THRESHOLD', type=float, default=500.0, help='mean evaluation return at which a run counts as solved')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', default=['COG','HGT'], help='set of priors to use: HGT = height; REL = relations; COG = center of gravity')
+    parser.add_argument('--sim_objects', metavar='SIMOBJECTS', type=int, default=2, help='number of objects to stack in the simulator')
+    parser.add_argument('--skip_training', action='store_true', default=False, help='only benchmark sampling')
+
+    args = parser.parse_args()
+    priors = sorted(args.priors)
+
+    print("%-12s %16s %20s" % ("buffer size", "uniform us/batch", "prioritized us/batch"))
+    for buffer_size in args.buffer_sizes:
+        uniform_time, prioritized_time = bench_sampling(buffer_size, args.batch_size)
+        print("%-12s %16.1f %20.1f" % (buffer_size, uniform_time*1e6, prioritized_time*1e6))
+
+    if args.skip_training:
+        return
+
+    print("\n%-12s %6s %16s" % ("replay", "seed", "samples to solve"))
+    results = {}
+    for name, algorithm in [("uniform", DDPG), ("prioritized", PrioritizedDDPG)]:
+        results[name] = []
+        for seed in args.seeds:
+            solved_at = samples_to_solve(algorithm, seed, args.threshold, args.max_timesteps,
+                args.eval_interval, args.eval_episodes, priors, args.sim_objects)
+            results[name].append(solved_at)
+            print("%-12s %6s %16s" % (name, seed, solved_at if solved_at is not None else "> %s" % args.max_timesteps))
+
+    print("\n%-12s %8s %24s" % ("replay", "solved", "median samples to solve"))
+    for name, solved in results.items():
+        # unsolved runs count as the whole budget
+        steps = [s if s is not None else args.max_timesteps for s in solved]
+        print("%-12s %5s/%-2s %24.0f" % (name, sum(s is not None for s in solved), len(solved), np.median(steps)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from functools import partial
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+
+def bench_step(n_steps, priors, visual_obs, vector_obs, compact_visual_obs, seed=0):
+    """Times StackerEnv.step on the simulator backend and measures the memory
+    allocated per step.  Returns (mean seconds per step, mean peak bytes
+    allocated per step)."""
+    backend = partial(StackerSimEnvironment, priors=priors,
+        visual_observation=visual_obs, vector_observation=vector_obs, seed=seed)
+
+    env = StackerEnv(visual_observation=visual_obs, vector_observation=vector_obs,
+        priors=priors, backend=backend, compact_visual_obs=compact_visual_obs)
+    env.reset()
+    rng = np.random.default_rng(seed)
+    actions = rng.uniform(450, 550, size=(n_steps, 2)).astype(np.float32)
+
+    start_time = time.perf_counter()
+    for action in actions:
+        env.step(action)
+    step_time = (time.perf_counter() - start_time) / n_steps
+
+    tracemalloc.start()
+    peaks = []
+    for action in actions[:min(n_steps, 200)]:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        env.step(action)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - base)
+    tracemalloc.stop()
+
+    env.close()
+
+    return step_time, float(np.mean(peaks))
+
+def bench_obs_path(n_steps, priors, visual_obs, vector_obs, compact_visual_obs, seed=0):
+    """Times converting one batch of Unity observations into the observation
+    returned by StackerEnv, which is the part of step() that StackerEnv itself
+    controls.  Returns (mean seconds per conversion, peak bytes allocated by
+    one conversion)."""
+    backend = partial(StackerSimEnvironment, priors=priors,
+        visual_observation=visual_obs, vector_observation=vector_obs, seed=seed)
+
+    env = StackerEnv(visual_observation=visual_obs, vector_observation=vector_obs,
+        priors=priors, backend=backend, compact_visual_obs=compact_visual_obs)
+    decision_steps, _ = env._env.get_steps(env.behavior_name)
+    step_obs = decision_steps.obs
+    buffers = env._new_obs_buffers()
+
+    start_time = time.perf_counter()
+    for _ in range(n_steps):
+        env._fill_obs(step_obs, 0, buffers)
+    fill_time = (time.perf_counter() - start_time) / n_steps
+
+    tracemalloc.start()
+    env._fill_obs(step_obs, 0, buffers)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    env.close()
+    return fill_time, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark StackerEnv.step on the stacking simulator, with compact (uint8) and float32 visual observations.  (Example usage: "python benchmarks/bench_step.py -s 2000")')
+    parser.add_argument('--steps', '-s', metavar='STEPS', default=2000, help='number of steps to time')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', default=['COG','HGT'], help='set of priors to use: HGT = height; REL = relations; COG = center of gravity')
+
+    args = parser.parse_args()
+    n_steps = int(args.steps)
+    priors = sorted(args.priors)
+
+    print("%-16s %-8s %14s %18s %14s %18s" % ("observations", "visual", "us/step", "peak bytes/step", "us/obs", "peak bytes/obs"))
+    for visual_obs, vector_obs, name in [(True, True, "visual+vector"), (True, False, "visual"), (False, True, "vector")]:
+        for compact in ([True, False] if visual_obs else [True]):
+            step_time, step_peak = bench_step(n_steps, priors, visual_obs, vector_obs, compact)
+            obs_time, obs_peak = bench_obs_path(n_steps, priors, visual_obs, vector_obs, compact)
+            print("%-16s %-8s %14.1f %18.0f %14.1f %18.0f" % (name, ("uint8" if compact else "float32") if visual_obs else "-",
+                step_time*1e6, step_peak, obs_time*1e6, obs_peak))
+
+if __name__ == "__main__":
+    main()
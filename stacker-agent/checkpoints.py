@@ -0,0 +1,104 @@
+import json
+import os
+import time
+
+from stable_baselines3 import DDPG
+from stable_baselines3.common.callbacks import BaseCallback
+
+# a checkpoint <prefix>-checkpoint consists of:
+#   <prefix>-checkpoint.zip: policy, optimizer states and step counters (SB3 save)
+#   <prefix>-checkpoint-replay_buffer.pkl: replay buffer
+#   <prefix>-checkpoint.json: training progress (written last, so a checkpoint
+#       is complete once it exists)
+CHECKPOINT_SUFFIX = "-checkpoint"
+REPLAY_BUFFER_SUFFIX = "-replay_buffer.pkl"
+
+def checkpoint_path(log_dir, name):
+    return os.path.join(log_dir, name + CHECKPOINT_SUFFIX)
+
+def save_replay_buffer(model, path):
+    """Saves the replay buffer of model next to the model saved at path
+    (<path>-replay_buffer.pkl)."""
+    model.save_replay_buffer(path + REPLAY_BUFFER_SUFFIX)
+
+def load_model(path, env, algorithm=DDPG, **model_kwargs):
+    """Loads the model saved at path (e.g., with DDPG or PrioritizedDDPG) to
+    train on env.  The saved observation space is replaced by env's, which
+    must have the same shapes: models saved before COG observations were
+    declared unbounded have COG bounds of +-1, which SB3 would otherwise
+    reject."""
+    # wrapped as SB3 wraps it (e.g., channels first for images), so the
+    #  policy is built for the observations it will get
+    env = algorithm._wrap_env(env, verbose=0)
+    custom_objects = dict(model_kwargs.pop("custom_objects", None) or {})
+    custom_objects["observation_space"] = env.observation_space
+    return algorithm.load(path, env, custom_objects=custom_objects, **model_kwargs)
+
+def load_replay_buffer(model, path):
+    """Loads the replay buffer saved next to the model at path, if any.
+    Returns whether it was found."""
+    if not os.path.exists(path + REPLAY_BUFFER_SUFFIX):
+        return False
+    model.load_replay_buffer(path + REPLAY_BUFFER_SUFFIX)
+    return True
+
+def save_checkpoint(model, path, total_timesteps):
+    """Saves everything needed to resume training model up to total_timesteps:
+    the model (policy, optimizers and step counters), its replay buffer and
+    the training progress.  Each file is written to a temporary file first, so
+    an interrupted save leaves the previous checkpoint intact."""
+    model.save(path + ".tmp.zip")
+    model.save_replay_buffer(path + ".tmp" + REPLAY_BUFFER_SUFFIX)
+    os.replace(path + ".tmp.zip", path + ".zip")
+    os.replace(path + ".tmp" + REPLAY_BUFFER_SUFFIX, path + REPLAY_BUFFER_SUFFIX)
+
+    state = {
+        "num_timesteps" : model.num_timesteps,
+        "total_timesteps" : total_timesteps,
+        "episode_num" : model._episode_num,
+        "n_updates" : model._n_updates,
+        "replay_buffer_size" : model.replay_buffer.size(),
+        "time" : time.time()
+    }
+    with open(path + ".json.tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".json.tmp", path + ".json")
+
+def load_checkpoint(path, env, algorithm=DDPG, **model_kwargs):
+    """Loads a checkpoint saved by save_checkpoint as an algorithm model
+    (e.g., DDPG or PrioritizedDDPG).  Returns the model (with its replay
+    buffer) and the training progress."""
+    if not os.path.exists(path + ".json"):
+        raise FileNotFoundError("No checkpoint found at %s" % path)
+    with open(path + ".json") as f:
+        state = json.load(f)
+
+    model = load_model(path, env, algorithm, **model_kwargs)
+    model.load_replay_buffer(path + REPLAY_BUFFER_SUFFIX)
+    # the saved last observation belongs to the environment of the interrupted
+    #  run; without it, learn() resets env before the first step
+    model._last_obs = None
+    model._last_original_obs = None
+    return model, state
+
+class CheckpointCallback(BaseCallback):
+    """Saves a checkpoint (see save_checkpoint) at path every save_freq
+    environment steps, overwriting the previous one."""
+
+    def __init__(self, path, save_freq, total_timesteps, verbose=0):
+        super().__init__(verbose)
+        self.path = path
+        self.save_freq = save_freq
+        self.total_timesteps = total_timesteps
+        self.last_save = 0
+
+    def _on_training_start(self):
+        self.last_save = self.num_timesteps
+
+    def _on_step(self):
+        if self.num_timesteps - self.last_save >= self.save_freq:
+            save_checkpoint(self.model, self.path, self.total_timesteps)
+            self.last_save = self.num_timesteps
+            if self.verbose > 0:
+                print("Checkpoint saved at %s (%s timesteps)" % (self.path, self.num_timesteps))
+        return True
@@ -0,0 +1,132 @@
+import warnings
+
+import numpy as np
+from gym import spaces
+from stable_baselines3.common.buffers import DictReplayBuffer, ReplayBuffer
+from stable_baselines3.common.type_aliases import DictReplayBufferSamples
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+def is_normalized_image_space(space):
+    """Whether space holds images as floats in [0, 1] (e.g., StackerEnv's
+    normalized_image_space), which can be stored as uint8 without loss."""
+    return (isinstance(space, spaces.Box) and len(space.shape) == 3 and
+        np.issubdtype(space.dtype, np.floating) and
+        np.all(space.low == 0) and np.all(space.high == 1))
+
+class CompactDictReplayBuffer(DictReplayBuffer):
+    """
+    Description:
+        A DictReplayBuffer for StackerEnv's visual + vector observations that
+        stores every image as uint8 and each observation only once.
+
+        Images in a uint8 space are stored as they are (the policy normalizes
+        them); images in a [0, 1] float space (--float_visual_obs) are
+        quantized to uint8 when added and normalized back to float on the
+        device when sampled.  Like ReplayBuffer's optimize_memory_usage, the
+        next observation of the transition at position i is stored as the
+        observation at position i + 1, and the slot at the current position is
+        never sampled.  The stored next observation of a terminal transition
+        is replaced by the first observation of the next episode, which is
+        harmless since the critic target ignores it (dones = 1), but means
+        timeouts can't be handled.
+
+        Compared to DictReplayBuffer, this stores 1/2 (uint8 spaces) or 1/8
+        ([0, 1] float spaces) of the image bytes.
+    """
+
+    def __init__(self, buffer_size, observation_space, action_space, device="auto", n_envs=1,
+        optimize_memory_usage=True, handle_timeout_termination=False):
+        if handle_timeout_termination:
+            raise ValueError("CompactDictReplayBuffer does not support handle_timeout_termination")
+        # skips DictReplayBuffer.__init__, which allocates next_observations
+        super(ReplayBuffer, self).__init__(buffer_size, observation_space, action_space, device, n_envs=n_envs)
+        self.buffer_size = max(buffer_size // n_envs, 1)
+        self.optimize_memory_usage = True
+        self.handle_timeout_termination = False
+
+        self.scaled_keys = [key for key, space in observation_space.spaces.items() if is_normalized_image_space(space)]
+        self.observations = {
+            key : np.zeros((self.buffer_size, self.n_envs, *obs_shape),
+                dtype=np.uint8 if key in self.scaled_keys else observation_space[key].dtype)
+            for key, obs_shape in self.obs_shape.items()
+        }
+        self.next_observations = None
+
+        self.actions = np.zeros((self.buffer_size, self.n_envs, self.action_dim), dtype=action_space.dtype)
+        self.rewards = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.dones = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+        self.timeouts = np.zeros((self.buffer_size, self.n_envs), dtype=np.float32)
+
+        if psutil is not None:
+            total_memory_usage = sum(obs.nbytes for obs in self.observations.values()) + \
+                self.actions.nbytes + self.rewards.nbytes + self.dones.nbytes
+            mem_available = psutil.virtual_memory().available
+            if total_memory_usage > mem_available:
+                warnings.warn("This system does not have apparently enough memory to store the complete "
+                    "replay buffer %.2fGB > %.2fGB" % (total_memory_usage / 1e9, mem_available / 1e9))
+
+    def _store_obs(self, pos, obs):
+        for key, storage in self.observations.items():
+            if key in self.scaled_keys:
+                np.copyto(storage[pos], np.rint(np.asarray(obs[key]).reshape(storage.shape[1:]) * 255.0), casting='unsafe')
+            else:
+                storage[pos] = np.asarray(obs[key]).reshape(storage.shape[1:])
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        self._store_obs(self.pos, obs)
+        self._store_obs((self.pos + 1) % self.buffer_size, next_obs)
+
+        self.actions[self.pos] = np.array(action).reshape((self.n_envs, self.action_dim))
+        self.rewards[self.pos] = np.array(reward)
+        self.dones[self.pos] = np.array(done)
+
+        self.pos += 1
+        if self.pos == self.buffer_size:
+            self.full = True
+            self.pos = 0
+
+    def sample(self, batch_size, env=None):
+        # the slot at self.pos holds only the next observation of the last
+        #  transition, so it isn't sampled
+        if self.full:
+            batch_inds = (np.random.randint(1, self.buffer_size, size=batch_size) + self.pos) % self.buffer_size
+        else:
+            batch_inds = np.random.randint(0, self.pos, size=batch_size)
+        return self._get_samples(batch_inds, env=env)
+
+    def _to_torch_obs(self, obs):
+        # normalizing after the transfer moves 1/4 of the bytes to the device
+        return {key : self.to_torch(value).float().div_(255.0) if key in self.scaled_keys else self.to_torch(value)
+            for key, value in obs.items()}
+
+    def _get_samples(self, batch_inds, env=None):
+        env_indices = np.random.randint(0, high=self.n_envs, size=(len(batch_inds),))
+        next_inds = (batch_inds + 1) % self.buffer_size
+
+        obs = self._normalize_obs({key : obs[batch_inds, env_indices] for key, obs in self.observations.items()}, env)
+        next_obs = self._normalize_obs({key : obs[next_inds, env_indices] for key, obs in self.observations.items()}, env)
+
+        return DictReplayBufferSamples(
+            observations=self._to_torch_obs(obs),
+            actions=self.to_torch(self.actions[batch_inds, env_indices]),
+            next_observations=self._to_torch_obs(next_obs),
+            dones=self.to_torch(self.dones[batch_inds, env_indices]).reshape(-1, 1),
+            rewards=self.to_torch(self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env)),
+        )
+
+def compact_replay_kwargs(observation_space):
+    """Model kwargs (for DDPG and other off-policy algorithms) that store the
+    replay buffer compactly: CompactDictReplayBuffer for dict observations,
+    and ReplayBuffer's optimize_memory_usage (next observations aren't stored
+    separately) otherwise.  Visual-only observations are already uint8."""
+    if isinstance(observation_space, spaces.Dict):
+        # optimize_memory_usage also makes the model truncate the last
+        #  trajectory when training continues on a loaded buffer
+        return dict(optimize_memory_usage=True, replay_buffer_class=CompactDictReplayBuffer)
+    if is_normalized_image_space(observation_space):
+        raise ValueError("Compact replay doesn't support [0, 1] float visual-only observations")
+    return dict(optimize_memory_usage=True, replay_buffer_kwargs=dict(handle_timeout_termination=False))
@@ -2,8 +2,23 @@ import numpy as np
 from stable_baselines3 import DDPG
 import os
 import matplotlib.pyplot as plt
-from stable_baselines3.common.noise import NormalActionNoise, OrnsteinUhlenbeckActionNoise
+from stable_baselines3.common.noise import NormalActionNoise, OrnsteinUhlenbeckActionNoise, VectorizedActionNoise
 from stacker_env import StackerEnv
+from stacker_vec_env import make_stacker_vec_env, MultiAgentStackerVecEnv, ThreadedStackerVecEnv
+from stacker_sim import StackerSimEnvironment
+from surrogate_env import SurrogateStackerEnv, load_surrogate
+from transition_recorder import TransitionRecorder
+from evaluate import evaluate, print_summary, save_summary
+from checkpoints import CheckpointCallback, checkpoint_path, save_checkpoint, load_checkpoint, load_model, save_replay_buffer, load_replay_buffer
+from prioritized_replay import PrioritizedDDPG, PrioritizedReplayBuffer
+from compact_replay import compact_replay_kwargs
+from policy_runtime import PolicyRuntime
+from warm_start import warm_start_replay_buffer, OfflinePretrainCallback
+from throughput import ThroughputCallback
+from model_catalog import ModelCatalog
+from functools import partial
+import logging
+from telemetry import make_telemetry, logger
 from stable_baselines3.common.monitor import Monitor
 import pandas as pd
 import argparse, textwrap
@@ -18,6 +33,7 @@ def main():
         \tTrain new model for 500 timesteps using vector observations only with height and center of gravity priors, and save the model (using default naming conventions) in the "cube_stacking_model" directory: "python ddpg.py -b stacker -l cube_stacking_model -t 500 --train --vector_obs -p HGT COG"
         \tTest ddpg_1 for 50 timesteps using height prior only: "python ddpg.py -b stacker -m ddpg_1 -t 50 --test -p HGT"
         \tLoad ddpg_1, continue training for 100 timesteps using center of gravity prior only, and save the result as "ddpg_2": "python ddpg.py -b stacker -m ddpg_1 -M ddpg_2 -t 100 --train -p COG"
+        \tTrain new model for 2000 timesteps on 4 parallel instances of a Unity build: "python ddpg.py -b stacker -l cube_stacking_model -t 2000 --train --vector_obs -p HGT COG -e builds/stacker -n 4"
         '''),formatter_class=argparse.RawTextHelpFormatter)
     parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='.', help='log directory')
     parser.add_argument('--tb_name', '-b', metavar='TBNAME', default='.', help='TensorBoard path name (recommended to add this folder to .gitignore')
@@ -29,6 +45,41 @@ def main():
     parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', help='set of priors to use (one required): HGT = height; REL = relations; COG = center of gravity')
     parser.add_argument('--train', action='store_true', default=False, help='train mode')
     parser.add_argument('--test', action='store_true', default=False, help='test mode')
+    parser.add_argument('--env_file', '-e', metavar='ENVFILE', default=None, help='path to a Unity build of the environment (leave blank to connect to the Unity Editor)')
+    parser.add_argument('--n_envs', '-n', metavar='NENVS', default=1, help='number of Unity instances to train on in parallel (requires --env_file if > 1; testing always uses one instance)')
+    parser.add_argument('--multi_agent', action='store_true', default=False, help='train on all stacking agents in the scene (replicated arenas) as a batched environment')
+    parser.add_argument('--fast', action='store_true', default=False, help='headless fast simulation: accelerated time scale, unlimited frame rate, lowest quality level, and no graphics when using a build with vector observations only')
+    parser.add_argument('--time_scale', metavar='TIMESCALE', type=float, default=None, help='Unity time scale (overrides --fast)')
+    parser.add_argument('--target_frame_rate', metavar='FRAMERATE', type=int, default=None, help='Unity target frame rate, -1 = unlimited (overrides --fast)')
+    parser.add_argument('--quality_level', metavar='QUALITY', type=int, default=None, help='Unity quality level (overrides --fast)')
+    parser.add_argument('--no_graphics', action='store_true', default=None, help='launch the Unity build without rendering (vector observations only)')
+    parser.add_argument('--sim', action='store_true', default=False, help='use the pure-Python stacking simulator instead of Unity')
+    parser.add_argument('--sim_objects', metavar='SIMOBJECTS', default=2, help='number of objects to stack in the simulator')
+    parser.add_argument('--float_visual_obs', action='store_true', default=False, help='return visual observations as float32 instead of uint8 (for models trained before compact observations)')
+    parser.add_argument('--async_env', action='store_true', default=False, help='step Unity in background threads: with -n > 1, all instances run in the training process and are stepped concurrently')
+    parser.add_argument('--full_reset', action='store_true', default=False, help='reset the whole Unity environment at the start of every episode instead of waiting for Unity to start the next episode')
+    parser.add_argument('--record', metavar='RECORDDIR', default=None, help='record the transitions of the test run as .npy shards in this directory (see transition_recorder.py); not with --eval_episodes')
+    parser.add_argument('--checkpoint_freq', metavar='CHECKPOINTFREQ', type=int, default=0, help='save a checkpoint (model, optimizers, replay buffer and step counters) every this many timesteps while training, and when training ends or is interrupted (0 = no checkpoints)')
+    parser.add_argument('--resume', action='store_true', default=False, help='resume training from the checkpoint of the model being trained (-M if given, else -m) until --total_timesteps')
+    parser.add_argument('--save_replay_buffer', action='store_true', default=False, help='save the replay buffer next to the trained model, so fine-tuning it (-m <model> -M <new model>) starts with the buffer')
+    parser.add_argument('--eval_episodes', '-E', metavar='EPISODES', type=int, default=None, help='with --test, evaluate the model over this many episodes instead of --total_timesteps steps, and save a summary and plots in the log directory (see evaluate.py)')
+    parser.add_argument('--eval_workers', '-w', metavar='WORKERS', type=int, default=1, help='number of environments to evaluate on in parallel, each in its own process (requires --env_file or --sim if > 1)')
+    parser.add_argument('--seed', metavar='SEED', type=int, default=0, help='base seed of the evaluation environments (worker i uses seed + i)')
+    parser.add_argument('--solved_threshold', metavar='THRESHOLD', type=float, default=None, help='mean evaluation return at which the task counts as solved')
+    parser.add_argument('--log_level', metavar='LOGLEVEL', default='WARNING', choices=['DEBUG','INFO','WARNING'], help='DEBUG = log every step (including observations); INFO = per-step telemetry records without observations; WARNING = silent (default)')
+    parser.add_argument('--telemetry_file', metavar='TELEMETRYFILE', default=None, help='append per-step telemetry records (see --log_level) to this file as JSON lines')
+    parser.add_argument('--telemetry_tb', action='store_true', default=False, help='write per-step rewards and step phase timings (see --log_level) to TensorBoard')
+    parser.add_argument('--surrogate', metavar='SURROGATE', default=None, help='use a surrogate environment model trained on trial data (see surrogate_env.py) instead of Unity (vector observations only)')
+    parser.add_argument('--prioritized_replay', action='store_true', default=False, help='train with prioritized experience replay: transitions are replayed in proportion to their TD errors, with importance-sampling correction (not supported with both visual and vector observations)')
+    parser.add_argument('--per_alpha', metavar='ALPHA', type=float, default=0.6, help='prioritization exponent of --prioritized_replay (0 = uniform)')
+    parser.add_argument('--per_beta', metavar='BETA', type=float, default=0.4, help='initial importance-sampling exponent of --prioritized_replay, annealed to 1 over training')
+    parser.add_argument('--compact_replay', action='store_true', default=False, help='store each observation in the replay buffer once (not again as the next observation), with images as uint8, so visual observation buffers fit in memory')
+    parser.add_argument('--buffer_size', metavar='BUFFERSIZE', type=int, default=1000000, help='replay buffer size in transitions (a visual transition takes about 21 KB with --compact_replay, 42 KB without)')
+    parser.add_argument('--exported_policy', metavar='POLICYFILE', default=None, help='with --test, run a policy exported by export_policy.py (.pt or .onnx) instead of loading the model with stable-baselines3')
+    parser.add_argument('--warm_start', metavar='TRIALDATA', type=str, nargs='*', default=None, help='fill the replay buffer with the placements logged in these trial data files (or glob patterns) before training; leave blank to use all files in analysis/trial-data (vector observations only)')
+    parser.add_argument('--logged_priors', metavar='LOGGEDPRIORS', type=str, nargs='+', default=['COG','HGT'], help='priors logged in the --warm_start trial data files')
+    parser.add_argument('--throughput_freq', metavar='THROUGHPUTFREQ', type=int, default=100, help='write env steps/second, gradient updates/second, the time split between env steps, the rest of each step (policy inference, replay inserts) and training, the replay buffer size and the process memory to TensorBoard (--tb_name) every this many timesteps while training (0 = off)')
+    parser.add_argument('--pretrain_steps', metavar='PRETRAINSTEPS', type=int, default=0, help='gradient steps to train on the warm-started replay buffer before interacting with the environment')
 
     args = parser.parse_args()
 
@@ -42,16 +93,89 @@ def main():
     vector_obs = args.vector_obs
     train = args.train
     test = args.test
+    env_file = args.env_file
+    n_envs = int(args.n_envs)
+    multi_agent = args.multi_agent
+    fast = args.fast
+    time_scale = args.time_scale
+    target_frame_rate = args.target_frame_rate
+    quality_level = args.quality_level
+    no_graphics = args.no_graphics
+    sim = args.sim
+    sim_objects = int(args.sim_objects)
+    surrogate = args.surrogate
+    float_visual_obs = args.float_visual_obs
+    async_env = args.async_env
+    full_reset = args.full_reset
+    record_dir = args.record
+    checkpoint_freq = args.checkpoint_freq
+    resume = args.resume
+    save_buffer = args.save_replay_buffer
+    eval_episodes = args.eval_episodes
+    eval_workers = args.eval_workers
+    seed = args.seed
+    solved_threshold = args.solved_threshold
+    log_level = getattr(logging, args.log_level)
+    telemetry_file = args.telemetry_file
+    telemetry_tb = args.telemetry_tb
+    prioritized_replay = args.prioritized_replay
+    per_alpha = args.per_alpha
+    per_beta = args.per_beta
+    compact_replay = args.compact_replay
+    buffer_size = args.buffer_size
+    exported_policy = args.exported_policy
+    warm_start = args.warm_start
+    logged_priors = sorted(args.logged_priors)
+    throughput_freq = args.throughput_freq
+    pretrain_steps = args.pretrain_steps
+
+    logging.basicConfig(level=log_level, format="%(message)s")
     
     if not visual_obs and not vector_obs:
         visual_obs = True
         vector_obs = True
     
+    if warm_start is not None and visual_obs:
+        raise ValueError("Trial data only has vector observations, so --warm_start requires --vector_obs")
+    if eval_episodes is not None and record_dir is not None:
+        # the evaluation may run in worker processes, each with its own environment
+        raise ValueError("--record records a --test run over timesteps; it can't be combined with --eval_episodes")
+
     os.makedirs(log_dir, exist_ok=True)
 
-    env = StackerEnv(visual_observation=visual_obs,vector_observation=vector_obs,priors=priors)
+    env_kwargs = dict(visual_observation=visual_obs,vector_observation=vector_obs,priors=priors,
+        fast_simulation=fast,time_scale=time_scale,target_frame_rate=target_frame_rate,
+        quality_level=quality_level,no_graphics=no_graphics,compact_visual_obs=not float_visual_obs,
+        soft_reset=not full_reset,
+        telemetry=partial(make_telemetry, log_level, telemetry_file,
+            "./" + tb_name + "/telemetry" if telemetry_tb else None))
 
-    #env = make_vec_env(lambda:env, n_envs=2)
+    if sim:
+        env_kwargs["backend"] = partial(StackerSimEnvironment, num_objects=sim_objects, priors=priors,
+            visual_observation=visual_obs, vector_observation=vector_obs)
+
+    if surrogate is not None:
+        if visual_obs:
+            raise ValueError("Surrogate environments only support vector observations (use --vector_obs)")
+        surrogate_model = load_surrogate(surrogate)
+        if surrogate_model["priors"] != priors:
+            raise ValueError("Surrogate %s was trained with priors %s, not %s" % (surrogate, surrogate_model["priors"], priors))
+        if train and n_envs > 1:
+            env = make_vec_env(lambda: SurrogateStackerEnv(surrogate_model), n_envs=n_envs)
+        else:
+            env = SurrogateStackerEnv(surrogate_model)
+    elif train and multi_agent:
+        # in multi-agent mode, one simulator hosts all n_envs arenas
+        multi_agent_kwargs = dict(env_kwargs)
+        if sim:
+            multi_agent_kwargs["backend"] = partial(env_kwargs["backend"], n_agents=n_envs)
+        env = MultiAgentStackerVecEnv(environment_filename=env_file, **multi_agent_kwargs)
+        n_envs = env.num_envs
+    elif train and n_envs > 1:
+        env = make_stacker_vec_env(n_envs, environment_filename=env_file,
+            vec_env_cls=ThreadedStackerVecEnv if async_env else None, **env_kwargs)
+    else:
+        env = StackerEnv(environment_filename=env_file, **env_kwargs)
 
     #env = Monitor(env, log_dir)
 
@@ -64,58 +188,155 @@ def main():
 
     action_noise = NormalActionNoise(mean=np.zeros(n_actions), sigma=0.1 * np.ones(n_actions))
 
+    # episodic training is only supported on a single env, so with
+    #  multiple envs update the model after every (vectorized) step instead
+    model_kwargs = {"buffer_size" : buffer_size}
+    if train and n_envs > 1:
+        action_noise = VectorizedActionNoise(action_noise, n_envs)
+        model_kwargs["train_freq"] = (1, "step")
+
+    algorithm = DDPG
+    if train and prioritized_replay:
+        if visual_obs and vector_obs:
+            raise ValueError("--prioritized_replay does not support dict observations (use --visual_obs or --vector_obs)")
+        algorithm = PrioritizedDDPG
+        model_kwargs["replay_buffer_class"] = PrioritizedReplayBuffer
+        model_kwargs["replay_buffer_kwargs"] = dict(alpha=per_alpha, beta=per_beta)
+    if train and compact_replay:
+        if prioritized_replay:
+            raise ValueError("--compact_replay can't be combined with --prioritized_replay")
+        model_kwargs.update(compact_replay_kwargs(env.observation_space))
+
     if train:
-        if new_model_name is None:
+        checkpoint = checkpoint_path(log_dir, model_name if new_model_name is None else new_model_name)
+        if resume:
+            # the saved noise is the same, but models saved by older SB3
+            #  versions pickled noise objects that newer versions can't call
+            model_kwargs["action_noise"] = action_noise
+            model, checkpoint_state = load_checkpoint(checkpoint, env, algorithm=algorithm, **model_kwargs)
+            print("Resuming from checkpoint %s at %s/%s timesteps (%s transitions in the replay buffer)" % (checkpoint,
+                model.num_timesteps, total_timesteps, model.replay_buffer.size()))
+        elif new_model_name is None:
             if visual_obs and vector_obs:
-                model = DDPG("MultiInputPolicy", env, learning_rate=1e-4, action_noise=action_noise, verbose=1, tensorboard_log="./" + tb_name + "/")
+                model = algorithm("MultiInputPolicy", env, learning_rate=1e-4, action_noise=action_noise, verbose=1, tensorboard_log="./" + tb_name + "/", **model_kwargs)
             elif visual_obs:
-                model = DDPG("CnnPolicy", env, learning_rate=1e-4, action_noise=action_noise, verbose=1, tensorboard_log="./" + tb_name + "/")
+                model = algorithm("CnnPolicy", env, learning_rate=1e-4, action_noise=action_noise, verbose=1, tensorboard_log="./" + tb_name + "/", **model_kwargs)
             elif vector_obs:
-                model = DDPG("MlpPolicy", env, learning_rate=1e-3, action_noise=action_noise, verbose=1, tensorboard_log="./" + tb_name + "/")
+                model = algorithm("MlpPolicy", env, learning_rate=1e-3, action_noise=action_noise, verbose=1, tensorboard_log="./" + tb_name + "/", **model_kwargs)
         else:
-            model = DDPG.load(log_dir + "/" + model_name, env)
+            model_kwargs["action_noise"] = action_noise
+            model = load_model(log_dir + "/" + model_name, env, algorithm, **model_kwargs)
+            if load_replay_buffer(model, log_dir + "/" + model_name):
+                print("Loaded replay buffer of %s (%s transitions)" % (model_name, model.replay_buffer.size()))
             
         print(model.policy)
 
+        callbacks = []
+        if warm_start is not None and not resume:
+            n_transitions = warm_start_replay_buffer(model, warm_start if len(warm_start) > 0 else None, priors, logged_priors)
+            print("Warm-started the replay buffer with %s trial data transitions" % n_transitions)
+            # the buffer is already filled, so learning can start right away
+            model.learning_starts = 0
+            if pretrain_steps > 0:
+                callbacks.append(OfflinePretrainCallback(pretrain_steps, verbose=1))
+        if checkpoint_freq > 0:
+            callbacks.append(CheckpointCallback(checkpoint, checkpoint_freq, total_timesteps, verbose=1))
+        if throughput_freq > 0:
+            throughput = ThroughputCallback(throughput_freq)
+            callbacks.append(throughput)
+
         start_time = time.time()
-        model.learn(total_timesteps=total_timesteps, log_interval=1)
+        try:
+            # when resuming, the step counters continue from the checkpoint
+            model.learn(total_timesteps=total_timesteps - model.num_timesteps if resume else total_timesteps,
+                log_interval=1, callback=callbacks, reset_num_timesteps=not resume)
+        except KeyboardInterrupt:
+            if checkpoint_freq > 0:
+                save_checkpoint(model, checkpoint, total_timesteps)
+                print("Training interrupted; checkpoint saved at %s (continue with --resume)" % checkpoint)
+            raise
+        if checkpoint_freq > 0:
+            save_checkpoint(model, checkpoint, total_timesteps)
 
         print("Done learning")
         print("Training took %.4f seconds" % float(time.time()-start_time))
+        if throughput_freq > 0:
+            throughput.print_summary()
 
+        catalog = ModelCatalog(log_dir)
         if new_model_name is None:
             # create filename: model name + date + action space + trainings steps + priors
             filename = model_name + "-" + datetime.now().strftime("%Y%m%d") + "-" + \
                 str(",".join(list(map(str,env.action_space.low)))) + "-" + str(",".join(list(map(str,env.action_space.high)))) + \
                 "-" + str(total_timesteps) + "-" + ".".join(priors)
-            num_identical_filenames = len([f for f in os.listdir((log_dir+"/"+filename).rsplit('/')[0]) \
-                if f.startswith((log_dir+"/"+filename).rsplit('/')[-1])])
-            if num_identical_filenames > 0:
-                filename += "-" + str(num_identical_filenames+1)
+            filename = catalog.unique_name(filename)
             model.save(log_dir + "/" + filename)
+            catalog.add(filename)
             print("Model saved at", log_dir + "/" + filename)
+            if save_buffer:
+                save_replay_buffer(model, log_dir + "/" + filename)
+                print("Replay buffer saved at", log_dir + "/" + filename + "-replay_buffer.pkl")
         else:
             # create filename: model name + date + action space + trainings steps + priors
             filename = new_model_name + "-" + datetime.now().strftime("%Y%m%d") + "-" + \
                 str(",".join(list(map(str,env.action_space.low)))) + "-" + str(",".join(list(map(str,env.action_space.high)))) + \
                 "-" + str(total_timesteps) + "-" + ".".join(priors)
-            num_identical_filenames = len([f for f in os.listdir((log_dir+"/"+filename).rsplit('/')[0]) \
-                if f.startswith((log_dir+"/"+filename).rsplit('/')[-1])])
-            if num_identical_filenames > 0:
-                filename += "-" + str(num_identical_filenames+1)
+            filename = catalog.unique_name(filename)
             model.save(log_dir + "/" + filename)
+            catalog.add(filename)
             print("Model saved at", log_dir + "/" + filename)
+            if save_buffer:
+                save_replay_buffer(model, log_dir + "/" + filename)
+                print("Replay buffer saved at", log_dir + "/" + filename + "-replay_buffer.pkl")
+
+        if not test:
+            # flushes buffered telemetry
+            env.close()
+
+    if test and eval_episodes is not None:
+        if surrogate is not None:
+            raise ValueError("--eval_episodes evaluates against the stacking environment, not a surrogate")
+        if eval_workers > 1 or (train and (n_envs > 1 or multi_agent)):
+            # the evaluation workers open their own environments
+            env.close()
+            eval_env = None
+        else:
+            # keep the open environment (e.g., the connection to the Editor)
+            eval_env = env
+        summary = evaluate(log_dir + "/" + model_name, n_episodes=eval_episodes, n_workers=eval_workers,
+            seed=seed, environment_filename=env_file, solved_threshold=solved_threshold, env=eval_env, **env_kwargs)
+        if eval_env is not None:
+            eval_env.close()
+        print_summary(summary)
+        json_path, plot_path = save_summary(summary, log_dir, prefix=model_name + "-eval")
+        print("Summary saved at", json_path)
+        print("Plots saved at", plot_path)
+    elif test:
+        if surrogate is not None:
+            if train and n_envs > 1:
+                env.close()
+                env = SurrogateStackerEnv(surrogate_model)
+        elif train and (n_envs > 1 or multi_agent):
+            # free the worker ids used for training and test on a single instance
+            env.close()
+            env = StackerEnv(environment_filename=env_file, **env_kwargs)
 
-    if test:
-        model = DDPG.load(log_dir + "/" + model_name)
-        print("Loaded model", log_dir + "/" + model_name)
+        if exported_policy is not None:
+            model = PolicyRuntime(exported_policy)
+            print("Loaded exported policy", exported_policy)
+        else:
+            model = DDPG.load(log_dir + "/" + model_name)
+            print("Loaded model", log_dir + "/" + model_name)
+
+        if record_dir is not None:
+            env = TransitionRecorder(env, record_dir,
+                metadata={"model" : model_name, "priors" : priors, "visual_obs" : visual_obs, "vector_obs" : vector_obs})
         #print(model)
         #print(model.policy)
         #print(model.get_parameters())
         
         # reset the environment and get the resulting observation
-        env.reset()
-        obs = env._env._env_state[env.behavior_name][0].obs[0]
+        obs = env.reset()
 
         i = 1
         ep_reward = 0
@@ -129,12 +350,11 @@ def main():
         ts_reward_mean = []
         ep_reward_mean = []
         while True:
-            print("\nTesting %s" % i)
-            print("obs:", obs)
+            logger.debug("Testing %s\nobs: %s", i, obs)
             action, _states = model.predict(obs)
             last_obs = obs
             obs, reward, done, info = env.step(action)
-            print("Reward: %s\t Done: %s" % (reward,done))
+            logger.debug("Reward: %s\t Done: %s", reward, done)
             total_reward += reward
             ep_reward += reward
             timesteps.append(i)
@@ -148,8 +368,7 @@ def main():
                 ep_reward_mean.append(float(total_reward)/float(total_episodes))
                 ep_reward = 0
                 # reset the environment and get the resulting observation
-                env.reset()
-                obs = env._env._env_state[env.behavior_name][0].obs[0]
+                obs = env.reset()
 
 #            if visual_obs and vector_obs:
 #                if not np.allclose(obs["visual_obs"], last_obs["visual_obs"]) and\
@@ -172,6 +391,12 @@ def main():
         print("\tTotal reward: %s" % total_reward)
         print("\tMax reward achieved: %s" % max_reward)
         print("\tMean reward per episode: %.4f" % (float(total_reward)/float(total_episodes),))
+        if isinstance(env.unwrapped, StackerEnv):
+            for kind, (count, mean_time, max_time) in env.unwrapped.telemetry.reset_summary().items():
+                print("\t%s %s resets: mean %.4f seconds, max %.4f seconds" % (count, kind, mean_time, max_time))
+
+        # flushes buffered telemetry
+        env.close()
         
         plt.figure(figsize=(16,6))
         plt.subplot(1, 2, 1)
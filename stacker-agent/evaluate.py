@@ -0,0 +1,257 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from matplotlib.figure import Figure
+from stable_baselines3 import DDPG
+
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+
+class RunningStats:
+    """Streaming count, mean, variance (Welford), min and max of a series of
+    values, which can be merged across workers."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float('inf')
+        self.max = -float('inf')
+
+    def update(self, x):
+        x = float(x)
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.count)) if self.count > 0 else 0.0
+
+    def summary(self):
+        return {"count" : self.count, "mean" : self.mean, "std" : self.std,
+            "min" : self.min, "max" : self.max}
+
+def evaluate_worker(rank,
+    model_path,
+    n_episodes,
+    seed=None,
+    environment_filename=None,
+    start_worker_id=0,
+    max_episode_steps=1000,
+    **env_kwargs):
+    """Runs n_episodes episodes of the model at model_path on its own
+    StackerEnv (worker id start_worker_id + rank, seeded with seed + rank).
+    Returns (episode returns, episode lengths, RunningStats of step rewards).
+    """
+    env = StackerEnv(environment_filename=environment_filename,
+        worker_id=start_worker_id+rank,
+        seed=None if seed is None else seed+rank,
+        **env_kwargs)
+    model = DDPG.load(model_path, device='cpu')
+    try:
+        return run_episodes(env, model, n_episodes, max_episode_steps)
+    finally:
+        env.close()
+
+def run_episodes(env, model, n_episodes, max_episode_steps=1000):
+    returns = np.zeros((n_episodes,), dtype=np.float64)
+    lengths = np.zeros((n_episodes,), dtype=np.int64)
+    step_rewards = RunningStats()
+
+    for episode in range(n_episodes):
+        obs = env.reset()
+        done = False
+        while not done and lengths[episode] < max_episode_steps:
+            action, _states = model.predict(obs, deterministic=True)
+            obs, reward, done, info = env.step(action)
+            returns[episode] += reward
+            lengths[episode] += 1
+            step_rewards.update(reward)
+
+    return returns, lengths, step_rewards
+
+def evaluate(model_path,
+    n_episodes=100,
+    n_workers=1,
+    seed=0,
+    environment_filename=None,
+    start_worker_id=0,
+    max_episode_steps=1000,
+    solved_threshold=None,
+    env=None,
+    **env_kwargs):
+    """Evaluates a saved DDPG model on n_episodes episodes spread over
+    n_workers environments, each in its own process (one worker runs in this
+    process, which is required to use the Unity Editor).  Results are
+    reproducible for the same seed and number of workers with seedable
+    backends and Unity builds.  With a single worker, an already open
+    StackerEnv can be passed as env; it is reseeded, and left open.
+
+    Returns a summary dict with the per-episode returns and lengths, return
+    and step reward statistics, and whether the mean return reaches
+    solved_threshold (if given).
+    """
+    if n_workers > 1 and environment_filename is None and env_kwargs.get("backend") is None:
+        raise ValueError("Evaluating on %s workers requires a Unity build (environment_filename); "
+            "the Unity Editor can only serve a single environment." % n_workers)
+
+    # contiguous blocks of episodes per worker
+    episode_counts = [n_episodes // n_workers + (1 if rank < n_episodes % n_workers else 0)
+        for rank in range(n_workers)]
+    episode_counts = [count for count in episode_counts if count > 0]
+
+    returns = np.zeros((n_episodes,), dtype=np.float64)
+    lengths = np.zeros((n_episodes,), dtype=np.int64)
+    step_rewards = RunningStats()
+
+    worker = partial(evaluate_worker, model_path=model_path, seed=seed,
+        environment_filename=environment_filename, start_worker_id=start_worker_id,
+        max_episode_steps=max_episode_steps, **env_kwargs)
+
+    start_time = time.time()
+    if env is not None:
+        if len(episode_counts) > 1:
+            raise ValueError("An open environment can only be used with a single worker")
+        env.seed(seed)
+        model = DDPG.load(model_path, device='cpu')
+        results = [run_episodes(env, model, n_episodes, max_episode_steps)]
+    elif len(episode_counts) == 1:
+        results = [worker(0, n_episodes=episode_counts[0])]
+    else:
+        # Unity and torch don't survive a fork, so workers are spawned
+        with ProcessPoolExecutor(len(episode_counts), mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(worker, rank, n_episodes=count) for rank, count in enumerate(episode_counts)]
+            results = [future.result() for future in futures]
+    wall_time = time.time() - start_time
+
+    offset = 0
+    for worker_returns, worker_lengths, worker_step_rewards in results:
+        returns[offset:offset+len(worker_returns)] = worker_returns
+        lengths[offset:offset+len(worker_lengths)] = worker_lengths
+        step_rewards.merge(worker_step_rewards)
+        offset += len(worker_returns)
+
+    summary = {
+        "model" : model_path,
+        "n_episodes" : n_episodes,
+        "n_workers" : len(episode_counts),
+        "seed" : seed,
+        "mean_return" : float(returns.mean()),
+        "std_return" : float(returns.std()),
+        "min_return" : float(returns.min()),
+        "max_return" : float(returns.max()),
+        "mean_episode_length" : float(lengths.mean()),
+        "step_reward" : step_rewards.summary(),
+        "solved_threshold" : solved_threshold,
+        "solved" : None if solved_threshold is None else bool(returns.mean() >= solved_threshold),
+        "wall_time" : wall_time,
+        "episodes_per_second" : n_episodes / wall_time,
+        "returns" : returns.tolist(),
+        "lengths" : lengths.tolist()
+    }
+    return summary
+
+def save_summary(summary, output_dir, prefix="eval"):
+    """Writes the summary as <prefix>-summary.json and plots the returns to
+    <prefix>-returns.png in output_dir, without a display.  Returns the two
+    paths."""
+    os.makedirs(output_dir, exist_ok=True)
+    json_path = os.path.join(output_dir, prefix + "-summary.json")
+    with open(json_path, "w") as f:
+        json.dump(summary, f, indent=2)
+
+    returns = np.array(summary["returns"])
+    episodes = np.arange(1, len(returns)+1)
+
+    # a bare Figure renders with Agg, whatever pyplot's backend is
+    fig = Figure(figsize=(16,6))
+    ax = fig.add_subplot(1, 2, 1)
+    ax.plot(episodes, returns, label="Episode Return")
+    ax.plot(episodes, np.cumsum(returns)/episodes, label="Mean Return")
+    if summary["solved_threshold"] is not None:
+        ax.axhline(summary["solved_threshold"], color="gray", linestyle="--", label="Solved Threshold")
+    ax.set_xlabel("Episodes")
+    ax.set_ylabel("Return")
+    ax.legend(loc="upper left")
+    ax.yaxis.grid()
+
+    ax = fig.add_subplot(1, 2, 2)
+    ax.hist(returns, bins=20)
+    ax.set_xlabel("Return")
+    ax.set_ylabel("Episodes")
+
+    plot_path = os.path.join(output_dir, prefix + "-returns.png")
+    fig.savefig(plot_path)
+    return json_path, plot_path
+
+def print_summary(summary):
+    print("\n===== Evaluation =====")
+    print("Evaluated %s episodes on %s workers in %.2f seconds" % (summary["n_episodes"], summary["n_workers"], summary["wall_time"]))
+    print("\tMean return: %.4f (std %.4f, min %.4f, max %.4f)" % (summary["mean_return"], summary["std_return"],
+        summary["min_return"], summary["max_return"]))
+    print("\tMean episode length: %.2f" % summary["mean_episode_length"])
+    if summary["solved"] is not None:
+        print("\tSolved (mean return >= %s): %s" % (summary["solved_threshold"], summary["solved"]))
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a saved model over a number of episodes on parallel, seeded environments.  (Example usage: "python evaluate.py -l cube_stacking_model -m 2cubes-20211212-0.0,0.0-1000.0,1000.0-2000-COG.HGT --vector_obs -p COG HGT -E 100 -w 4 -e <path to build>")')
+    parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='.', help='model directory; the summary and plots are written here')
+    parser.add_argument('--model_name', '-m', metavar='MODELNAME', required=True, help='name of model to evaluate')
+    parser.add_argument('--visual_obs', action='store_true', default=False, help='use visual observations (leave blank to use both)')
+    parser.add_argument('--vector_obs', action='store_true', default=False, help='use vector observations (leave blank to use both)')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', required=True, help='set of priors to use: HGT = height; REL = relations; COG = center of gravity')
+    parser.add_argument('--episodes', '-E', metavar='EPISODES', default=100, help='number of episodes to evaluate')
+    parser.add_argument('--workers', '-w', metavar='WORKERS', default=1, help='number of environments to evaluate on in parallel (requires --env_file or --sim if > 1)')
+    parser.add_argument('--seed', metavar='SEED', default=0, help='base seed (worker i uses seed + i)')
+    parser.add_argument('--solved_threshold', metavar='THRESHOLD', type=float, default=None, help='mean return at which the task counts as solved')
+    parser.add_argument('--env_file', '-e', metavar='ENVFILE', default=None, help='path to a Unity build of the environment (leave blank to connect to the Unity Editor)')
+    parser.add_argument('--fast', action='store_true', default=False, help='headless fast simulation (see ddpg.py)')
+    parser.add_argument('--sim', action='store_true', default=False, help='use the pure-Python stacking simulator instead of Unity')
+    parser.add_argument('--sim_objects', metavar='SIMOBJECTS', default=2, help='number of objects to stack in the simulator')
+
+    args = parser.parse_args()
+
+    priors = sorted(args.priors)
+    visual_obs = args.visual_obs
+    vector_obs = args.vector_obs
+    if not visual_obs and not vector_obs:
+        visual_obs = True
+        vector_obs = True
+
+    env_kwargs = dict(visual_observation=visual_obs, vector_observation=vector_obs, priors=priors,
+        fast_simulation=args.fast)
+    if args.sim:
+        env_kwargs["backend"] = partial(StackerSimEnvironment, num_objects=int(args.sim_objects), priors=priors,
+            visual_observation=visual_obs, vector_observation=vector_obs)
+
+    summary = evaluate(args.log_dir + "/" + args.model_name, n_episodes=int(args.episodes),
+        n_workers=int(args.workers), seed=int(args.seed), environment_filename=args.env_file,
+        solved_threshold=args.solved_threshold, **env_kwargs)
+    print_summary(summary)
+    json_path, plot_path = save_summary(summary, args.log_dir, prefix=args.model_name + "-eval")
+    print("Summary saved at", json_path)
+    print("Plots saved at", plot_path)
+
+if __name__ == "__main__":
+    main()
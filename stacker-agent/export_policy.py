@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch as th
+from gym import spaces
+from stable_baselines3 import DDPG
+from stable_baselines3.common.preprocessing import is_image_space, is_image_space_channels_first
+
+from policy_runtime import PolicyRuntime, metadata_path
+
+FORMATS = {
+    "torchscript" : ".pt",
+    "onnx" : ".onnx"
+}
+
+class ExportedActor(th.nn.Module):
+    """
+    Description:
+        The actor of a DDPG policy with the policy's observation preprocessing
+        and action unscaling baked in, so it maps raw StackerEnv observations
+        (one positional input per observation key, in the order of inputs, with
+        a leading batch axis) straight to actions in the environment's action
+        range.
+
+        Images are transposed from the environment's height x width x
+        channels to channels first if the policy was trained on transposed
+        images (VecTransposeImage, which SB3 adds automatically); the actor
+        itself converts observations to float and normalizes uint8 images
+        (preprocess_obs).
+    """
+
+    def __init__(self, actor, observation_space, action_space):
+        super().__init__()
+        self.actor = actor
+        if isinstance(observation_space, spaces.Dict):
+            self.keys = list(observation_space.spaces)
+            obs_spaces = list(observation_space.spaces.values())
+        else:
+            self.keys = None
+            obs_spaces = [observation_space]
+        self.transpose = [is_image_space(space, check_channels=False) and is_image_space_channels_first(space)
+            for space in obs_spaces]
+        self.register_buffer("action_low", th.as_tensor(action_space.low, dtype=th.float32))
+        self.register_buffer("action_high", th.as_tensor(action_space.high, dtype=th.float32))
+
+    def forward(self, *inputs):
+        obs = []
+        for x, transpose in zip(inputs, self.transpose):
+            obs.append(x.permute(0, 3, 1, 2) if transpose else x)
+        if self.keys is None:
+            scaled_action = self.actor(obs[0])
+        else:
+            scaled_action = self.actor({key : value for key, value in zip(self.keys, obs)})
+        # unscale from [-1, 1] to the action range, as in BasePolicy.predict
+        action = self.action_low + 0.5 * (scaled_action + 1.0) * (self.action_high - self.action_low)
+        return th.max(th.min(action, self.action_high), self.action_low)
+
+def input_specs(observation_space):
+    """The names, shapes (without the batch axis) and dtypes of the exported
+    actor's inputs, which are the observations as StackerEnv returns them
+    (images height x width x channels)."""
+    if isinstance(observation_space, spaces.Dict):
+        items = list(observation_space.spaces.items())
+    else:
+        items = [("obs", observation_space)]
+    specs = []
+    for name, space in items:
+        shape = list(space.shape)
+        if is_image_space(space, check_channels=False) and is_image_space_channels_first(space):
+            shape = shape[1:] + shape[:1]
+        specs.append({"name" : name, "shape" : shape, "dtype" : np.dtype(space.dtype).name})
+    return specs
+
+def sample_inputs(specs, batch_size, seed=0):
+    rng = np.random.default_rng(seed)
+    inputs = []
+    for spec in specs:
+        shape = [batch_size] + spec["shape"]
+        if np.issubdtype(np.dtype(spec["dtype"]), np.integer):
+            inputs.append(rng.integers(0, 256, size=shape).astype(spec["dtype"]))
+        else:
+            inputs.append(rng.uniform(-1, 1, size=shape).astype(spec["dtype"]))
+    return inputs
+
+def export_policy(model_path, output_path, export_format="torchscript"):
+    """Exports the actor of the DDPG model at model_path (see ExportedActor)
+    to output_path + .pt (TorchScript) or .onnx, plus a metadata sidecar
+    (output_path + .json) read by PolicyRuntime.  Returns the path of the
+    exported module."""
+    model = DDPG.load(model_path, device="cpu")
+    policy = model.policy
+    policy.set_training_mode(False)
+
+    module = ExportedActor(policy.actor, policy.observation_space, model.action_space).eval()
+    specs = input_specs(policy.observation_space)
+    example_inputs = tuple(th.as_tensor(x) for x in sample_inputs(specs, 2))
+
+    path = output_path + FORMATS[export_format]
+    with th.no_grad():
+        if export_format == "torchscript":
+            traced = th.jit.trace(module, example_inputs)
+            th.jit.save(th.jit.freeze(traced), path)
+        else:
+            try:
+                th.onnx.export(module, example_inputs, path,
+                    input_names=[spec["name"] for spec in specs], output_names=["action"],
+                    dynamic_axes={name : {0 : "batch"} for name in [spec["name"] for spec in specs] + ["action"]})
+            except ImportError as e:
+                raise ImportError("ONNX export requires the onnx package (pip install onnx)") from e
+
+    metadata = {
+        "model" : os.path.basename(model_path),
+        "format" : export_format,
+        "dict_obs" : isinstance(policy.observation_space, spaces.Dict),
+        "inputs" : specs,
+        "action_low" : model.action_space.low.tolist(),
+        "action_high" : model.action_space.high.tolist()
+    }
+    with open(metadata_path(path), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return path
+
+def check_export(model_path, path, n_samples=1000, batch_size=256):
+    """Compares the exported policy at path with the DDPG model at model_path
+    on random observations.  Returns (max absolute action difference, SB3
+    seconds per single prediction, runtime seconds per single prediction,
+    runtime seconds per observation in batches of batch_size)."""
+    model = DDPG.load(model_path, device="cpu")
+    runtime = PolicyRuntime(path)
+    inputs = sample_inputs(runtime.inputs, n_samples)
+
+    def observation(i):
+        if runtime.keys is None:
+            return inputs[0][i]
+        return {spec["name"] : x[i] for spec, x in zip(runtime.inputs, inputs)}
+
+    start_time = time.perf_counter()
+    expected = [model.predict(observation(i), deterministic=True)[0] for i in range(n_samples)]
+    sb3_time = (time.perf_counter() - start_time) / n_samples
+
+    start_time = time.perf_counter()
+    actions = [runtime.act(observation(i)) for i in range(n_samples)]
+    runtime_time = (time.perf_counter() - start_time) / n_samples
+    max_diff = float(np.max(np.abs(np.array(actions) - np.array(expected))))
+
+    batch = inputs[0][:batch_size] if runtime.keys is None else \
+        {spec["name"] : x[:batch_size] for spec, x in zip(runtime.inputs, inputs)}
+    n_batches = max(1, n_samples // batch_size)
+    start_time = time.perf_counter()
+    for _ in range(n_batches):
+        runtime.act_batch(batch)
+    batch_time = (time.perf_counter() - start_time) / (n_batches * len(inputs[0][:batch_size]))
+
+    return max_diff, sb3_time, runtime_time, batch_time
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the actor of a saved model as a standalone TorchScript or ONNX module for policy_runtime.py, which runs it without stable-baselines3.  (Example usage: "python export_policy.py -l cube_stacking_model -m 2cubes-20211212-0.0,0.0-1000.0,1000.0-2000-COG.HGT --check")')
+    parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='.', help='model directory')
+    parser.add_argument('--model_name', '-m', metavar='MODELNAME', required=True, help='name of model to export')
+    parser.add_argument('--output', '-o', metavar='OUTPUT', default=None, help='path of the exported module without extension (default: <log dir>/<model name>-policy)')
+    parser.add_argument('--format', '-f', metavar='FORMAT', default='torchscript', choices=list(FORMATS), help='torchscript (.pt) or onnx (.onnx; requires the onnx package, and onnxruntime to run it)')
+    parser.add_argument('--check', action='store_true', default=False, help='compare the exported policy with the model on random observations and time both')
+
+    args = parser.parse_args()
+
+    model_path = os.path.join(args.log_dir, args.model_name)
+    output = args.output if args.output is not None else model_path + "-policy"
+    path = export_policy(model_path, output, args.format)
+    print("Policy exported at", path)
+
+    if args.check:
+        max_diff, sb3_time, runtime_time, batch_time = check_export(model_path, path)
+        print("Max action difference from the model: %.6f" % max_diff)
+        print("Single observation: %.1f us (SB3 predict: %.1f us)" % (runtime_time*1e6, sb3_time*1e6))
+        print("Batched: %.2f us per observation" % (batch_time*1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import argparse
+import fnmatch
+import json
+import os
+import re
+import zipfile
+from collections import OrderedDict
+
+import pandas as pd
+
+from checkpoints import CHECKPOINT_SUFFIX
+
+CATALOG_FILENAME = "model_catalog.json"
+
+# <name>-<date>-<action low>-<action high>-<timesteps>-<priors>[-<copy>], as
+#  ddpg.py names saved models
+MODEL_NAME_PATTERN = re.compile(r"^(?P<prefix>.+)-(?P<date>\d{8})"
+    r"-(?P<action_low>-?[\d.]+(?:,-?[\d.]+)*)-(?P<action_high>-?[\d.]+(?:,-?[\d.]+)*)"
+    r"-(?P<timesteps>\d+)-(?P<priors>[A-Z]+(?:\.[A-Z]+)*)(?:-(?P<copy>\d+))?$")
+
+def parse_model_name(name):
+    """The settings encoded in a model name saved by ddpg.py (prefix, date,
+    action bounds, timesteps, priors and copy number), or None if the name
+    doesn't follow the naming convention."""
+    match = MODEL_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+    return {
+        "prefix" : match["prefix"],
+        "date" : match["date"],
+        "action_low" : [float(x) for x in match["action_low"].split(",")],
+        "action_high" : [float(x) for x in match["action_high"].split(",")],
+        "timesteps" : int(match["timesteps"]),
+        "priors" : match["priors"].split("."),
+        "copy" : int(match["copy"]) if match["copy"] is not None else 1
+    }
+
+def base_name(name):
+    """The model name without its copy number."""
+    settings = parse_model_name(name)
+    if settings is None or settings["copy"] == 1:
+        return name
+    return name.rsplit("-", 1)[0]
+
+def read_model_data(path):
+    """The observation mode (vector, visual or both), observation shape and
+    trained timesteps of the stable-baselines3 model saved at path, read from
+    the saved data without loading the model, or None if path isn't a saved
+    model."""
+    if not zipfile.is_zipfile(path):
+        return None
+    with zipfile.ZipFile(path) as archive:
+        if "data" not in archive.namelist() or "policy.pth" not in archive.namelist():
+            return None
+        data = json.loads(archive.read("data"))
+
+    observation_space = data.get("observation_space", {})
+    if "Dict" in observation_space.get(":type:", ""):
+        obs, obs_shape = "both", None
+    else:
+        # a list, or its string in newer stable-baselines3 versions
+        obs_shape = observation_space.get("shape")
+        if isinstance(obs_shape, str):
+            obs_shape = json.loads(obs_shape)
+        obs = "visual" if obs_shape is not None and len(obs_shape) == 3 else "vector"
+    return {"obs" : obs, "obs_shape" : obs_shape, "num_timesteps" : data.get("num_timesteps")}
+
+class ModelCatalog:
+    """
+    Description:
+        An index of the models saved in a directory, kept in
+        <log_dir>/model_catalog.json: per model, the settings encoded in its
+        name (see parse_model_name; None for models named otherwise), its
+        observation mode and shape, and the timesteps it was trained for.
+
+        refresh() lists the directory once and reads only models that are new
+        or changed since they were indexed, so the catalog stays cheap to open
+        as the directory grows.  ddpg.py adds models when it saves them.
+    """
+
+    def __init__(self, log_dir, refresh=True):
+        self.log_dir = log_dir
+        self.path = os.path.join(log_dir, CATALOG_FILENAME)
+        self.models = {}
+        # files that aren't models, so they aren't read again
+        self.ignored = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                index = json.load(f)
+            self.models = index["models"]
+            self.ignored = index["ignored"]
+        if refresh:
+            self.refresh()
+
+    def save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"models" : self.models, "ignored" : self.ignored}, f, indent=1)
+        # atomic, so concurrent runs never read a partial index
+        os.replace(tmp_path, self.path)
+
+    def _index(self, name, stat):
+        data = read_model_data(os.path.join(self.log_dir, name))
+        if data is None:
+            self.models.pop(name, None)
+            self.ignored[name] = [stat.st_mtime, stat.st_size]
+            return
+        entry = {"name" : name, "mtime" : stat.st_mtime, "size" : stat.st_size}
+        entry.update(parse_model_name(name) or {"prefix" : name, "date" : None, "action_low" : None,
+            "action_high" : None, "timesteps" : None, "priors" : None, "copy" : 1})
+        entry.update(data)
+        self.ignored.pop(name, None)
+        self.models[name] = entry
+
+    def refresh(self):
+        """Indexes new and changed models and drops deleted ones.  Returns
+        whether the catalog changed."""
+        if not os.path.isdir(self.log_dir):
+            return False
+        changed = False
+        names = set()
+        with os.scandir(self.log_dir) as entries:
+            for entry in entries:
+                # checkpoints are resumed, not evaluated
+                if (entry.name.startswith(CATALOG_FILENAME) or os.path.splitext(entry.name)[0].endswith(CHECKPOINT_SUFFIX)
+                    or not entry.is_file()):
+                    continue
+                names.add(entry.name)
+                stat = entry.stat()
+                indexed = self.models.get(entry.name)
+                if indexed is not None:
+                    if indexed["mtime"] == stat.st_mtime and indexed["size"] == stat.st_size:
+                        continue
+                elif self.ignored.get(entry.name) == [stat.st_mtime, stat.st_size]:
+                    continue
+                self._index(entry.name, stat)
+                changed = True
+        for index in (self.models, self.ignored):
+            for name in set(index) - names:
+                del index[name]
+                changed = True
+        if changed:
+            self.save()
+        return changed
+
+    def add(self, name):
+        """Indexes the model just saved as name in the catalog's directory."""
+        self._index(name, os.stat(os.path.join(self.log_dir, name)))
+        self.save()
+        return self.models.get(name)
+
+    def unique_name(self, name):
+        """name, or name-<n> with the next free copy number if a model named
+        name (or a copy of it) is already catalogued."""
+        copies = [entry["copy"] for entry in self.models.values() if base_name(entry["name"]) == name]
+        if len(copies) == 0 and not os.path.exists(os.path.join(self.log_dir, name)):
+            return name
+        return name + "-" + str(max(copies, default=1) + 1)
+
+    def find(self, patterns=None, priors=None, obs=None):
+        """The catalogued models whose names match any of patterns (globs),
+        trained with priors and observation mode obs (if given), sorted by
+        name."""
+        entries = []
+        for name in sorted(self.models):
+            entry = self.models[name]
+            if patterns and not any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                continue
+            if priors is not None and (entry["priors"] is None or sorted(entry["priors"]) != sorted(priors)):
+                continue
+            if obs is not None and entry["obs"] != obs:
+                continue
+            entries.append(entry)
+        return entries
+
+    def model_path(self, entry):
+        return os.path.join(self.log_dir, entry["name"])
+
+    def to_dataframe(self, entries=None):
+        entries = list(self.models.values()) if entries is None else entries
+        columns = ["name", "prefix", "date", "priors", "obs", "timesteps", "num_timesteps", "action_low", "action_high"]
+        df = pd.DataFrame([{column : entry[column] for column in columns} for entry in entries], columns=columns)
+        df["priors"] = df["priors"].map(lambda priors: ".".join(priors) if priors is not None else None)
+        df["timesteps"] = df["timesteps"].astype("Int64")
+        return df
+
+class PolicyCache:
+    """
+    Description:
+        A least-recently-used cache of loaded models, keyed by path, holding at
+        most maxsize of them.  load is called with the path on a miss (by
+        default, DDPG.load onto the CPU).
+    """
+
+    def __init__(self, maxsize=8, load=None):
+        if load is None:
+            from stable_baselines3 import DDPG
+            load = lambda path: DDPG.load(path, device="cpu")
+        self.maxsize = maxsize
+        self.load = load
+        self.models = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        if path in self.models:
+            self.hits += 1
+            self.models.move_to_end(path)
+            return self.models[path]
+        self.misses += 1
+        model = self.load(path)
+        self.models[path] = model
+        while len(self.models) > self.maxsize:
+            self.models.popitem(last=False)
+        return model
+
+    def clear(self):
+        self.models.clear()
+
+def main():
+    parser = argparse.ArgumentParser(description='List the models in a directory with the settings they were trained with, updating the model catalog.  (Example usage: "python model_catalog.py -l cube_stacking_model -p COG HGT")')
+    parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='.', help='model directory')
+    parser.add_argument('--models', '-m', metavar='MODELS', type=str, nargs='+', default=None, help='model names or glob patterns to list (leave blank to list all)')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', default=None, help='list only models trained with this set of priors')
+    parser.add_argument('--obs', metavar='OBS', default=None, choices=['vector', 'visual', 'both'], help='list only models trained with these observations')
+
+    args = parser.parse_args()
+
+    catalog = ModelCatalog(args.log_dir)
+    entries = catalog.find(args.models, args.priors, args.obs)
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", None):
+        print(catalog.to_dataframe(entries).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import json
+import os
+
+import numpy as np
+
+def metadata_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+class PolicyRuntime:
+    """
+    Description:
+        Runs a policy exported by export_policy.py (TorchScript .pt or ONNX
+        .onnx, with its .json metadata sidecar) without stable-baselines3.
+
+        Observations are passed as StackerEnv returns them: an array, or a
+        dict of arrays for visual + vector observations.  act() scores one
+        observation, copying it into preallocated input tensors, and
+        act_batch() scores a batch (leading batch axis) in one call.  Actions
+        are in the environment's action range.  predict() has the signature
+        of SB3's predict, so a runtime can stand in for a model (e.g., in
+        evaluate.run_episodes).
+
+        ONNX modules require onnxruntime.
+    """
+
+    def __init__(self, path, num_threads=None):
+        with open(metadata_path(path)) as f:
+            self.metadata = json.load(f)
+        self.inputs = self.metadata["inputs"]
+        self.keys = [spec["name"] for spec in self.inputs] if self.metadata["dict_obs"] else None
+        self.dtypes = [np.dtype(spec["dtype"]) for spec in self.inputs]
+
+        if path.endswith(".onnx"):
+            try:
+                import onnxruntime
+            except ImportError as e:
+                raise ImportError("Running ONNX policies requires onnxruntime (pip install onnxruntime)") from e
+            options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            self._session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+            self._module = None
+            self._single_inputs = [np.zeros([1] + spec["shape"], dtype=dtype) for spec, dtype in zip(self.inputs, self.dtypes)]
+            self._single_arrays = self._single_inputs
+        else:
+            import torch
+            self._torch = torch
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            self._module = torch.jit.load(path, map_location="cpu").eval()
+            self._session = None
+            self._single_inputs = [torch.zeros([1] + spec["shape"], dtype=getattr(torch, dtype.name))
+                for spec, dtype in zip(self.inputs, self.dtypes)]
+            # numpy views of the single-observation input tensors
+            self._single_arrays = [x.numpy() for x in self._single_inputs]
+
+    def _split(self, obs):
+        if self.keys is None:
+            return [obs]
+        return [obs[key] for key in self.keys]
+
+    def _run(self, inputs):
+        if self._module is not None:
+            with self._torch.inference_mode():
+                return self._module(*inputs).numpy()
+        return self._session.run(None, {spec["name"] : x for spec, x in zip(self.inputs, inputs)})[0]
+
+    def act(self, obs):
+        """Returns the action for a single observation."""
+        for out, value in zip(self._single_arrays, self._split(obs)):
+            np.copyto(out[0], value, casting='unsafe')
+        return self._run(self._single_inputs)[0]
+
+    def act_batch(self, obs):
+        """Returns the actions for a batch of observations."""
+        inputs = [np.ascontiguousarray(value, dtype=dtype) for value, dtype in zip(self._split(obs), self.dtypes)]
+        if self._module is not None:
+            inputs = [self._torch.from_numpy(x) for x in inputs]
+        return self._run(inputs)
+
+    def predict(self, observation, state=None, episode_start=None, deterministic=True):
+        first = self._split(observation)[0]
+        if np.ndim(first) > len(self.inputs[0]["shape"]):
+            return self.act_batch(observation), state
+        return self.act(observation), state
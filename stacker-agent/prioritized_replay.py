@@ -0,0 +1,255 @@
+from typing import NamedTuple
+
+import numpy as np
+import torch as th
+from torch.nn import functional as F
+from stable_baselines3 import DDPG
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.utils import polyak_update
+
+SEARCH_LEVEL_SIZE = 1024
+
+class SumTree:
+    """
+    Description:
+        A binary tree over capacity leaves (priorities) in which every inner
+        node holds the sum, and the minimum, of the leaves below it.  Leaves
+        are found by prefix sum, and updated, in O(log capacity); both work on
+        arrays of leaves at once.
+
+        The tree is stored as an array of 2 * capacity nodes (rounded up to a
+        power of two), with the root at node 1, the children of node i at 2i
+        and 2i + 1, and leaf i at node size + i.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 2
+        while self.size < capacity:
+            self.size *= 2
+        self.sums = np.zeros((2 * self.size,), dtype=np.float64)
+        self.mins = np.full((2 * self.size,), np.inf, dtype=np.float64)
+        self.depth = self.size.bit_length() - 1
+        # find starts at the level of at most SEARCH_LEVEL_SIZE nodes
+        self.search_level = min(self.depth, SEARCH_LEVEL_SIZE.bit_length() - 1)
+
+    @property
+    def total(self):
+        return self.sums[1]
+
+    @property
+    def min(self):
+        return self.mins[1]
+
+    def __getitem__(self, leaves):
+        return self.sums[self.size + np.asarray(leaves)]
+
+    def update(self, leaves, priorities):
+        """Sets the priorities of leaves (arrays of leaf indices and
+        priorities) and updates their ancestors."""
+        nodes = self.size + np.asarray(leaves)
+        self.sums[nodes] = priorities
+        self.mins[nodes] = priorities
+        # a parent shared by several nodes is just written more than once
+        #  (with the same value), which is cheaper than deduplicating
+        sum_pairs = self.sums.reshape((-1, 2))
+        min_pairs = self.mins.reshape((-1, 2))
+        for _ in range(self.depth):
+            nodes = nodes // 2
+            self.sums[nodes] = sum_pairs[nodes].sum(axis=1)
+            self.mins[nodes] = min_pairs[nodes].min(axis=1)
+
+    def find(self, prefix_sums):
+        """Returns, for each prefix sum, the first leaf at which the running
+        sum of the priorities exceeds it."""
+        prefix_sums = np.array(prefix_sums, dtype=np.float64)
+        # the top levels are skipped with one binary search over the running
+        #  sums of a level's nodes, then the batch descends level by level
+        level = self.sums[1 << self.search_level:2 << self.search_level]
+        running_sums = np.cumsum(level)
+        nodes = np.searchsorted(running_sums, prefix_sums, side='right')
+        # never end in an empty node, which rounding could otherwise do for
+        #  prefix sums close to the total
+        nonempty = np.flatnonzero(level)
+        if len(nonempty) > 0:
+            np.minimum(nodes, nonempty[-1], out=nodes)
+        prefix_sums -= np.where(nodes > 0, running_sums[nodes - 1], 0.0)
+        nodes += 1 << self.search_level
+        for _ in range(self.depth - self.search_level):
+            nodes *= 2
+            left_sums = self.sums[nodes]
+            go_right = prefix_sums >= left_sums
+            go_right &= self.sums[nodes + 1] > 0
+            prefix_sums -= left_sums * go_right
+            nodes += go_right
+        return nodes - self.size
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: th.Tensor
+    actions: th.Tensor
+    next_observations: th.Tensor
+    dones: th.Tensor
+    rewards: th.Tensor
+    weights: th.Tensor
+    indices: np.ndarray
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Description:
+        Proportional prioritized experience replay (Schaul et al., 2016):
+        transition i is sampled with probability p_i^alpha / sum_j p_j^alpha,
+        where p_i is its last absolute TD error (plus epsilon), and new
+        transitions get the highest priority seen so far so they are replayed
+        at least once.  The priorities live in a SumTree, so sampling a batch
+        and updating its priorities are O(batch size * log buffer size).
+
+        Samples include importance-sampling weights (N * P(i))^-beta,
+        normalized by the largest possible weight, which correct for the
+        non-uniform sampling when applied to the loss; beta is annealed to 1
+        by PrioritizedDDPG.  Each transition of each env is a leaf of the
+        tree (leaf = buffer position * n_envs + env index).
+    """
+
+    def __init__(self, buffer_size, observation_space, action_space, device="auto", n_envs=1,
+        optimize_memory_usage=False, handle_timeout_termination=True, alpha=0.6, beta=0.4, epsilon=1e-6):
+        if optimize_memory_usage:
+            raise ValueError("PrioritizedReplayBuffer does not support optimize_memory_usage")
+        super().__init__(buffer_size, observation_space, action_space, device=device, n_envs=n_envs,
+            optimize_memory_usage=False, handle_timeout_termination=handle_timeout_termination)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+        self.tree = SumTree(self.buffer_size * self.n_envs)
+
+    @classmethod
+    def from_replay_buffer(cls, replay_buffer, **kwargs):
+        """Wraps the transitions of a uniform ReplayBuffer (without copying
+        them) in a PrioritizedReplayBuffer, all with the same priority."""
+        buffer = cls(replay_buffer.buffer_size, replay_buffer.observation_space, replay_buffer.action_space,
+            device=replay_buffer.device, n_envs=replay_buffer.n_envs,
+            handle_timeout_termination=replay_buffer.handle_timeout_termination, **kwargs)
+        for name in ["observations", "next_observations", "actions", "rewards", "dones", "timeouts", "pos", "full"]:
+            setattr(buffer, name, getattr(replay_buffer, name))
+        buffer.reset_priorities(np.arange(buffer.size()))
+        return buffer
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        self.reset_priorities(np.array([self.pos]))
+        super().add(obs, next_obs, action, reward, done, infos)
+
+    def reset_priorities(self, positions):
+        """Gives the transitions at buffer positions (of all envs) the highest
+        priority, e.g., after they were written."""
+        leaves = (np.asarray(positions)[:, None] * self.n_envs + np.arange(self.n_envs)).reshape(-1)
+        self.tree.update(leaves, np.full(leaves.shape, self.max_priority ** self.alpha))
+
+    def sample(self, batch_size, env=None):
+        # stratified: one prefix sum from each of batch_size equal segments
+        segment = self.tree.total / batch_size
+        prefix_sums = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        leaves = self.tree.find(prefix_sums)
+        return self._get_prioritized_samples(leaves, env)
+
+    def _get_prioritized_samples(self, leaves, env=None):
+        batch_inds, env_indices = np.divmod(leaves, self.n_envs)
+
+        probabilities = self.tree[leaves] / self.tree.total
+        max_weight = (self.size() * self.n_envs * self.tree.min / self.tree.total) ** -self.beta
+        weights = (self.size() * self.n_envs * probabilities) ** -self.beta / max_weight
+
+        data = (
+            self._normalize_obs(self.observations[batch_inds, env_indices, :], env),
+            self.actions[batch_inds, env_indices, :],
+            self._normalize_obs(self.next_observations[batch_inds, env_indices, :], env),
+            (self.dones[batch_inds, env_indices] * (1 - self.timeouts[batch_inds, env_indices])).reshape(-1, 1),
+            self._normalize_reward(self.rewards[batch_inds, env_indices].reshape(-1, 1), env),
+            weights.reshape(-1, 1).astype(np.float32),
+        )
+        return PrioritizedReplayBufferSamples(*tuple(map(self.to_torch, data)), leaves)
+
+    def update_priorities(self, leaves, td_errors):
+        """Sets the priorities of sampled transitions (the indices of the
+        samples) to their absolute TD errors."""
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(leaves, priorities ** self.alpha)
+
+class PrioritizedDDPG(DDPG):
+    """
+    Description:
+        DDPG trained on a PrioritizedReplayBuffer: the critic loss of each
+        sample is weighted by its importance-sampling weight, and the sampled
+        transitions' priorities are set to their new TD errors.  The
+        importance-sampling exponent beta is annealed linearly from the
+        buffer's initial beta to 1 over training.  The actor update is the
+        same as DDPG's.
+
+        Models saved from PrioritizedDDPG load with DDPG.load for testing.
+    """
+
+    def __init__(self, policy, env, replay_buffer_class=None, replay_buffer_kwargs=None, **kwargs):
+        super().__init__(policy, env, replay_buffer_class=PrioritizedReplayBuffer if replay_buffer_class is None else replay_buffer_class,
+            replay_buffer_kwargs=replay_buffer_kwargs, **kwargs)
+
+    def _setup_model(self):
+        super()._setup_model()
+        self.initial_beta = self.replay_buffer.beta
+
+    def load_replay_buffer(self, path, truncate_last_traj=True):
+        super().load_replay_buffer(path, truncate_last_traj)
+        # e.g., the buffer of a model trained with uniform replay
+        if not isinstance(self.replay_buffer, PrioritizedReplayBuffer):
+            self.replay_buffer = PrioritizedReplayBuffer.from_replay_buffer(self.replay_buffer, **self.replay_buffer_kwargs)
+
+    def train(self, gradient_steps, batch_size=100):
+        self.policy.set_training_mode(True)
+        self._update_learning_rate([self.actor.optimizer, self.critic.optimizer])
+        progress = min(1.0, 1.0 - self._current_progress_remaining)
+        self.replay_buffer.beta = self.initial_beta + (1.0 - self.initial_beta) * progress
+
+        actor_losses, critic_losses = [], []
+        for _ in range(gradient_steps):
+            self._n_updates += 1
+            replay_data = self.replay_buffer.sample(batch_size, env=self._vec_normalize_env)
+
+            with th.no_grad():
+                noise = replay_data.actions.clone().data.normal_(0, self.target_policy_noise)
+                noise = noise.clamp(-self.target_noise_clip, self.target_noise_clip)
+                next_actions = (self.actor_target(replay_data.next_observations) + noise).clamp(-1, 1)
+                next_q_values = th.cat(self.critic_target(replay_data.next_observations, next_actions), dim=1)
+                next_q_values, _ = th.min(next_q_values, dim=1, keepdim=True)
+                target_q_values = replay_data.rewards + (1 - replay_data.dones) * self.gamma * next_q_values
+
+            current_q_values = self.critic(replay_data.observations, replay_data.actions)
+
+            # importance-sampling weighted critic loss
+            critic_loss = sum((replay_data.weights * F.mse_loss(current_q, target_q_values, reduction="none")).mean()
+                for current_q in current_q_values)
+            critic_losses.append(critic_loss.item())
+
+            self.critic.optimizer.zero_grad()
+            critic_loss.backward()
+            self.critic.optimizer.step()
+
+            td_errors = (current_q_values[0] - target_q_values).detach().abs().cpu().numpy().reshape(-1)
+            self.replay_buffer.update_priorities(replay_data.indices, td_errors)
+
+            if self._n_updates % self.policy_delay == 0:
+                actor_loss = -self.critic.q1_forward(replay_data.observations, self.actor(replay_data.observations)).mean()
+                actor_losses.append(actor_loss.item())
+
+                self.actor.optimizer.zero_grad()
+                actor_loss.backward()
+                self.actor.optimizer.step()
+
+                polyak_update(self.critic.parameters(), self.critic_target.parameters(), self.tau)
+                polyak_update(self.actor.parameters(), self.actor_target.parameters(), self.tau)
+                polyak_update(self.critic_batch_norm_stats, self.critic_batch_norm_stats_target, 1.0)
+                polyak_update(self.actor_batch_norm_stats, self.actor_batch_norm_stats_target, 1.0)
+
+        self.logger.record("train/n_updates", self._n_updates, exclude="tensorboard")
+        if len(actor_losses) > 0:
+            self.logger.record("train/actor_loss", np.mean(actor_losses))
+        self.logger.record("train/critic_loss", np.mean(critic_losses))
+        self.logger.record("train/per_beta", self.replay_buffer.beta)
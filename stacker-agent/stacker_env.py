@@ -1,9 +1,40 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import gym
 from gym import spaces
 
 from mlagents_envs.environment import UnityEnvironment
 from mlagents_envs.base_env import ActionTuple
+from mlagents_envs.side_channel.engine_configuration_channel import EngineConfigurationChannel
+
+from telemetry import StepTelemetry, logger
+
+def vector_observation_space(priors, max_height=4, num_relations=5, obs_space_scale=1):
+    """Returns the vector observation space for a (sorted) list of priors.
+
+    StackingAgent observes, in this order, HGT (the stack height), REL (a
+    one-hot vector over the num_relations relations of the theme object to
+    the destination object) and COG (the theme center minus the stack center,
+    as a ratio of the stack size, which is unbounded: a theme object on the
+    floor can be several stack sizes away).
+    """
+    low, high = [], []
+    if 'HGT' in priors:
+        low.append(0.0)
+        high.append(float(max_height)*obs_space_scale)
+    if 'REL' in priors:
+        low.extend([0.0]*num_relations)
+        high.extend([1.0*obs_space_scale]*num_relations)
+    if 'COG' in priors:
+        low.extend([-np.inf]*2)
+        high.extend([np.inf]*2)
+    return spaces.Box(
+        np.array(low, dtype=np.float32),
+        np.array(high, dtype=np.float32),
+        dtype=np.float32
+    )
 
 class StackerEnv(gym.Env):
     """
@@ -61,21 +92,135 @@ class StackerEnv(gym.Env):
         should learn to produce action values that are closer to [0.0,0.0] in this
         action space. Considered solved when the average return is N-1 over 100
         episodes, where N is the number of interactable objects in the environment.
+
+    Engine Configuration:
+        time_scale, target_frame_rate and quality_level are sent to Unity at
+        startup through the ML-Agents engine configuration side channel, and
+        no_graphics launches a Unity build without rendering.  These are left
+        at the scene's settings if not specified.  no_graphics is only valid
+        with vector observations, since camera observations need rendering.
+        fast_simulation is a shortcut for a headless, accelerated configuration
+        (FAST_SIMULATION_CONFIG, plus no_graphics if a build is used and only
+        vector observations are requested); any explicitly passed value takes
+        precedence over it.
+
+    Observation Buffers:
+        Observations are written into buffers that are allocated once and
+        reused.  Two sets of buffers are used alternately, so an observation
+        returned by step() or reset() stays valid during the next step (e.g.,
+        while it is running asynchronously) and is overwritten by the one after
+        that (observations returned on termination are kept in separate
+        buffers, which are overwritten two terminations later).  Copy them to
+        keep them around.  With compact_visual_obs (the default), visual
+        observations are stored as uint8 (0-255) in both visual and dict mode,
+        and normalized by the policy; otherwise they are float32, in 0-255 for
+        visual observations and in 0-1 for dict observations, as in models
+        trained before compact observations were introduced.
+
+    Resetting:
+        When an episode ends, Unity starts the next one by itself, re-placing
+        the objects (StackingAgent.OnEpisodeBegin).  With soft_reset (the
+        default), reset() after the end of an episode just waits for the first
+        decision of that episode instead of resetting the whole environment,
+        which is only done on the first reset, after a reset in the middle of an
+        episode, with reset(full=True) (e.g., to start from a new seed), or
+        without soft_reset.  initial_observation() returns the
+        observation the current episode started with.  Reset latencies are
+        kept by the telemetry (see StepTelemetry.reset_summary).
+
+    Asynchronous Stepping:
+        step_async(action) sends the action and steps Unity in a background
+        thread and returns immediately, and step_wait() returns the result of
+        that step, so the caller can do other work (bookkeeping, stepping other
+        environments) while Unity simulates the placement.  Only one step can
+        be in progress at a time; step(), reset() and close() must not be
+        called between step_async() and step_wait().
+
+    Telemetry:
+        Diagnostic messages go to the "stacker" logger (see telemetry.py) and
+        are silent unless logging is configured.  Per-step records (action,
+        reward, done, observation and the timings of each phase of a step) are
+        kept by telemetry, a StepTelemetry or a callable that takes the worker
+        id and returns one, which records nothing by default.
+
+    Backend:
+        By default, StackerEnv launches (or connects to) Unity.  Any other
+        mlagents_envs BaseEnv, such as the pure-Python StackerSimEnvironment in
+        stacker_sim.py, can be passed as backend instead, either as an instance
+        or as a callable that creates one (e.g., to create it in a
+        subprocess).  Engine configuration does not apply to other backends.
     """
 
+    FAST_SIMULATION_CONFIG = {
+        "time_scale" : 20.0,
+        "target_frame_rate" : -1,
+        "quality_level" : 0
+    }
+
     def __init__(self,
         environment_filename=None,
         visual_observation=False,
         vector_observation=False,
-        priors=[]):
-        self._env = UnityEnvironment(environment_filename,0)
-        self.seed()
-        self.resetting = False
-        self.num_timesteps = 0
-        
+        priors=[],
+        worker_id=0,
+        fast_simulation=False,
+        time_scale=None,
+        target_frame_rate=None,
+        quality_level=None,
+        no_graphics=None,
+        backend=None,
+        soft_reset=True,
+        compact_visual_obs=True,
+        telemetry=None,
+        seed=None):
         self.visual_obs = visual_observation
         self.vector_obs = vector_observation
         self.dict_obs = self.visual_obs and self.vector_obs
+        self.compact_visual_obs = compact_visual_obs
+        self.soft_reset = soft_reset
+
+        if fast_simulation:
+            time_scale = self.FAST_SIMULATION_CONFIG["time_scale"] if time_scale is None else time_scale
+            target_frame_rate = self.FAST_SIMULATION_CONFIG["target_frame_rate"] if target_frame_rate is None else target_frame_rate
+            quality_level = self.FAST_SIMULATION_CONFIG["quality_level"] if quality_level is None else quality_level
+            # the Editor always renders, so no_graphics only applies to builds
+            if no_graphics is None:
+                no_graphics = (environment_filename is not None) and not self.visual_obs
+
+        self.no_graphics = bool(no_graphics)
+        if self.no_graphics and self.visual_obs:
+            raise ValueError("no_graphics cannot be used with visual observations (camera observations require rendering)")
+
+        self.engine_configuration_channel = EngineConfigurationChannel()
+        self.engine_configuration_channel.set_configuration_parameters(
+            time_scale=time_scale,
+            target_frame_rate=target_frame_rate,
+            quality_level=quality_level)
+
+        # each instance listens on base_port + worker_id, so multiple
+        #  environments running side by side need distinct worker ids
+        self.worker_id = worker_id
+        if telemetry is None:
+            self.telemetry = StepTelemetry(worker_id=self.worker_id)
+        elif callable(telemetry):
+            self.telemetry = telemetry(worker_id=self.worker_id)
+        else:
+            self.telemetry = telemetry
+
+        if backend is None:
+            # Unity only takes a seed when it is launched
+            unity_kwargs = {} if seed is None else {"seed" : int(seed)}
+            self._env = UnityEnvironment(environment_filename,self.worker_id,
+                no_graphics=self.no_graphics,
+                side_channels=[self.engine_configuration_channel],
+                **unity_kwargs)
+        elif callable(backend):
+            self._env = backend()
+        else:
+            self._env = backend
+        self.seed(seed)
+        self.resetting = False
+        self.num_timesteps = 0
         
         self.raw_image_space = spaces.Box(
             0,
@@ -94,74 +239,14 @@ class StackerEnv(gym.Env):
         max_height = 4
         num_relations = 5
         obs_space_scale = 1
+        self.obs_space_scale = obs_space_scale
         
         self.priors = priors
-                
-        # height only
-        if self.priors == ['HGT']:
-            self.vector_obs_space = spaces.Box(
-                0.0,
-                float(max_height)*obs_space_scale,
-                dtype=np.float32,
-                shape=(1,)
-            )
-        
-        # relations only
-        if self.priors == ['REL']:
-            self.vector_obs_space = spaces.Box(
-                np.zeros(shape=(num_relations,)),
-                np.ones(shape=(num_relations,))*obs_space_scale,
-                dtype=np.float32,
-                shape=(5,)
-            )
-        
-        # CoG only
-        if self.priors == ['COG']:
-            self.vector_obs_space = spaces.Box(
-                np.array([-1.0*obs_space_scale,-1.0*obs_space_scale]),
-                np.array([1.0*obs_space_scale,1.0*obs_space_scale]),
-                dtype=np.float32,
-                shape=(2,)
-            )
-        
-        # height and relations
-        if self.priors == ['HGT','REL']:
-            self.vector_obs_space = spaces.Box(
-                np.array([0.0,0.0]),
-                np.array([float(max_height)*obs_space_scale,float(num_relations)*obs_space_scale]),
-                dtype=np.float32,
-                shape=(2,)
-            )
-        
-        # height and CoG
-        if self.priors == ['COG','HGT']:
-            self.vector_obs_space = spaces.Box(
-                np.array([0.0,-1.0*obs_space_scale,-1.0*obs_space_scale]),
-                np.array([float(max_height)*obs_space_scale,1.0*obs_space_scale,1.0*obs_space_scale]),
-                dtype=np.float32,
-                shape=(3,)
-            )
-        
-        # relations and CoG
-        if self.priors == ['COG','REL']:
-            self.vector_obs_space = spaces.Box(
-                np.array([0.0,-1.0*obs_space_scale,-1.0*obs_space_scale]),
-                np.array([float(num_relations)*obs_space_scale,1.0*obs_space_scale,1.0*obs_space_scale]),
-                dtype=np.float32,
-                shape=(3,)
-            )
+        self.vector_obs_space = vector_observation_space(self.priors, max_height, num_relations, obs_space_scale)
         
-        # all
-        if self.priors == ['COG','HGT','REL']:
-            self.vector_obs_space = spaces.Box(
-                np.array([0.0,0.0,-1.0*obs_space_scale,-1.0*obs_space_scale]),
-                np.array([float(max_height)*obs_space_scale,float(num_relations)*obs_space_scale,\
-                    -1.0*obs_space_scale,1.0*obs_space_scale]),
-                dtype=np.float32,
-                shape=(4,)
-            )
-        
-        if self.dict_obs:
+        if self.compact_visual_obs:
+            self.image_space = self.raw_image_space
+        elif self.dict_obs:
             self.image_space = self.normalized_image_space
         elif self.visual_obs:
             self.image_space = self.raw_image_space
@@ -171,11 +256,11 @@ class StackerEnv(gym.Env):
                 
         # get behavior name from Unity
         self.behavior_name = list(self._env.behavior_specs)[0]
-        print(self.behavior_name)
+        logger.info("Behavior name: %s", self.behavior_name)
 
         # get behavior spec
         self.behavior_spec = self._env.behavior_specs[self.behavior_name]
-        print(self.behavior_spec)
+        logger.info("Behavior spec: %s", self.behavior_spec)
 
         # define action and observation space
         # action: where on the surface of the target block do I put my object?
@@ -194,146 +279,243 @@ class StackerEnv(gym.Env):
         elif self.vector_obs:
             self.observation_space = self.vector_obs_space
 
-        self.last_action = np.array([-float('inf'),-float('inf')])
-        self.last_obs = {}
+        # "no action" sentinel, ignored by Unity
+        self._noop_action = np.array([-float('inf'),-float('inf')], dtype=np.float32)
+        self.last_action = self._noop_action.copy()
+
+        # preallocated buffers for actions sent to Unity and observations returned
+        self._action_buffer = np.zeros((1, self.action_space.shape[0]), dtype=np.float32)
+        self._obs_buffers = [self._new_obs_buffers(), self._new_obs_buffers()]
+        self._terminal_obs_buffers = [self._new_obs_buffers(), self._new_obs_buffers()]
+        self._buffer_index = 0
+        self._terminal_buffer_index = 0
+        self._initial_obs_buffers = self._new_obs_buffers()
+        self._initial_obs = None
+
+        # episode state for soft resets
+        self._episode_done = False
+        self._next_episode_steps = None
+
+        # background thread and action of step_async
+        self._step_executor = None
+        self._pending_step = None
+        self._pending_action = np.zeros_like(self._action_buffer)
 
     def step(self, action):
+        self._check_no_pending_step("step")
+        return self._step(action)
+
+    def step_async(self, action):
+        self._check_no_pending_step("step_async")
+        if self._step_executor is None:
+            self._step_executor = ThreadPoolExecutor(max_workers=1)
+        # the caller may reuse its action array while the step runs
+        np.copyto(self._pending_action, np.reshape(action, self._pending_action.shape), casting='unsafe')
+        self._pending_step = self._step_executor.submit(self._step, self._pending_action)
+
+    def step_wait(self):
+        if self._pending_step is None:
+            raise RuntimeError("step_wait called without a step in progress (call step_async first)")
+        try:
+            return self._pending_step.result()
+        finally:
+            self._pending_step = None
+
+    def _check_no_pending_step(self, method_name):
+        if self._pending_step is not None:
+            raise RuntimeError("%s called while an asynchronous step is in progress (call step_wait first)" % method_name)
+
+    def _swap_obs_buffers(self):
+        self._buffer_index = 1 - self._buffer_index
+
+    def _step(self, action):
         self.num_timesteps += 1
         if self.resetting:
             self.resetting = False
         
-        print("last_action:",self.last_action)
-        print("action:",action)
-        self._env.set_actions(self.behavior_name, ActionTuple(continuous=action.reshape((1,-1))))
-        print("action shape:", action.reshape((1, -1)).shape)
+        logger.debug("Step %s action: %s", self.num_timesteps, action)
+        start_time = time.perf_counter()
+        np.copyto(self._action_buffer, np.reshape(action, self._action_buffer.shape), casting='unsafe')
+        self._env.set_actions(self.behavior_name, ActionTuple(continuous=self._action_buffer))
+        set_actions_time = time.perf_counter()
         self._env.step()
+        step_time = time.perf_counter()
         step_info, terminal_info = self._env.get_steps(self.behavior_name)
-
-        obs = 1
+        get_steps_time = time.perf_counter()
 
         done = (len(terminal_info) != 0)
+        self._swap_obs_buffers()
         
         if done:
-            print("Step %s\nTerminated\n\tObservation: %s\tReward: %s\tInterrupted: %s" % (self.num_timesteps,terminal_info.obs,terminal_info.reward,terminal_info.interrupted))
+            logger.debug("Step %s terminated\n\tObservation: %s\tReward: %s\tInterrupted: %s", self.num_timesteps, terminal_info.obs, terminal_info.reward, terminal_info.interrupted)
             
-            if self.dict_obs:
-                obs["visual_obs"] = terminal_info.obs[0]
-                obs["vector_obs"] = terminal_info.obs[1]
-            else:
-                obs = terminal_info.obs[0]
+            self._terminal_buffer_index = 1 - self._terminal_buffer_index
+            obs = self._fill_obs(terminal_info.obs, 0, self._terminal_obs_buffers[self._terminal_buffer_index])
             reward = terminal_info.reward[0]
-            self.last_action = np.array([-float('inf'),-float('inf')])
+            self._episode_done = True
+            # the next episode's first decision may arrive with the terminal step
+            self._next_episode_steps = step_info if len(step_info) > 0 else None
+            np.copyto(self.last_action, self._noop_action)
         else:
-            self.last_obs = obs
-            self.last_action = action
+            np.copyto(self.last_action, self._action_buffer[0])
         
-            if self.dict_obs:
-                obs = {}
-                            
-                if step_info.obs[0].shape[0] > 0:
-                    obs["visual_obs"] = step_info.obs[0]
-                else:
-                    print("step_info.obs[0].shape = ", step_info.obs[0].shape, "setting visual_obs to black")
-                    obs["visual_obs"] = np.zeros(self.image_space.shape, dtype=self.image_space.dtype)
-                    
-                if step_info.obs[1].shape[0] > 0:
-                    obs["vector_obs"] = step_info.obs[1]
-                else:
-                    print("step_info.obs[1].shape = ", step_info.obs[1].shape, "setting vector_obs to 0")
-                    obs["vector_obs"] = 0
-            else:
-                if step_info.obs[0].shape[0] > 0:
-                    obs = step_info.obs[0]
-                    
-                    if self.visual_obs:
-                        obs = (obs*255).astype('float32')
-                else:
-                    if self.visual_obs:
-                        print("step_info.obs[0].shape =", step_info.obs[0].shape[0], "setting visual_obs to black")
-                        obs = np.zeros(self.image_space.shape, dtype=self.image_space.dtype)
-                    elif self.vector_obs:
-                        print("step_info.obs[0].shape =", step_info.obs[0].shape[0], "setting vector_obs to 0")
-                        obs = 0
-
-            print("Step %s\n\tObservation: %s\tReward: %s" % (self.num_timesteps,step_info.obs,step_info.reward))
-            if not np.allclose(action,self.last_action):
-                print("last observation:",self.last_obs)
+            obs = self._fill_obs(step_info.obs, 0, self._obs_buffers[self._buffer_index])
+
+            logger.debug("Step %s\n\tObservation: %s\tReward: %s", self.num_timesteps, step_info.obs, step_info.reward)
 
             if step_info.reward.shape[0] > 0:
                 reward = step_info.reward[0]
             else:
-                print("step_info.reward.shape =", step_info.reward.shape, "setting reward to 0")
+                logger.debug("step_info.reward.shape = %s, setting reward to 0", step_info.reward.shape)
                 reward = 0
-                
-            if not np.allclose(action,self.last_action):
-                print("reward:",reward)
+
+        self.telemetry.record(self.num_timesteps, self._action_buffer, obs, reward, done,
+            (set_actions_time - start_time, step_time - set_actions_time, get_steps_time - step_time))
 
         info = {}
         return obs, reward, done, info
 
-    def reset(self):
+    def reset(self, full=False):
+        self._check_no_pending_step("reset")
         if self.resetting:
-            return
-        print("Resetting")
+            return self._initial_obs
+        logger.debug("Resetting")
         #if self.num_timesteps > 10
         #    assert False
         self.resetting = True
-        self.seed()
-        
-        # reset the base environment and get the resulting observation
-        self._env.reset()
-        obs = self._env._env_state[self.behavior_name][0].obs[0]
-        
-        if obs is None:
-            if self.dict_obs:
-                obs = {}
-                obs["visual_obs"] = np.zeros(self.image_space.shape, dtype=self.image_space.dtype)
-                obs["vector_obs"] = np.array([1+np.random.normal(0,0.1,1)[0]]) # add gaussian noise
-            elif self.visual_obs:
-                obs = np.zeros(self.image_space.shape, dtype=self.image_space.dtype)
-            elif self.vector_obs:
-                if self.priors == ['HGT']:
-                    obs = np.array([obs_space_scale])
-            
-                if self.priors == ['REL']:
-                    obs = np.array([0])
-
-                if self.priors == ['COG']:
-                    obs = np.array([0,0])
-            
-                if self.priors == ['HGT','REL']:
-                    obs = np.array([obs_space_scale,0])
+        start_time = time.perf_counter()
 
-                if self.priors == ['COG','HGT']:
-                    obs = np.array([obs_space_scale,0,0])
+        soft = self.soft_reset and self._episode_done and not full
+        if soft:
+            # Unity starts the next episode (re-placing the objects) by itself
+            #  when an episode ends, so wait for its first decision instead of
+            #  reloading the scene
+            decision_steps = self._wait_for_next_episode()
+        else:
+            # reset the base environment and get the resulting observation
+            self._env.reset()
+            decision_steps, _ = self._env.get_steps(self.behavior_name)
 
-                if self.priors == ['COG','REL']:
-                    obs = np.array([0,0,0])
-            
-                if self.priors == ['COG','HGT','REL']:
-                    obs = np.array([obs_space_scale,0,0,0])
+        if len(decision_steps) > 0:
+            obs = self._fill_obs(decision_steps.obs, 0, self._initial_obs_buffers)
+        else:
+            obs = self._default_initial_obs()
+            logger.debug("obs is None, setting obs to %s", obs)
 
-            print("obs is None, setting obs to", obs)
+        self._initial_obs = obs
+        self._episode_done = False
+        self._next_episode_steps = None
+        self.telemetry.record_reset(time.perf_counter() - start_time, soft)
         self.resetting = False
         return obs
 
+    def initial_observation(self):
+        """Returns the first observation of the current episode (as returned by
+        reset()), or None before the first reset."""
+        return self._initial_obs
+
+    def _wait_for_next_episode(self):
+        decision_steps = self._next_episode_steps
+        while decision_steps is None or len(decision_steps) == 0:
+            self._env.step()
+            decision_steps, _ = self._env.get_steps(self.behavior_name)
+        return decision_steps
+
+    def _default_initial_obs(self):
+        # used when Unity has no decision pending right after a full reset; the
+        #  stack height is 1 at the start of an episode, with no relations or CoG yet
+        vector_obs = np.zeros(self.vector_obs_space.shape, dtype=np.float32)
+        if 'HGT' in self.priors:
+            vector_obs[0] = self.obs_space_scale
+        if self.dict_obs:
+            obs = {}
+            obs["visual_obs"] = np.zeros(self.image_space.shape, dtype=self.image_space.dtype)
+            obs["vector_obs"] = vector_obs
+        elif self.visual_obs:
+            obs = np.zeros(self.image_space.shape, dtype=self.image_space.dtype)
+        elif self.vector_obs:
+            obs = vector_obs
+        return obs
+
+    def _new_obs_buffers(self):
+        specs = self.behavior_spec.observation_specs
+        image_dtype = np.uint8 if self.compact_visual_obs else np.float32
+        if self.dict_obs:
+            return {
+                "visual_obs" : np.zeros(specs[0].shape, dtype=image_dtype),
+                "vector_obs" : np.zeros(specs[1].shape, dtype=np.float32)
+            }
+        elif self.visual_obs:
+            return np.zeros(specs[0].shape, dtype=image_dtype)
+        else:
+            return np.zeros(specs[0].shape, dtype=np.float32)
+
+    def _fill_obs(self, step_obs, agent_index, out):
+        """Writes the observation of one agent from a batch of observations
+        from Unity (DecisionSteps.obs or TerminalSteps.obs) into out, which is
+        one of the buffers created by _new_obs_buffers, and returns out."""
+        if self.dict_obs:
+            self._fill_visual_obs(step_obs[0], agent_index, out["visual_obs"])
+            self._fill_vector_obs(step_obs[1], agent_index, out["vector_obs"])
+        elif self.visual_obs:
+            self._fill_visual_obs(step_obs[0], agent_index, out)
+        else:
+            self._fill_vector_obs(step_obs[0], agent_index, out)
+        return out
+
+    def _fill_visual_obs(self, batch, agent_index, out):
+        if batch.shape[0] <= agent_index:
+            logger.debug("visual obs shape = %s, setting visual_obs to black", batch.shape)
+            out.fill(0)
+        elif self.compact_visual_obs:
+            # Unity sends [0,1] floats; keep them as 0-255 bytes, converted
+            #  (truncated) in one pass without a float scratch buffer
+            np.multiply(batch[agent_index], 255, out=out, casting='unsafe')
+        elif self.dict_obs:
+            np.copyto(out, batch[agent_index])
+        else:
+            np.multiply(batch[agent_index], 255, out=out)
+
+    def _fill_vector_obs(self, batch, agent_index, out):
+        if batch.shape[0] <= agent_index:
+            logger.debug("vector obs shape = %s, setting vector_obs to 0", batch.shape)
+            out.fill(0)
+        else:
+            np.copyto(out, batch[agent_index])
+
     #def render(self, mode='rgb_array'):
         #return self.visual_obs
 
     def close(self):
+        if self._pending_step is not None:
+            self.step_wait()
+        if self._step_executor is not None:
+            self._step_executor.shutdown()
+            self._step_executor = None
+        self.telemetry.close()
         self._env.close()
         
     def seed(self, seed=None):
         """Sets a fixed seed for this env's random number generator(s).
         The valid range for seeds is [0, 99999). By default a random seed
         will be chosen.
+
+        Backends with a seed method (e.g., the stacking simulator) are reseeded
+        right away, which applies from their next episode.  Unity can only be
+        seeded when it is launched (the seed argument of StackerEnv), so seeds
+        set later only take effect for Unity environments created with them.
         """
         if seed is None:
             self._seed = seed
-            return
+            return [seed]
 
         seed = int(seed)
         if seed < 0 or seed >= 99999:
-            print("Seed outside of valid range [0, 99999). A random seed within the valid range will be used on next reset.")
-        print("New seed " + str(seed) + " will apply on next reset.")
+            logger.warning("Seed outside of valid range [0, 99999). A random seed within the valid range will be used on next reset.")
         self._seed = seed
+        if hasattr(self._env, "seed"):
+            self._env.seed(seed)
+            logger.debug("New seed %s will apply from the next episode.", seed)
+        else:
+            logger.debug("New seed %s will apply when a new Unity environment is launched.", seed)
+        return [seed]
@@ -0,0 +1,367 @@
+import numpy as np
+
+from mlagents_envs.base_env import ActionSpec, ActionTuple, BaseEnv, BehaviorMapping, BehaviorSpec, \
+    DecisionSteps, DimensionProperty, ObservationSpec, ObservationType, TerminalSteps
+
+class StackerSimEnvironment(BaseEnv):
+    """
+    Description:
+        A pure-Python stand-in for the Unity stacking scene that implements the
+        parts of the mlagents_envs environment interface used by StackerEnv
+        (behavior_specs, set_actions, step, get_steps, reset, close), so that
+        training, testing and benchmarking can run headless without Unity.
+
+        Each agent has its own arena with num_objects blocks that start on the
+        floor.  Blocks are modeled as axis-aligned squares (seen from above)
+        with the sizes given in object_sizes.  As in StackingAgent, the theme
+        object is the lowest object not in the stack and the destination object
+        is the top of the stack.
+
+    Actions:
+        Actions are converted to a placement on the top surface of the
+        destination object the same way ContinuousStackingAgent does:
+        offset = .01 * (action - (high-low) * (1+target_action) * .5), as a
+        ratio of the destination object's size.  Gaussian jitter with standard
+        deviation placement_noise (as a ratio of the theme object's size)
+        stands in for the random force applied after each placement.  The
+        action [-inf,-inf] is ignored, as in Unity.
+
+    Physics:
+        After each placement, every block in the stack must support the center
+        of gravity of all blocks above it (the combined center must lie on its
+        top face).  The lowest block that fails this test keeps its position
+        and all blocks above it fall to the floor.  A theme object placed
+        completely off the destination object falls to the floor.
+
+    Observation:
+        Vector observations are constructed as in StackingAgent:
+        HGT (number of objects in the stack), then REL (support, left, right,
+        in_front, behind of the theme object w.r.t. the destination object),
+        then COG (theme center - stack center, as a ratio of the stack size),
+        for each prior given in priors.  With visual_observation, an 84x84x3
+        top-down rendering of the arena (brighter is higher) is observed first.
+
+    Reward:
+        As in StackingAgent, with cur/last the stack height after/before a
+        placement: (cur-last)*(cur-1)*pos_reward_multiplier, decayed by the
+        number of attempts, if the stack grew, otherwise
+        ((cur-last)-1)*neg_reward_multiplier.
+
+    Episode Termination:
+        All objects are stacked, or max_attempts placements have been made.
+        A new episode is started right away, so the terminated agent also
+        appears in the next DecisionSteps, as with the Unity scene.
+    """
+
+    BEHAVIOR_NAME = "StackingAgent?team=0"
+
+    IMAGE_SHAPE = (84, 84, 3)
+
+    def __init__(self,
+        num_objects=2,
+        priors=['COG','HGT'],
+        visual_observation=False,
+        vector_observation=True,
+        n_agents=1,
+        object_sizes=None,
+        max_attempts=10,
+        pos_reward_multiplier=1000.0,
+        neg_reward_multiplier=1.0,
+        observation_space_scale=1.0,
+        action_space_low=(0.0,0.0),
+        action_space_high=(1000.0,1000.0),
+        target_action=(0.0,0.0),
+        placement_noise=0.05,
+        noisy_vectors=False,
+        floor_extent=0.5,
+        seed=None):
+        self.num_objects = num_objects
+        self.priors = sorted(priors)
+        self.visual_obs = visual_observation
+        self.vector_obs = vector_observation
+        self.n_agents = n_agents
+        self.object_sizes = np.full((num_objects,), 0.1) if object_sizes is None else np.asarray(object_sizes, dtype=np.float64)
+        self.max_attempts = max_attempts
+        self.pos_reward_multiplier = pos_reward_multiplier
+        self.neg_reward_multiplier = neg_reward_multiplier
+        self.observation_space_scale = observation_space_scale
+        self.action_center = (np.asarray(action_space_high) - np.asarray(action_space_low)) * \
+            ((1.0 + np.asarray(target_action)) * .5)
+        self.placement_noise = placement_noise
+        self.noisy_vectors = noisy_vectors
+        self.floor_extent = floor_extent
+
+        self.rng = np.random.default_rng(seed)
+
+        self.vector_size = 0
+        if 'HGT' in self.priors:
+            self.vector_size += 1
+        if 'REL' in self.priors:
+            self.vector_size += 5
+        if 'COG' in self.priors:
+            self.vector_size += 2
+
+        observation_specs = []
+        if self.visual_obs:
+            observation_specs.append(ObservationSpec(self.IMAGE_SHAPE,
+                (DimensionProperty.TRANSLATIONAL_EQUIVARIANCE, DimensionProperty.TRANSLATIONAL_EQUIVARIANCE, DimensionProperty.NONE),
+                ObservationType.DEFAULT, "CameraSensor"))
+        if self.vector_obs:
+            observation_specs.append(ObservationSpec((self.vector_size,),
+                (DimensionProperty.NONE,), ObservationType.DEFAULT, "VectorSensor"))
+
+        self._behavior_spec = BehaviorSpec(observation_specs, ActionSpec.create_continuous(2))
+        self._behavior_specs = BehaviorMapping({self.BEHAVIOR_NAME : self._behavior_spec})
+
+        self._arenas = [_SimArena(self, i) for i in range(self.n_agents)]
+        self._actions = None
+        self._decision_agents = []
+        self._terminal_agents = []
+        self._terminal_obs = {}
+        self._terminal_rewards = {}
+        self._rewards = np.zeros((self.n_agents,), dtype=np.float32)
+
+    @property
+    def behavior_specs(self):
+        return self._behavior_specs
+
+    def seed(self, seed=None):
+        """Reseeds the random number generator (applies to the next episode)."""
+        self.rng = np.random.default_rng(seed)
+
+    def reset(self):
+        for arena in self._arenas:
+            arena.begin_episode()
+        self._decision_agents = list(range(self.n_agents))
+        self._terminal_agents = []
+        self._terminal_obs = {}
+        self._terminal_rewards = {}
+        self._rewards[:] = 0
+        self._actions = None
+
+    def set_actions(self, behavior_name, action):
+        self._check_behavior_name(behavior_name)
+        self._actions = np.asarray(action.continuous, dtype=np.float64).reshape((len(self._decision_agents), -1))
+
+    def set_action_for_agent(self, behavior_name, agent_id, action):
+        self._check_behavior_name(behavior_name)
+        if agent_id not in self._decision_agents:
+            return
+        if self._actions is None:
+            # agents without an action get an empty (zero) action, as in mlagents_envs
+            self._actions = np.zeros((len(self._decision_agents), 2))
+        self._actions[self._decision_agents.index(agent_id)] = np.asarray(action.continuous).reshape(-1)
+
+    def step(self):
+        actions = self._actions
+        if actions is None:
+            actions = np.zeros((len(self._decision_agents), 2))
+        self._actions = None
+
+        self._terminal_agents = []
+        self._terminal_obs = {}
+        self._terminal_rewards = {}
+        self._rewards[:] = 0
+
+        for j, agent_id in enumerate(self._decision_agents):
+            if not np.all(np.isfinite(actions[j])):
+                # invalid action: the agent keeps waiting for a decision
+                continue
+            arena = self._arenas[agent_id]
+            reward, done = arena.place(actions[j])
+            if done:
+                self._terminal_agents.append(agent_id)
+                self._terminal_obs[agent_id] = arena.observe()
+                self._terminal_rewards[agent_id] = reward
+                arena.begin_episode()
+            else:
+                self._rewards[agent_id] = reward
+
+        # all arenas resolve their placements within a single step
+        self._decision_agents = list(range(self.n_agents))
+
+    def get_steps(self, behavior_name):
+        self._check_behavior_name(behavior_name)
+
+        decision_obs = [arena.observe() for arena in self._arenas]
+        decision_steps = DecisionSteps(
+            self._batch_obs(decision_obs),
+            self._rewards.copy(),
+            np.arange(self.n_agents, dtype=np.int32),
+            None,
+            np.zeros((self.n_agents,), dtype=np.int32),
+            np.zeros((self.n_agents,), dtype=np.float32))
+
+        if len(self._terminal_agents) == 0:
+            return decision_steps, TerminalSteps.empty(self._behavior_spec)
+
+        terminal_steps = TerminalSteps(
+            self._batch_obs([self._terminal_obs[agent_id] for agent_id in self._terminal_agents]),
+            np.array([self._terminal_rewards[agent_id] for agent_id in self._terminal_agents], dtype=np.float32),
+            np.zeros((len(self._terminal_agents),), dtype=bool),
+            np.array(self._terminal_agents, dtype=np.int32),
+            np.zeros((len(self._terminal_agents),), dtype=np.int32),
+            np.zeros((len(self._terminal_agents),), dtype=np.float32))
+        return decision_steps, terminal_steps
+
+    def close(self):
+        pass
+
+    def _batch_obs(self, agent_obs):
+        return [np.stack([obs[k] for obs in agent_obs]) for k in range(len(self._behavior_spec.observation_specs))]
+
+    def _check_behavior_name(self, behavior_name):
+        if behavior_name != self.BEHAVIOR_NAME:
+            raise KeyError("Unknown behavior name %s (expected %s)" % (behavior_name, self.BEHAVIOR_NAME))
+
+class _SimArena:
+    """State of a single stacking arena in a StackerSimEnvironment."""
+
+    def __init__(self, sim, index):
+        self.sim = sim
+        self.index = index
+        self.positions = np.zeros((sim.num_objects, 2))
+        self.stack = []
+        self.theme = None
+        self.cog = np.zeros((2,))
+        self.num_attempts = 0
+        self.cur_num_stacked = 1
+        self.last_num_stacked = 1
+
+    def begin_episode(self):
+        self.positions = self._random_floor_positions(self.sim.num_objects)
+        self.stack = [0]
+        self.theme = self._select_theme()
+        self.num_attempts = 0
+        self.cur_num_stacked = 1
+        self.last_num_stacked = 1
+        self.cog = self._center_of_gravity()
+
+    def place(self, action):
+        sim = self.sim
+        self.num_attempts += 1
+
+        dest = self.stack[-1]
+        offset = .01 * (np.asarray(action) - sim.action_center)
+        self.positions[self.theme] = self.positions[dest] + offset * sim.object_sizes[dest]
+        self.cog = self._center_of_gravity()
+
+        # jitter standing in for the force applied after the placement
+        self.positions[self.theme] += sim.rng.normal(0.0, sim.placement_noise, 2) * sim.object_sizes[self.theme]
+
+        fallen = []
+        if np.any(np.abs(self.positions[self.theme] - self.positions[dest]) >=
+                (sim.object_sizes[dest] + sim.object_sizes[self.theme]) * .5):
+            fallen = [self.theme]
+        else:
+            self.stack.append(self.theme)
+            fallen = self._collapse()
+
+        if len(fallen) > 0:
+            self.positions[fallen] = self._random_floor_positions(len(fallen))
+
+        self.last_num_stacked = self.cur_num_stacked
+        self.cur_num_stacked = len(self.stack)
+
+        reward = self._reward()
+
+        done = (self.cur_num_stacked == sim.num_objects) or (self.num_attempts >= sim.max_attempts)
+        if not done:
+            self.theme = self._select_theme()
+        return reward, done
+
+    def observe(self):
+        obs = []
+        if self.sim.visual_obs:
+            obs.append(self._render())
+        if self.sim.vector_obs:
+            obs.append(self._vector_observation())
+        return obs
+
+    def _collapse(self):
+        sizes = self.sim.object_sizes
+        masses = sizes ** 3
+        for k in range(len(self.stack) - 1):
+            above = self.stack[k+1:]
+            center = np.average(self.positions[above], axis=0, weights=masses[above])
+            if np.any(np.abs(center - self.positions[self.stack[k]]) > sizes[self.stack[k]] * .5):
+                self.stack = self.stack[:k+1]
+                return above
+        return []
+
+    def _reward(self):
+        sim = self.sim
+        delta = self.cur_num_stacked - self.last_num_stacked
+        if delta > 0:
+            reward = delta * (self.cur_num_stacked - 1)
+        elif self.cur_num_stacked == sim.num_objects:
+            reward = (self.cur_num_stacked - 1) * (self.cur_num_stacked - 1)
+        else:
+            reward = delta - 1
+
+        if reward > 0:
+            reward = reward * sim.pos_reward_multiplier
+            reward = (reward / sim.max_attempts) * (sim.max_attempts - self.num_attempts + 1)
+        else:
+            reward = reward * sim.neg_reward_multiplier
+        return float(reward)
+
+    def _select_theme(self):
+        on_floor = [i for i in range(self.sim.num_objects) if i not in self.stack]
+        return on_floor[0] if len(on_floor) > 0 else None
+
+    def _center_of_gravity(self):
+        if self.theme is None:
+            return np.zeros((2,))
+        sizes = self.sim.object_sizes
+        lows = self.positions[self.stack] - sizes[self.stack, None] * .5
+        highs = self.positions[self.stack] + sizes[self.stack, None] * .5
+        stack_center = (lows.min(axis=0) + highs.max(axis=0)) * .5
+        stack_size = highs.max(axis=0) - lows.min(axis=0)
+        return (self.positions[self.theme] - stack_center) / stack_size
+
+    def _relations(self):
+        rel = np.zeros((5,))
+        if self.theme is None:
+            return rel
+        dest = self.stack[-1]
+        if self.theme in self.stack:
+            rel[0] = 1  # support
+            return rel
+        dx, dz = self.positions[self.theme] - self.positions[dest]
+        if abs(dx) >= abs(dz):
+            rel[1 if dx < 0 else 2] = 1  # left/right
+        else:
+            rel[3 if dz < 0 else 4] = 1  # in_front/behind
+        return rel
+
+    def _vector_observation(self):
+        scale = self.sim.observation_space_scale
+        obs = []
+        if 'HGT' in self.sim.priors:
+            obs.append(self.cur_num_stacked * scale)
+        if 'REL' in self.sim.priors:
+            obs.extend(self._relations() * scale)
+        if 'COG' in self.sim.priors:
+            obs.extend(self.cog * scale)
+        obs = np.array(obs, dtype=np.float32)
+        if self.sim.noisy_vectors:
+            obs += self.sim.rng.normal(0.0, 0.1, obs.shape).astype(np.float32)
+        return obs
+
+    def _random_floor_positions(self, n):
+        return self.sim.rng.uniform(-self.sim.floor_extent, self.sim.floor_extent, (n, 2))
+
+    def _render(self):
+        height, width, _ = self.sim.IMAGE_SHAPE
+        image = np.full(self.sim.IMAGE_SHAPE, .1, dtype=np.float32)
+        extent = self.sim.floor_extent + self.sim.object_sizes.max()
+        levels = {obj : level for level, obj in enumerate(self.stack)}
+        # draw lower objects first so that higher objects end up on top
+        for obj in sorted(range(self.sim.num_objects), key=lambda o: levels.get(o, -1)):
+            half = self.sim.object_sizes[obj] * .5
+            (x0, z0), (x1, z1) = [((self.positions[obj] + sign * half) + extent) / (2 * extent) for sign in (-1, 1)]
+            c0, c1 = int(np.clip(x0 * width, 0, width)), int(np.clip(np.ceil(x1 * width), 0, width))
+            r0, r1 = int(np.clip(z0 * height, 0, height)), int(np.clip(np.ceil(z1 * height), 0, height))
+            image[r0:r1, c0:c1] = .3 + .7 * (levels.get(obj, 0) + 1) / self.sim.num_objects
+        return image
@@ -0,0 +1,243 @@
+import numpy as np
+from collections import OrderedDict
+from copy import deepcopy
+
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
+
+from mlagents_envs.base_env import ActionTuple
+
+from stacker_env import StackerEnv
+from telemetry import logger
+
+def make_stacker_env(rank,
+    environment_filename=None,
+    start_worker_id=0,
+    **env_kwargs):
+    """Returns a thunk that creates a StackerEnv on worker id
+    start_worker_id + rank, so that each Unity instance gets its own port.
+    The thunk is executed inside the subprocess when used with SubprocVecEnv.
+    """
+    def _init():
+        return StackerEnv(environment_filename=environment_filename,
+            worker_id=start_worker_id+rank,
+            **env_kwargs)
+    return _init
+
+def make_stacker_vec_env(n_envs,
+    environment_filename=None,
+    start_worker_id=0,
+    vec_env_cls=None,
+    **env_kwargs):
+    """Launches n_envs Unity instances on distinct worker ids behind a single
+    vectorized environment.
+
+    Only a built Unity player can be launched more than once, so
+    environment_filename is required when n_envs > 1 (the Editor only
+    listens on a single port), unless a backend other than Unity is used.  By default, each environment runs in its own
+    subprocess (SubprocVecEnv) so that all instances are stepped in parallel;
+    ThreadedStackerVecEnv steps them in parallel from a single process instead.
+    """
+    if n_envs > 1 and environment_filename is None and env_kwargs.get("backend") is None:
+        raise ValueError("Running %s environments requires a Unity build (environment_filename); "
+            "the Unity Editor can only serve a single environment." % n_envs)
+
+    if vec_env_cls is None:
+        vec_env_cls = SubprocVecEnv if n_envs > 1 else DummyVecEnv
+
+    env_fns = [make_stacker_env(i, environment_filename, start_worker_id, **env_kwargs)
+        for i in range(n_envs)]
+
+    return vec_env_cls(env_fns)
+
+class ThreadedStackerVecEnv(DummyVecEnv):
+    """
+    Description:
+        A DummyVecEnv of StackerEnvs that steps all of them concurrently:
+        step_async starts every environment's step in its own background
+        thread (see StackerEnv.step_async) and step_wait collects the results,
+        so every Unity instance simulates at the same time instead of one
+        after the other.  The environments live in the main process, so, unlike
+        SubprocVecEnv, observations are not pickled between processes.
+
+        Stepping is mostly waiting on Unity, so the threads run in parallel
+        despite the GIL; pure-Python backends (e.g., the stacking simulator)
+        gain nothing from it.
+    """
+
+    def step_async(self, actions):
+        self.actions = actions
+        for env_idx in range(self.num_envs):
+            self.envs[env_idx].step_async(self.actions[env_idx])
+
+    def step_wait(self):
+        for env_idx in range(self.num_envs):
+            obs, self.buf_rews[env_idx], self.buf_dones[env_idx], self.buf_infos[env_idx] = self.envs[env_idx].step_wait()
+            if self.buf_dones[env_idx]:
+                # save final observation where user can get it, then reset
+                self.buf_infos[env_idx]["terminal_observation"] = obs
+                obs = self.envs[env_idx].reset()
+            self._save_obs(env_idx, obs)
+        return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones), deepcopy(self.buf_infos))
+
+class MultiAgentStackerVecEnv(VecEnv):
+    """
+    Description:
+        Exposes every StackingAgent in a single Unity scene (e.g., a scene with
+        replicated arenas) as a separate sub-environment of one vectorized
+        environment.  Each agent id that appears in the DecisionSteps /
+        TerminalSteps of the stacker behavior is mapped to its own index, and
+        all agents' actions are sent to Unity with a single _env.step(), so
+        the Python<->Unity round trip is shared by the whole batch.
+
+        Observation and action spaces are those of StackerEnv (see
+        stacker_env.py), which is used to open the Unity environment.
+
+    Stepping:
+        Agents finish their placements at different times.  step_wait keeps
+        stepping Unity until every agent has either requested its next
+        decision or terminated.  Agents that are already waiting for their
+        next action in the meantime are sent the "no action" sentinel
+        [-inf,-inf], which Unity ignores (ScenarioController.IsValidAction).
+
+    Episode Termination:
+        As in StackerEnv, episodes are ended by Unity, which starts the next
+        episode for that agent by itself.  Following the VecEnv convention, the
+        observation returned for a done sub-environment is the first
+        observation of its next episode and the final observation is in
+        info["terminal_observation"].
+    """
+
+    def __init__(self,
+        environment_filename=None,
+        worker_id=0,
+        **env_kwargs):
+        self.stacker_env = StackerEnv(environment_filename=environment_filename,
+            worker_id=worker_id,
+            **env_kwargs)
+        self._env = self.stacker_env._env
+        self.behavior_name = self.stacker_env.behavior_name
+
+        self.visual_obs = self.stacker_env.visual_obs
+        self.vector_obs = self.stacker_env.vector_obs
+        self.dict_obs = self.stacker_env.dict_obs
+
+        # the agents requesting a decision after the reset define the sub-envs
+        decision_steps = self._wait_for_decisions()
+        self.agent_ids = [int(agent_id) for agent_id in decision_steps.agent_id]
+        self.agent_index = {agent_id : i for i, agent_id in enumerate(self.agent_ids)}
+        logger.info("Found %s stacking agents: %s", len(self.agent_ids), self.agent_ids)
+
+        VecEnv.__init__(self, len(self.agent_ids),
+            self.stacker_env.observation_space,
+            self.stacker_env.action_space)
+
+        self._decision_steps = decision_steps
+        self._actions = None
+        self._noop_action = np.array([-float('inf'),-float('inf')], dtype=np.float32)
+
+    def _wait_for_decisions(self):
+        decision_steps, _ = self._env.get_steps(self.behavior_name)
+        while len(decision_steps) == 0:
+            self._env.step()
+            decision_steps, _ = self._env.get_steps(self.behavior_name)
+        return decision_steps
+
+    def _agent_obs(self, step_obs, j):
+        return self.stacker_env._fill_obs(step_obs, j, self.stacker_env._new_obs_buffers())
+
+    def _stack_obs(self, obs_list):
+        if self.dict_obs:
+            return OrderedDict([(key, np.stack([obs[key] for obs in obs_list]))
+                for key in ("visual_obs", "vector_obs")])
+        return np.stack(obs_list)
+
+    def reset(self):
+        self._env.reset()
+        self._decision_steps = self._wait_for_decisions()
+        obs = [None] * self.num_envs
+        pending = set(range(self.num_envs))
+
+        while True:
+            for j, agent_id in enumerate(self._decision_steps.agent_id):
+                i = self.agent_index[int(agent_id)]
+                obs[i] = self._agent_obs(self._decision_steps.obs, j)
+                pending.discard(i)
+            if len(pending) == 0:
+                break
+            # some agents haven't requested a decision yet; hold the others
+            self._env.set_actions(self.behavior_name, ActionTuple(continuous=np.tile(self._noop_action,
+                (len(self._decision_steps), 1))))
+            self._env.step()
+            self._decision_steps, _ = self._env.get_steps(self.behavior_name)
+
+        return self._stack_obs(obs)
+
+    def step_async(self, actions):
+        self._actions = np.asarray(actions, dtype=np.float32).reshape((self.num_envs, -1))
+
+    def step_wait(self):
+        obs = [None] * self.num_envs
+        rewards = np.zeros((self.num_envs,), dtype=np.float32)
+        dones = np.zeros((self.num_envs,), dtype=bool)
+        infos = [{} for _ in range(self.num_envs)]
+
+        awaiting_action = set(range(self.num_envs))
+        pending = set(range(self.num_envs))
+
+        while len(pending) > 0:
+            if len(self._decision_steps) > 0:
+                continuous = np.empty((len(self._decision_steps), self._actions.shape[-1]), dtype=np.float32)
+                for j, agent_id in enumerate(self._decision_steps.agent_id):
+                    i = self.agent_index[int(agent_id)]
+                    if i in awaiting_action:
+                        continuous[j] = self._actions[i]
+                        awaiting_action.discard(i)
+                    else:
+                        continuous[j] = self._noop_action
+                self._env.set_actions(self.behavior_name, ActionTuple(continuous=continuous))
+
+            self._env.step()
+            decision_steps, terminal_steps = self._env.get_steps(self.behavior_name)
+
+            for j, agent_id in enumerate(terminal_steps.agent_id):
+                i = self.agent_index[int(agent_id)]
+                rewards[i] += terminal_steps.reward[j]
+                dones[i] = True
+                infos[i]["terminal_observation"] = self._agent_obs(terminal_steps.obs, j)
+                infos[i]["TimeLimit.truncated"] = bool(terminal_steps.interrupted[j])
+
+            for j, agent_id in enumerate(decision_steps.agent_id):
+                i = self.agent_index[int(agent_id)]
+                if i not in pending:
+                    continue
+                # after a terminal step, the decision step starts the next episode
+                if not dones[i]:
+                    rewards[i] += decision_steps.reward[j]
+                obs[i] = self._agent_obs(decision_steps.obs, j)
+                pending.discard(i)
+
+            self._decision_steps = decision_steps
+
+        self.stacker_env.num_timesteps += 1
+        return self._stack_obs(obs), rewards, dones, infos
+
+    def close(self):
+        self.stacker_env.close()
+
+    def seed(self, seed=None):
+        # all agents share a single Unity instance, and therefore a single seed
+        self.stacker_env.seed(seed)
+        return [seed] * self.num_envs
+
+    def get_attr(self, attr_name, indices=None):
+        return [getattr(self.stacker_env, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name, value, indices=None):
+        setattr(self.stacker_env, attr_name, value)
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return [getattr(self.stacker_env, method_name)(*method_args, **method_kwargs)
+            for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return [False for _ in self._get_indices(indices)]
@@ -0,0 +1,198 @@
+import argparse
+import os
+import pickle
+import sys
+import time
+
+import gym
+import numpy as np
+import torch
+from gym import spaces
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis"))
+import neuralnetworks_torch as nntorch
+
+from stacker_env import vector_observation_space
+import trial_data
+
+class SurrogateStackerEnv(gym.Env):
+    """
+    Description:
+        A learned stand-in for StackerEnv, for pretraining policies much faster
+        than against Unity before fine-tuning them against the real scene.
+        A neural network trained on logged trial data (see train_surrogate)
+        predicts the next observation, the reward and whether the episode ends
+        from the current observation and the action.
+
+    Observation:
+        The vector observation space of StackerEnv for the priors the surrogate
+        was trained with.  Visual observations are not supported.
+
+    Actions:
+        As in StackerEnv.
+
+    Reward:
+        The predicted reward.  The model is only trusted within the range of
+        actions present in the trial data, so actions outside that range are
+        treated as failed placements: the observation does not change and the
+        reward is the lowest logged reward.  With sample_noise, Gaussian noise
+        with the standard deviation of the model's residuals on the training
+        data is added to the predicted observation and reward, so that outcomes
+        are as variable as in the logged data.
+
+    Starting State:
+        The initial observation (height 1, no relations, centered CoG).
+
+    Episode Termination:
+        The model predicts termination, or max_attempts placements have been
+        made.
+    """
+
+    def __init__(self,
+        surrogate,
+        max_attempts=10,
+        sample_noise=True,
+        seed=None):
+        self.surrogate = surrogate
+        self.nnet = surrogate["nnet"]
+        self.priors = surrogate["priors"]
+        self.num_objects = surrogate["num_objects"]
+        self.residual_stds = surrogate["residual_stds"]
+        self.max_attempts = max_attempts
+        self.sample_noise = sample_noise
+
+        self.observation_space = vector_observation_space(self.priors)
+        self.action_space = spaces.Box(np.array([0,0]),
+            np.array([1000,1000]))
+
+        self.seed(seed)
+        self.obs = trial_data.initial_observation(self.priors)
+        self.num_attempts = 0
+
+    def step(self, action):
+        action = np.asarray(action, dtype=np.float32).reshape(-1)
+        self.num_attempts += 1
+
+        if np.any(action < self.surrogate["action_low"]) or np.any(action > self.surrogate["action_high"]):
+            done = self.num_attempts >= self.max_attempts
+            return self.obs.copy(), float(self.surrogate["failure_reward"]), done, {}
+
+        x = np.hstack([self.obs, action]).reshape((1,-1))
+        y = self.nnet.use(x)[0]
+        if self.sample_noise:
+            y = y + self.rng.normal(0.0, self.residual_stds)
+
+        obs = y[:-2].astype(np.float32)
+        if 'HGT' in self.priors:
+            # height is a count of stacked objects
+            obs[0] = np.clip(np.round(obs[0]), 1, self.num_objects)
+        reward = float(y[-2])
+        done = bool(y[-1] > 0.5) or (self.num_attempts >= self.max_attempts)
+
+        self.obs = obs
+        return obs, reward, done, {}
+
+    def reset(self):
+        self.obs = trial_data.initial_observation(self.priors)
+        self.num_attempts = 0
+        return self.obs.copy()
+
+    def seed(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        return [seed]
+
+def train_surrogate(paths=None,
+    priors=['COG','HGT'],
+    logged_priors=['COG','HGT'],
+    num_objects=2,
+    hiddens=[64, 64],
+    act_funcs=['tanh', 'tanh'],
+    n_epochs=2000,
+    learning_rate=1e-3,
+    device='cpu'):
+    """Trains a surrogate model on the trial data files in paths (see
+    trial_data.load_transitions) that predicts [next observation, reward,
+    done] from [observation, action]."""
+    transitions = trial_data.load_transitions(paths, priors, logged_priors)
+
+    X = np.hstack([transitions["observations"], transitions["actions"]])
+    T = np.hstack([transitions["next_observations"],
+        transitions["rewards"].reshape((-1,1)),
+        transitions["dones"].reshape((-1,1))]).astype(np.float32)
+    nnet = nntorch.NeuralNetwork(X.shape[1], hiddens, T.shape[1], act_func_per_layer=act_funcs, device=device)
+    nnet.fit(X, T, n_epochs, learning_rate, method='adam', verbose=True)
+
+    residual_stds = (T - nnet.use(X)).std(0)
+    # termination is thresholded, not sampled
+    residual_stds[-1] = 0
+
+    return {
+        "nnet" : nnet,
+        "priors" : sorted(priors),
+        "logged_priors" : sorted(logged_priors),
+        "num_objects" : num_objects,
+        "residual_stds" : residual_stds,
+        "action_low" : transitions["actions"].min(0),
+        "action_high" : transitions["actions"].max(0),
+        "failure_reward" : transitions["rewards"].min()
+    }
+
+def save_surrogate(surrogate, path):
+    """Saves a surrogate as plain values and tensors (the network as its
+    NeuralNetwork.saved_state), so load_surrogate doesn't unpickle any
+    classes."""
+    torch.save({
+        "nnet" : surrogate["nnet"].saved_state(),
+        "priors" : surrogate["priors"],
+        "logged_priors" : surrogate["logged_priors"],
+        "num_objects" : int(surrogate["num_objects"]),
+        "residual_stds" : torch.from_numpy(np.asarray(surrogate["residual_stds"], dtype=np.float32)),
+        "action_low" : torch.from_numpy(np.asarray(surrogate["action_low"], dtype=np.float32)),
+        "action_high" : torch.from_numpy(np.asarray(surrogate["action_high"], dtype=np.float32)),
+        "failure_reward" : float(surrogate["failure_reward"])
+    }, path)
+
+def load_surrogate(path, device='cpu'):
+    try:
+        saved = torch.load(path, map_location=device, weights_only=True)
+    except pickle.UnpicklingError as e:
+        raise ValueError("%s is a pickled surrogate from an older surrogate_env.py; retrain it" % path) from e
+    surrogate = dict(saved)
+    surrogate["nnet"] = nntorch.network_from_saved_state(saved["nnet"], device)
+    surrogate["nnet"].eval()
+    for key in ("residual_stds", "action_low", "action_high"):
+        surrogate[key] = saved[key].cpu().numpy()
+    return surrogate
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a surrogate stacking environment on trial data.  (Example usage: "python surrogate_env.py -f analysis/trial-data/*2cubes.csv -o surrogates/2cubes-COG.HGT.pt -p COG HGT")')
+    parser.add_argument('--files', '-f', metavar='FILES', type=str, nargs='+', default=None, help='trial data files (default: all files in analysis/trial-data)')
+    parser.add_argument('--output', '-o', metavar='OUTPUT', required=True, help='file name to save the surrogate model to')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', default=['COG','HGT'], help='set of priors to use: HGT = height; REL = relations; COG = center of gravity')
+    parser.add_argument('--logged_priors', metavar='LOGGEDPRIORS', type=str, nargs='+', default=['COG','HGT'], help='set of priors the trial data was logged with')
+    parser.add_argument('--num_objects', '-N', metavar='NUMOBJECTS', default=2, help='number of objects in the logged scene')
+    parser.add_argument('--epochs', '-e', metavar='EPOCHS', default=2000, help='number of training epochs')
+    parser.add_argument('--gpu', action='store_true', default=False, help='train using GPU if available')
+
+    args = parser.parse_args()
+
+    device = 'cpu'
+    if args.gpu:
+        if not torch.cuda.is_available():
+            print("CUDA not available. Defaulting to CPU.")
+        else:
+            device = 'cuda:0'
+
+    start_time = time.time()
+    surrogate = train_surrogate(args.files, args.priors, args.logged_priors,
+        num_objects=int(args.num_objects), n_epochs=int(args.epochs), device=device)
+    print("Training took %.4f seconds" % float(time.time()-start_time))
+    print("Residual standard deviations:", surrogate["residual_stds"])
+
+    if os.path.dirname(args.output) != '':
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    save_surrogate(surrogate, args.output)
+    print("Surrogate saved at", args.output)
+
+if __name__ == "__main__":
+    main()
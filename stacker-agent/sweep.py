@@ -0,0 +1,210 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+import pandas as pd
+from stable_baselines3 import DDPG
+from stable_baselines3.common.noise import NormalActionNoise
+
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+from evaluate import run_episodes
+
+ALL_PRIORS = ['COG', 'HGT', 'REL']
+# every non-empty combination of priors, e.g. "COG.HGT"
+ALL_PRIOR_SETS = [".".join(combination) for n in range(1, len(ALL_PRIORS)+1)
+    for combination in itertools.combinations(ALL_PRIORS, n)]
+OBS_MODES = {
+    "vector" : (False, True),
+    "visual" : (True, False),
+    "both" : (True, True)
+}
+POLICIES = {
+    "vector" : "MlpPolicy",
+    "visual" : "CnnPolicy",
+    "both" : "MultiInputPolicy"
+}
+
+# worker id of the Unity instance owned by this sweep process
+_worker_id = 0
+# the environment of this sweep process, kept across its runs, and the
+#  settings it was created with
+_env = None
+_env_key = None
+
+def _init_sweep_process(worker_ids):
+    global _worker_id
+    _worker_id = worker_ids.get()
+    multiprocessing.util.Finalize(None, _close_env, exitpriority=10)
+
+def _close_env():
+    global _env, _env_key
+    if _env is not None:
+        _env.close()
+    _env, _env_key = None, None
+
+def _get_env(key, environment_filename, env_kwargs):
+    # relaunching Unity takes longer than most runs, so the environment is
+    #  only recreated when its key (see run_config) changes
+    global _env, _env_key
+    if _env is None or _env_key != key:
+        _close_env()
+        _env = StackerEnv(environment_filename=environment_filename, worker_id=_worker_id, **env_kwargs)
+        _env_key = key
+    return _env
+
+def run_config(config,
+    total_timesteps,
+    eval_episodes,
+    log_dir,
+    environment_filename=None,
+    sim=False,
+    sim_objects=2,
+    buffer_size=1000000,
+    fast_simulation=False):
+    """Trains and evaluates one configuration of the sweep (a dict with priors,
+    obs, learning_rate and seed) on this process's environment, and returns its
+    row of the results table.  The environment is reused by the next run with
+    the same priors and observation mode, and, since Unity can only be seeded
+    when it is launched, the same seed unless it is the simulator, which each
+    run reseeds.  Every run starts with a full reset."""
+    priors = sorted(config["priors"].split("."))
+    visual_obs, vector_obs = OBS_MODES[config["obs"]]
+    row = dict(config)
+
+    env_kwargs = dict(visual_observation=visual_obs, vector_observation=vector_obs, priors=priors,
+        fast_simulation=fast_simulation, seed=config["seed"])
+    if sim:
+        env_kwargs["backend"] = partial(StackerSimEnvironment, num_objects=sim_objects, priors=priors,
+            visual_observation=visual_obs, vector_observation=vector_obs)
+
+    try:
+        key = (tuple(priors), config["obs"]) if sim else (tuple(priors), config["obs"], config["seed"])
+        env = _get_env(key, environment_filename, env_kwargs)
+        env.seed(config["seed"])
+        # a soft reset would start with the episode placed under the last run's seed
+        env.reset(full=True)
+
+        n_actions = env.action_space.shape[-1]
+        action_noise = NormalActionNoise(mean=np.zeros(n_actions), sigma=0.1 * np.ones(n_actions))
+        model = DDPG(POLICIES[config["obs"]], env, learning_rate=config["learning_rate"],
+            action_noise=action_noise, buffer_size=buffer_size, seed=config["seed"], verbose=0)
+
+        start_time = time.time()
+        model.learn(total_timesteps=total_timesteps)
+        row["train_time"] = time.time() - start_time
+
+        model_path = os.path.join(log_dir, "sweep-%s-%s-lr%s-seed%s" % (config["priors"], config["obs"],
+            config["learning_rate"], config["seed"]))
+        model.save(model_path)
+        row["model"] = model_path
+
+        start_time = time.time()
+        returns, lengths, step_rewards = run_episodes(env, model, eval_episodes)
+        row["eval_time"] = time.time() - start_time
+        row["mean_return"] = float(returns.mean())
+        row["std_return"] = float(returns.std())
+        row["mean_episode_length"] = float(lengths.mean())
+        row["error"] = ""
+    except Exception:
+        # one failed configuration shouldn't end the sweep; its environment may
+        #  be in any state, so the next run gets a new one
+        row["error"] = traceback.format_exc().strip().splitlines()[-1]
+        _close_env()
+
+    return row
+
+def sweep(prior_sets,
+    obs_modes,
+    learning_rates,
+    seeds,
+    total_timesteps,
+    eval_episodes=100,
+    n_procs=1,
+    log_dir=".",
+    results_path=None,
+    environment_filename=None,
+    start_worker_id=0,
+    **run_kwargs):
+    """Runs every combination of prior_sets x obs_modes x learning_rates x
+    seeds on a pool of n_procs processes, each of which owns one environment
+    (a Unity build on worker id start_worker_id + process #, or the simulator)
+    for all of its runs, recreated only when the priors, observation mode or
+    (for Unity) seed change.  The results table (a DataFrame) is written to results_path as each run
+    finishes, and returned sorted by configuration."""
+    if n_procs > 1 and environment_filename is None and not run_kwargs.get("sim", False):
+        raise ValueError("Running %s sweep processes requires a Unity build (environment_filename); "
+            "the Unity Editor can only serve a single environment." % n_procs)
+
+    # runs that can share an environment are queued next to each other
+    configs = [{"priors" : priors, "obs" : obs, "learning_rate" : learning_rate, "seed" : seed}
+        for priors, obs, seed, learning_rate in itertools.product(prior_sets, obs_modes, seeds, learning_rates)]
+    os.makedirs(log_dir, exist_ok=True)
+    print("Sweeping %s configurations on %s processes" % (len(configs), n_procs))
+
+    run = partial(run_config, total_timesteps=total_timesteps, eval_episodes=eval_episodes, log_dir=log_dir,
+        environment_filename=environment_filename, **run_kwargs)
+
+    # Unity and torch don't survive a fork, so processes are spawned
+    context = multiprocessing.get_context("spawn")
+    worker_ids = context.Queue()
+    for i in range(n_procs):
+        worker_ids.put(start_worker_id + i)
+
+    rows = []
+    with ProcessPoolExecutor(n_procs, mp_context=context, initializer=_init_sweep_process, initargs=(worker_ids,)) as pool:
+        futures = [pool.submit(run, config) for config in configs]
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print("[%s/%s] %s %s lr=%s seed=%s: %s" % (len(rows), len(configs), row["priors"], row["obs"],
+                row["learning_rate"], row["seed"], row["error"] if row["error"] else "mean return %.4f" % row["mean_return"]))
+            if results_path is not None:
+                pd.DataFrame(rows).to_csv(results_path, index=False)
+
+    results = pd.DataFrame(rows).sort_values(["priors", "obs", "learning_rate", "seed"]).reset_index(drop=True)
+    if results_path is not None:
+        results.to_csv(results_path, index=False)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Train and evaluate a grid of prior sets, observation modes, learning rates and seeds in parallel.  (Example usage: "python sweep.py -l sweeps -t 2000 -p COG HGT COG.HGT -o vector -r 1e-3 1e-4 -s 0 1 2 -n 4 -e <path to build>")')
+    parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='sweep', help='directory for the models and the results table')
+    parser.add_argument('--total_timesteps', '-t', metavar='TOTALTIMESTEPS', default=500, help='training timesteps per configuration')
+    parser.add_argument('--priors', '-p', metavar='PRIORSETS', type=str, nargs='+', default=ALL_PRIOR_SETS, help='prior sets to sweep, each a "."-separated list of priors (e.g., COG.HGT); default: all %s combinations of HGT, REL and COG' % len(ALL_PRIOR_SETS))
+    parser.add_argument('--obs', '-o', metavar='OBSMODES', type=str, nargs='+', default=["vector"], choices=list(OBS_MODES), help='observation modes to sweep: vector, visual and/or both')
+    parser.add_argument('--learning_rates', '-r', metavar='LEARNINGRATES', type=float, nargs='+', default=[1e-3], help='learning rates to sweep')
+    parser.add_argument('--seeds', '-s', metavar='SEEDS', type=int, nargs='+', default=[0], help='seeds to sweep')
+    parser.add_argument('--eval_episodes', '-E', metavar='EPISODES', default=100, help='number of episodes to evaluate each trained model on')
+    parser.add_argument('--n_procs', '-n', metavar='NPROCS', default=1, help='number of configurations to run in parallel, each in its own process with its own environment (requires --env_file or --sim if > 1)')
+    parser.add_argument('--env_file', '-e', metavar='ENVFILE', default=None, help='path to a Unity build of the environment (leave blank to connect to the Unity Editor)')
+    parser.add_argument('--buffer_size', metavar='BUFFERSIZE', default=1000000, help='replay buffer size (lower it for visual observations)')
+    parser.add_argument('--fast', action='store_true', default=False, help='headless fast simulation (see ddpg.py)')
+    parser.add_argument('--sim', action='store_true', default=False, help='use the pure-Python stacking simulator instead of Unity')
+    parser.add_argument('--sim_objects', metavar='SIMOBJECTS', default=2, help='number of objects to stack in the simulator')
+
+    args = parser.parse_args()
+
+    prior_sets = [".".join(sorted(prior_set.split("."))) for prior_set in args.priors]
+    results_path = os.path.join(args.log_dir, "sweep-results.csv")
+
+    start_time = time.time()
+    results = sweep(prior_sets, args.obs, args.learning_rates, args.seeds,
+        total_timesteps=int(args.total_timesteps), eval_episodes=int(args.eval_episodes),
+        n_procs=int(args.n_procs), log_dir=args.log_dir, results_path=results_path,
+        environment_filename=args.env_file, sim=args.sim, sim_objects=int(args.sim_objects),
+        buffer_size=int(args.buffer_size), fast_simulation=args.fast)
+    print("Sweep took %.4f seconds" % float(time.time()-start_time))
+
+    print("\n===== Results =====")
+    print(results.drop(columns=["model"], errors="ignore").to_string(index=False))
+    print("Results saved at", results_path)
+
+if __name__ == "__main__":
+    main()
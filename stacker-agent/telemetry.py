@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+
+# diagnostic messages of the stacker environments; silent unless configured
+#  (e.g., logging.basicConfig(level=logging.DEBUG))
+logger = logging.getLogger("stacker")
+
+# phases of StackerEnv.step that are timed
+PHASES = ("set_actions", "step", "get_steps")
+
+class StepTelemetry:
+    """
+    Description:
+        Per-step records of a StackerEnv, kept in a fixed-size in-memory ring
+        buffer and written to sinks (see JsonLinesSink and TensorBoardSink) in
+        batches, so that logging a step costs a few array writes instead of
+        formatting and printing observations.
+
+    Levels:
+        Standard logging levels.  Nothing is recorded above logging.INFO, which
+        is the default (logging.WARNING).
+        logging.INFO: timestamp, action, reward, done flag and the durations (in
+            seconds) of the set_actions, _env.step and get_steps phases.
+        logging.DEBUG: also the vector observation.
+
+    Flushing:
+        Records are written to the sinks once flush_every of them have
+        accumulated, and on flush() and close().  Without sinks, the last
+        capacity records stay available through records().
+
+    Resets:
+        The number and durations of soft and full resets are always counted,
+        whatever the level (see record_reset and reset_summary).
+    """
+
+    def __init__(self,
+        level=logging.WARNING,
+        capacity=4096,
+        flush_every=1024,
+        sinks=None,
+        worker_id=0):
+        self.level = level
+        self.capacity = capacity
+        self.flush_every = min(flush_every, capacity)
+        self.sinks = [] if sinks is None else list(sinks)
+        self.worker_id = worker_id
+
+        self.num_records = 0
+        self.num_flushed = 0
+        self._buffers = None
+
+        self.reset_stats = {kind : {"count" : 0, "total_time" : 0.0, "max_time" : 0.0}
+            for kind in ("soft", "full")}
+
+    @property
+    def enabled(self):
+        return self.level <= logging.INFO
+
+    def _allocate(self, action, obs):
+        self._buffers = {
+            "step" : np.zeros((self.capacity,), dtype=np.int64),
+            "timestamp" : np.zeros((self.capacity,), dtype=np.float64),
+            "action" : np.zeros((self.capacity, np.size(action)), dtype=np.float32),
+            "reward" : np.zeros((self.capacity,), dtype=np.float32),
+            "done" : np.zeros((self.capacity,), dtype=bool),
+            "timings" : np.zeros((self.capacity, len(PHASES)), dtype=np.float64)
+        }
+        if obs is not None:
+            self._buffers["observation"] = np.zeros((self.capacity, np.size(obs)), dtype=np.float32)
+
+    def record(self, step, action, obs, reward, done, timings):
+        """Records one step.  obs is the observation returned by the step (only
+        its vector part is kept, at logging.DEBUG) and timings the durations of
+        the PHASES."""
+        if not self.enabled:
+            return
+
+        if isinstance(obs, dict):
+            obs = obs.get("vector_obs")
+        if obs is not None and (self.level > logging.DEBUG or np.ndim(obs) != 1):
+            obs = None
+
+        if self._buffers is None:
+            self._allocate(action, obs)
+
+        i = self.num_records % self.capacity
+        self._buffers["step"][i] = step
+        self._buffers["timestamp"][i] = time.time()
+        self._buffers["action"][i] = np.reshape(action, -1)
+        self._buffers["reward"][i] = reward
+        self._buffers["done"][i] = done
+        self._buffers["timings"][i] = timings
+        if obs is not None and "observation" in self._buffers:
+            self._buffers["observation"][i] = obs
+        self.num_records += 1
+
+        if len(self.sinks) > 0 and self.num_records - self.num_flushed >= self.flush_every:
+            self.flush()
+
+    def record_reset(self, duration, soft):
+        stats = self.reset_stats["soft" if soft else "full"]
+        stats["count"] += 1
+        stats["total_time"] += duration
+        stats["max_time"] = max(stats["max_time"], duration)
+
+    def reset_summary(self):
+        """Returns {kind : (count, mean seconds, max seconds)} for the kinds
+        of reset ("soft", "full") that happened."""
+        return {kind : (stats["count"], stats["total_time"]/stats["count"], stats["max_time"])
+            for kind, stats in self.reset_stats.items() if stats["count"] > 0}
+
+    def records(self, since=None):
+        """Returns the buffered records (all of them, or those recorded after
+        the first since records) as a dict of arrays, oldest first."""
+        if self._buffers is None:
+            return {}
+        start = max(self.num_records - self.capacity, 0 if since is None else since)
+        indices = np.arange(start, self.num_records) % self.capacity
+        return {key : buffer[indices] for key, buffer in self._buffers.items()}
+
+    def flush(self):
+        if self.num_records > self.num_flushed and len(self.sinks) > 0:
+            batch = self.records(since=self.num_flushed)
+            for sink in self.sinks:
+                sink.write(batch, self.worker_id)
+        self.num_flushed = self.num_records
+
+    def close(self):
+        self.flush()
+        for sink in self.sinks:
+            sink.close()
+
+class JsonLinesSink:
+    """Appends telemetry records to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._file = None
+
+    def write(self, batch, worker_id=0):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        lines = []
+        for i in range(len(batch["step"])):
+            record = {
+                "worker" : worker_id,
+                "step" : int(batch["step"][i]),
+                "timestamp" : float(batch["timestamp"][i]),
+                "action" : batch["action"][i].tolist(),
+                "reward" : float(batch["reward"][i]),
+                "done" : bool(batch["done"][i]),
+                "timings" : dict(zip(PHASES, batch["timings"][i].tolist()))
+            }
+            if "observation" in batch:
+                record["observation"] = batch["observation"][i].tolist()
+            lines.append(json.dumps(record) + "\n")
+        # one write per batch, so concurrent workers appending to the same
+        #  file don't interleave within a batch
+        self._file.write("".join(lines))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class TensorBoardSink:
+    """Writes rewards and phase timings (in milliseconds) of telemetry records
+    as TensorBoard scalars under telemetry/worker_<worker id>/."""
+
+    def __init__(self, log_dir):
+        self.log_dir = log_dir
+        self._writer = None
+
+    def write(self, batch, worker_id=0):
+        if self._writer is None:
+            from torch.utils.tensorboard import SummaryWriter
+            self._writer = SummaryWriter(self.log_dir)
+        prefix = "telemetry/worker_%s/" % worker_id
+        for i in range(len(batch["step"])):
+            step = int(batch["step"][i])
+            self._writer.add_scalar(prefix + "reward", batch["reward"][i], step)
+            for j, phase in enumerate(PHASES):
+                self._writer.add_scalar(prefix + phase + "_ms", batch["timings"][i][j]*1000, step)
+        self._writer.flush()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def make_telemetry(level=logging.WARNING, path=None, tb_dir=None, worker_id=0, **telemetry_kwargs):
+    """Creates a StepTelemetry that writes to path (JSON lines) and/or tb_dir
+    (TensorBoard), if given."""
+    sinks = []
+    if path is not None:
+        sinks.append(JsonLinesSink(path))
+    if tb_dir is not None:
+        sinks.append(TensorBoardSink(tb_dir))
+    return StepTelemetry(level, sinks=sinks, worker_id=worker_id, **telemetry_kwargs)
@@ -0,0 +1,49 @@
+import os
+import sys
+from functools import partial
+
+import numpy as np
+import torch as th
+from stable_baselines3 import DDPG
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+from checkpoints import CheckpointCallback, load_checkpoint
+from throughput import ThroughputCallback
+
+PRIORS = ['COG','HGT']
+
+def make_env(seed):
+    backend = partial(StackerSimEnvironment, priors=PRIORS, vector_observation=True)
+    return StackerEnv(vector_observation=True, priors=PRIORS, backend=backend, seed=seed)
+
+def actor_parameters(model):
+    return [parameter.detach().clone() for parameter in model.actor.parameters()]
+
+def test_resumed_checkpoint_trains_the_loaded_model(tmp_path):
+    path = str(tmp_path / "model-checkpoint")
+    env = make_env(0)
+    model = DDPG("MlpPolicy", env, learning_starts=50, seed=0)
+    # throughput is measured while checkpoints are saved, as in ddpg.py
+    model.learn(total_timesteps=200, callback=[CheckpointCallback(path, 100, 400), ThroughputCallback(50)])
+    env.close()
+
+    env = make_env(1)
+    model, state = load_checkpoint(path, env)
+    assert state["num_timesteps"] == 200
+    assert model._last_obs is None
+    # nothing of the callback may be pickled into the checkpoint
+    assert "train" not in vars(model) and "_sample_action" not in vars(model)
+
+    before = actor_parameters(model)
+    n_updates = model._n_updates
+    throughput = ThroughputCallback(50)
+    model.learn(total_timesteps=200, callback=throughput, reset_num_timesteps=False)
+    env.close()
+
+    assert model.num_timesteps >= 400
+    assert model._n_updates > n_updates
+    assert any(not th.equal(a, b) for a, b in zip(before, actor_parameters(model)))
+    assert model.env is not None and not hasattr(model.env, "elapsed")
+    assert np.isclose(sum(throughput.summary()[phase + "_fraction"] for phase in ("env", "inference", "train")), 1, atol=0.1)
@@ -0,0 +1,143 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "analysis"))
+import neuralnetworks_torch as nntorch
+
+def make_data(n_samples=200, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(-2, 2, size=(n_samples, 3)) * [1, 10, 100] + [0, 5, -50]
+    T = np.hstack([np.sin(X[:, :1]) + 0.1 * X[:, 1:2], X[:, 2:3] / 100 + 0.3 * rng.normal(size=(n_samples, 1))])
+    return X.astype(np.float32), T.astype(np.float32)
+
+def make_network(n_hiddens=[20, 10, 20]):
+    return nntorch.NeuralNetwork(3, n_hiddens, 2, ['tanh'] * len(n_hiddens))
+
+def eager_use(nnet, X):
+    # the forward pass on standardized inputs, with the outputs unstandardized
+    X = torch.from_numpy(X)
+    with torch.no_grad():
+        return (nnet.forward((X - nnet.Xmeans) / nnet.Xstds) * nnet.Tstds + nnet.Tmeans).numpy()
+
+def test_fit_restores_the_best_validation_weights():
+    X, T = make_data()
+    torch.manual_seed(0)
+    nnet = make_network([50, 50])
+    nnet.fit(X, T, 500, 0.01, verbose=False, batch_size=32, validation_fraction=0.25,
+             patience=20, check_interval=1, seed=0)
+
+    # stopped early, with the weights of the best validation error
+    assert nnet.best_epoch < len(nnet.val_error_trace) < 500
+    assert nnet.best_epoch == int(np.argmin(nnet.val_error_trace)) + 1
+    _, _, Xval, Tval = nnet._split_validation(torch.from_numpy(X), torch.from_numpy(T), 0.25, 0)
+    Yval = torch.from_numpy(nnet.use(Xval.numpy()))
+    val_error = torch.sqrt(torch.nn.functional.mse_loss((Yval - nnet.Tmeans) / nnet.Tstds,
+                                                        (Tval - nnet.Tmeans) / nnet.Tstds)).item()
+    assert np.isclose(val_error, min(nnet.val_error_trace), rtol=1e-4)
+
+@pytest.mark.parametrize("lr_schedule", ['cosine', 'plateau'])
+def test_fit_with_lr_schedules(lr_schedule):
+    X, T = make_data()
+    torch.manual_seed(0)
+    nnet = make_network()
+    nnet.fit(X, T, 100, 0.01, verbose=False, batch_size=50, lr_schedule=lr_schedule, check_interval=5, seed=0)
+    assert len(nnet.error_trace) == 100
+    assert nnet.error_trace[-1] < nnet.error_trace[0]
+    with pytest.raises(ValueError):
+        make_network().fit(X, T, 1, 0.01, verbose=False, lr_schedule='step')
+
+@pytest.mark.parametrize("n_hiddens", [[20, 10, 20], []])
+def test_use_folds_the_standardization(n_hiddens):
+    X, T = make_data()
+    torch.manual_seed(0)
+    nnet = make_network(n_hiddens)
+    nnet.fit(X, T, 50, 0.01, verbose=False)
+    assert np.allclose(nnet.use(X), eager_use(nnet, X), atol=1e-4)
+
+    with torch.no_grad():
+        middle = nnet.forward_to_middle_layer((torch.from_numpy(X) - nnet.Xmeans) / nnet.Xstds).numpy()
+    assert np.allclose(nnet.use_to_middle(X), middle, atol=1e-5)
+
+    # further training rebuilds the inference form
+    nnet.fit(X, T, 10, 0.01, verbose=False)
+    assert np.allclose(nnet.use(X), eager_use(nnet, X), atol=1e-4)
+
+    # and so do new weights
+    other = make_network(n_hiddens)
+    other.fit(X, T, 5, 0.01, verbose=False)
+    nnet.load_state_dict(other.state_dict())
+    assert np.allclose(nnet.use(X), eager_use(nnet, X), atol=1e-4)
+
+def test_chunked_use(tmp_path):
+    X, T = make_data(1000)
+    torch.manual_seed(0)
+    nnet = make_network()
+    nnet.fit(X, T, 20, 0.01, verbose=False)
+    Y = nnet.use(X)
+
+    X_memmap = np.memmap(tmp_path / "X.dat", dtype=np.float64, mode='w+', shape=X.shape)
+    X_memmap[:] = X
+    assert np.allclose(nnet.use(X_memmap, batch_size=64), Y, atol=1e-5)
+
+    # single rows and arrays of rows, split across chunks
+    rows = iter([X[0]] + [X[first:first + 100] for first in range(1, 1000, 100)])
+    assert np.allclose(nnet.use(rows, batch_size=64), Y, atol=1e-5)
+
+    out = np.memmap(tmp_path / "Y.dat", dtype=np.float32, mode='w+', shape=(1200, 2))
+    written = nnet.use(X, batch_size=300, out=out)
+    assert written.shape == Y.shape and np.allclose(out[:1000], Y, atol=1e-5)
+    with pytest.raises(ValueError):
+        nnet.use(X, batch_size=300, out=np.empty((900, 2), dtype=np.float32))
+
+    assert np.allclose(np.concatenate(list(nnet.use_chunks(iter(X), batch_size=128))), Y, atol=1e-5)
+
+def test_save_load_and_convert(tmp_path):
+    X, T = make_data()
+    torch.manual_seed(0)
+    nnet = make_network()
+    nnet.fit(X, T, 20, 0.01, verbose=False)
+
+    path = str(tmp_path / "nnet.pt")
+    nnet.save(path)
+    loaded = nntorch.load_network(path)
+    assert type(loaded) is nntorch.NeuralNetwork and loaded.config() == nnet.config()
+    assert loaded.error_trace == pytest.approx(nnet.error_trace)
+    assert np.array_equal(loaded.use(X), nnet.use(X))
+
+    pickled_path = str(tmp_path / "pickled.pt")
+    torch.save(nnet, pickled_path)
+    with pytest.raises(ValueError):
+        nntorch.load_network(pickled_path)
+    nntorch.convert_pickled_network(pickled_path)
+    assert np.array_equal(nntorch.load_network(pickled_path, mmap=False).use(X), nnet.use(X))
+
+def test_train_ensemble_matches_fit():
+    X, T = make_data()
+    seeds = [0, 1, 2]
+    members = nntorch.train_ensemble(make_network, X, T, 30, 0.01, seeds, verbose=False)
+
+    for seed, member in zip(seeds, members):
+        torch.manual_seed(seed)
+        nnet = make_network()
+        nnet.fit(X, T, 30, 0.01, verbose=False)
+        assert np.allclose(member.error_trace, nnet.error_trace, atol=1e-4)
+        assert np.abs(member.use(X) - nnet.use(X)).max() < 1e-5
+
+def test_classifier_use_standardizes_the_inputs():
+    X, _ = make_data()
+    T = (X[:, 1] > 5).astype(np.int64) + (X[:, 2] > -50)
+    torch.manual_seed(0)
+    nnet = nntorch.NeuralNetwork_Classifier(3, [20, 20], 3, ['tanh', 'tanh'])
+    nnet.train(X, T, 50, 0.01, verbose=False)
+
+    with torch.no_grad():
+        probs = torch.softmax(nnet.forward((torch.from_numpy(X) - nnet.Xmeans) / nnet.Xstds), 1).numpy()
+    classes, use_probs = nnet.use(X)
+    assert np.allclose(use_probs, probs, atol=1e-5)
+    assert np.array_equal(classes, probs.argmax(1))
+    chunk_classes, chunk_probs = nnet.use(iter(X), batch_size=64)
+    assert np.array_equal(chunk_classes, classes) and np.allclose(chunk_probs, use_probs, atol=1e-6)
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from prioritized_replay import SumTree
+
+@pytest.mark.parametrize("capacity", [3, 1000, 5000])
+def test_sum_tree_matches_running_sums(capacity):
+    rng = np.random.default_rng(0)
+    tree = SumTree(capacity)
+    priorities = rng.exponential(size=capacity)
+    # some leaves are never sampled
+    priorities[rng.uniform(size=capacity) < 0.2] = 0
+    tree.update(np.arange(capacity), priorities)
+    # repeated leaves, as in a sampled batch
+    leaves = rng.integers(capacity, size=200)
+    priorities[leaves] = rng.exponential(size=200)
+    tree.update(leaves, priorities[leaves])
+
+    assert np.isclose(tree.total, priorities.sum())
+    assert tree.min == priorities.min()
+    prefix_sums = rng.uniform(0, tree.total, size=500)
+    assert np.array_equal(tree.find(prefix_sums), np.searchsorted(np.cumsum(priorities), prefix_sums, side='right'))
+    # the ends of the range land on the first and last leaves that can be sampled
+    assert np.array_equal(tree.find([0, tree.total]), np.flatnonzero(priorities)[[0, -1]])
@@ -0,0 +1,48 @@
+import os
+import sys
+from functools import partial
+
+import numpy as np
+import pytest
+from stable_baselines3 import DDPG
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+from checkpoints import load_model
+from sweep import ALL_PRIOR_SETS, OBS_MODES
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cube_stacking_model")
+
+def make_env(priors, visual_obs, vector_obs, num_objects=2, seed=0):
+    backend = partial(StackerSimEnvironment, num_objects=num_objects, priors=priors,
+        visual_observation=visual_obs, vector_observation=vector_obs)
+    return StackerEnv(visual_observation=visual_obs, vector_observation=vector_obs, priors=priors,
+        backend=backend, seed=seed)
+
+@pytest.mark.parametrize("obs", list(OBS_MODES))
+@pytest.mark.parametrize("prior_set", ALL_PRIOR_SETS)
+def test_observations_are_in_the_observation_space(prior_set, obs):
+    env = make_env(prior_set.split("."), *OBS_MODES[obs])
+    try:
+        assert env.observation_space.contains(env.reset())
+        for _ in range(50):
+            obs, _, done, _ = env.step(env.action_space.sample())
+            assert env.observation_space.contains(obs)
+            if done:
+                assert env.observation_space.contains(env.reset())
+    finally:
+        env.close()
+
+def test_loads_a_model_saved_with_bounded_cog():
+    env = make_env(['COG','HGT'], False, True, num_objects=3)
+    try:
+        model = load_model(os.path.join(MODEL_DIR, "3cubes-20220219-0.0,0.0-1000.0,1000.0-2000-COG.HGT"), env)
+        obs = env.reset()
+        action, _ = model.predict(obs, deterministic=True)
+        assert env.action_space.contains(action)
+        # a plain load is rejected, since the saved COG bounds are +-1
+        with pytest.raises(ValueError):
+            DDPG.load(os.path.join(MODEL_DIR, "3cubes-20220219-0.0,0.0-1000.0,1000.0-2000-COG.HGT"), env)
+    finally:
+        env.close()
@@ -0,0 +1,181 @@
+import os
+import resource
+import time
+
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.logger import TensorBoardOutputFormat
+from stable_baselines3.common.vec_env import VecEnvWrapper
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# phases of a training step that ThroughputCallback times
+PHASES = ("env", "inference", "train")
+
+def process_memory_mb():
+    """Resident memory of this process in MB (the peak, if psutil isn't
+    installed)."""
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss / 2**20
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10
+
+class TimedVecEnv(VecEnvWrapper):
+    """Adds the time each step takes (from step_async to the end of
+    step_wait) to elapsed(seconds)."""
+
+    def __init__(self, venv, elapsed):
+        super().__init__(venv)
+        self.elapsed = elapsed
+
+    def reset(self):
+        return self.venv.reset()
+
+    def step_async(self, actions):
+        self._step_start = time.perf_counter()
+        self.venv.step_async(actions)
+
+    def step_wait(self):
+        try:
+            return self.venv.step_wait()
+        finally:
+            self.elapsed(time.perf_counter() - self._step_start)
+
+class ThroughputCallback(BaseCallback):
+    """
+    Description:
+        Measures where training time goes, so a run can be identified as
+        simulator-bound or learner-bound.
+
+        While training, the model's environment is wrapped in a TimedVecEnv
+        that times its steps; the rest of each rollout step (action sampling,
+        i.e. policy inference plus noise, replay buffer inserts and callbacks)
+        counts as inference, and the time between the end of a rollout and the
+        start of the next one (the model's gradient updates) as train.  The
+        model itself is left untouched, so checkpoints saved during training
+        hold nothing of the callback.  Every log_freq environment steps, the
+        following are written to the model's TensorBoard run (or recorded with
+        the model's logger if it has no TensorBoard output) under
+        throughput/:
+            env_steps_per_second, updates_per_second: over the interval
+            <phase>_fraction: fraction of the interval's wall time spent in
+                each phase, and other_fraction for the rest
+            <phase>_ms_per_step: mean time per environment step
+            replay_buffer_size: transitions in the replay buffer
+            memory_mb: resident memory of the process
+    """
+
+    def __init__(self, log_freq=100, verbose=0):
+        super().__init__(verbose)
+        self.log_freq = log_freq
+        self.totals = {phase : 0.0 for phase in PHASES}
+        self._window = {phase : 0.0 for phase in PHASES}
+        self._writer = None
+        self._env = None
+
+    def _add(self, phase, elapsed):
+        self._window[phase] += elapsed
+        self.totals[phase] += elapsed
+
+    def _on_training_start(self):
+        # model.env isn't saved with the model, and learn() passes it to each
+        #  rollout, so the wrapper times the steps from the first rollout on
+        self._env = TimedVecEnv(self.model.env, lambda elapsed: self._add("env", elapsed))
+        self.model.env = self._env
+        self._rollout_end = None
+
+        for output_format in self.logger.output_formats:
+            if isinstance(output_format, TensorBoardOutputFormat):
+                self._writer = output_format.writer
+
+        self.start_time = time.perf_counter()
+        self.start_timesteps = self.num_timesteps
+        self.start_updates = self.model._n_updates
+        self._start_window()
+
+    def _start_window(self):
+        self._window_start = time.perf_counter()
+        self._window_timesteps = self.num_timesteps
+        self._window_updates = self.model._n_updates
+        for phase in PHASES:
+            self._window[phase] = 0.0
+        self._step_start = self._window_start
+        self._step_env_time = self.totals["env"]
+
+    def _on_rollout_start(self):
+        now = time.perf_counter()
+        if self._rollout_end is not None:
+            # learn() trains between two rollouts
+            self._add("train", now - max(self._rollout_end, self._window_start))
+        self._step_start = now
+        self._step_env_time = self.totals["env"]
+
+    def _on_step(self):
+        now = time.perf_counter()
+        self._add("inference", max(0.0, now - self._step_start - (self.totals["env"] - self._step_env_time)))
+        self._step_start = now
+        self._step_env_time = self.totals["env"]
+        if self.num_timesteps - self._window_timesteps >= self.log_freq:
+            self._record()
+        return True
+
+    def _on_rollout_end(self):
+        self._rollout_end = time.perf_counter()
+
+    def _record(self):
+        elapsed = time.perf_counter() - self._window_start
+        steps = self.num_timesteps - self._window_timesteps
+        values = {
+            "env_steps_per_second" : steps / elapsed,
+            "updates_per_second" : (self.model._n_updates - self._window_updates) / elapsed,
+            "other_fraction" : max(0.0, 1.0 - sum(self._window.values()) / elapsed),
+            "replay_buffer_size" : self.model.replay_buffer.size() * self.model.replay_buffer.n_envs,
+            "memory_mb" : process_memory_mb()
+        }
+        for phase in PHASES:
+            values[phase + "_fraction"] = self._window[phase] / elapsed
+            values[phase + "_ms_per_step"] = self._window[phase] * 1000 / max(steps, 1)
+
+        for key, value in values.items():
+            if self._writer is not None:
+                self._writer.add_scalar("throughput/" + key, value, self.num_timesteps)
+            else:
+                self.logger.record("throughput/" + key, value)
+        if self._writer is not None:
+            self._writer.flush()
+        if self.verbose > 0:
+            print("%s env steps/s, %.1f updates/s (env %.0f%%, inference %.0f%%, train %.0f%%)" % (
+                int(values["env_steps_per_second"]), values["updates_per_second"], values["env_fraction"]*100,
+                values["inference_fraction"]*100, values["train_fraction"]*100))
+        self._start_window()
+
+    def _on_training_end(self):
+        if self._rollout_end is not None:
+            self._add("train", time.perf_counter() - self._rollout_end)
+        if self.model.env is self._env:
+            self.model.env = self._env.venv
+        self._env = None
+        self.wall_time = time.perf_counter() - self.start_time
+
+    def summary(self):
+        """Returns the totals over training: wall time, env steps and
+        gradient updates per second, and the fraction of time per phase."""
+        wall_time = self.wall_time if hasattr(self, "wall_time") else time.perf_counter() - self.start_time
+        summary = {
+            "wall_time" : wall_time,
+            "env_steps_per_second" : (self.num_timesteps - self.start_timesteps) / wall_time,
+            "updates_per_second" : (self.model._n_updates - self.start_updates) / wall_time
+        }
+        for phase in PHASES:
+            summary[phase + "_fraction"] = self.totals[phase] / wall_time
+        return summary
+
+    def print_summary(self):
+        summary = self.summary()
+        print("\t%.1f env steps/second, %.1f gradient updates/second" % (summary["env_steps_per_second"], summary["updates_per_second"]))
+        print("\tTime in env steps: %.1f%%, inference and replay inserts: %.1f%%, training: %.1f%%" % (summary["env_fraction"]*100,
+            summary["inference_fraction"]*100, summary["train_fraction"]*100))
+        bound = "simulator" if summary["env_fraction"] > summary["train_fraction"] else "learner"
+        print("\tTraining was %s-bound" % bound)
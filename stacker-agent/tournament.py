@@ -0,0 +1,141 @@
+import argparse
+import os
+import time
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from stacker_env import StackerEnv
+from stacker_sim import StackerSimEnvironment
+from evaluate import run_episodes
+from model_catalog import ModelCatalog, PolicyCache
+from sweep import OBS_MODES
+
+def tournament(catalog,
+    entries,
+    n_episodes=10,
+    n_rounds=1,
+    seed=0,
+    cache_size=8,
+    environment_filename=None,
+    worker_id=0,
+    max_episode_steps=1000,
+    sim=False,
+    sim_objects=2,
+    fast_simulation=False,
+    verbose=1):
+    """Evaluates the catalogued models in entries in this process, every model
+    on the same seeded episodes: n_rounds rounds of n_episodes episodes, with
+    episode j (over all rounds) seeded with seed + j.  Models trained with the
+    same priors and observation mode share one environment, which is opened
+    once; models are loaded through an LRU cache of cache_size models, and
+    each round evaluates every model of a group once.  Episodes are only
+    identical across models with seedable backends (the simulator); Unity is
+    only seeded when it is launched.
+
+    Returns the results table (one row per model, ranked by mean return) and
+    the PolicyCache.
+    """
+    cache = PolicyCache(cache_size)
+    groups = {}
+    for entry in entries:
+        groups.setdefault((tuple(sorted(entry["priors"])), entry["obs"]), []).append(entry)
+
+    returns = {entry["name"] : [] for entry in entries}
+    lengths = {entry["name"] : [] for entry in entries}
+    start_time = time.time()
+    for (priors, obs), group in groups.items():
+        priors = list(priors)
+        visual_obs, vector_obs = OBS_MODES[obs]
+        env_kwargs = dict(visual_observation=visual_obs, vector_observation=vector_obs, priors=priors,
+            fast_simulation=fast_simulation, seed=seed)
+        if sim:
+            env_kwargs["backend"] = partial(StackerSimEnvironment, num_objects=sim_objects, priors=priors,
+                visual_observation=visual_obs, vector_observation=vector_obs)
+            # a soft reset starts the next episode with the seed of the last one
+            env_kwargs["soft_reset"] = False
+        if verbose > 0:
+            print("Evaluating %s models with priors %s and %s observations" % (len(group), ".".join(priors), obs))
+
+        # the Unity Editor serves one environment at a time, so each group's is
+        #  closed before the next one opens
+        env = StackerEnv(environment_filename=environment_filename, worker_id=worker_id, **env_kwargs)
+        try:
+            for round_index in range(n_rounds):
+                # alternating the order starts each round with the models the
+                #  cache holds, instead of evicting each one just before its turn
+                for entry in (group if round_index % 2 == 0 else group[::-1]):
+                    model = cache.get(catalog.model_path(entry))
+                    for episode in range(round_index * n_episodes, (round_index + 1) * n_episodes):
+                        env.seed(seed + episode)
+                        episode_returns, episode_lengths, _ = run_episodes(env, model, 1, max_episode_steps)
+                        returns[entry["name"]].extend(episode_returns)
+                        lengths[entry["name"]].extend(episode_lengths)
+                if verbose > 0:
+                    print("\tRound %s/%s done (%.1f seconds)" % (round_index+1, n_rounds, time.time()-start_time))
+        finally:
+            env.close()
+
+    rows = []
+    for entry in entries:
+        entry_returns = np.array(returns[entry["name"]])
+        rows.append({
+            "model" : entry["name"],
+            "priors" : ".".join(entry["priors"]),
+            "obs" : entry["obs"],
+            "timesteps" : entry["timesteps"],
+            "date" : entry["date"],
+            "mean_return" : entry_returns.mean(),
+            "std_return" : entry_returns.std(),
+            "min_return" : entry_returns.min(),
+            "max_return" : entry_returns.max(),
+            "mean_episode_length" : np.mean(lengths[entry["name"]])
+        })
+    results = pd.DataFrame(rows).sort_values("mean_return", ascending=False, kind="stable").reset_index(drop=True)
+    results.insert(0, "rank", np.arange(1, len(results)+1))
+    return results, cache
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank many catalogued models (see model_catalog.py) against the same seeded episodes in one process.  (Example usage: "python tournament.py -l cube_stacking_model -m \'2cubes-*\' -E 20 --rounds 5 --sim")')
+    parser.add_argument('--log_dir', '-l', metavar='LOGDIR', default='.', help='model directory; the results are written here')
+    parser.add_argument('--models', '-m', metavar='MODELS', type=str, nargs='+', default=None, help='model names or glob patterns to evaluate (leave blank to evaluate all catalogued models)')
+    parser.add_argument('--priors', '-p', metavar='PRIORS', type=str, nargs='+', default=None, help='evaluate only models trained with this set of priors')
+    parser.add_argument('--obs', metavar='OBS', default=None, choices=['vector', 'visual', 'both'], help='evaluate only models trained with these observations')
+    parser.add_argument('--episodes', '-E', metavar='EPISODES', type=int, default=10, help='number of episodes per model per round')
+    parser.add_argument('--rounds', metavar='ROUNDS', type=int, default=1, help='number of rounds of --episodes episodes; each round evaluates every model once, in the order that reuses the most cached models')
+    parser.add_argument('--seed', metavar='SEED', type=int, default=0, help='seed of the first episode (episode j is seeded with seed + j)')
+    parser.add_argument('--cache_size', metavar='CACHESIZE', type=int, default=8, help='number of loaded models to keep in memory')
+    parser.add_argument('--output', '-o', metavar='OUTPUT', default='tournament.csv', help='name of the results table in the log directory')
+    parser.add_argument('--env_file', '-e', metavar='ENVFILE', default=None, help='path to a Unity build of the environment (leave blank to connect to the Unity Editor)')
+    parser.add_argument('--worker_id', metavar='WORKERID', type=int, default=0, help='worker id of the Unity build')
+    parser.add_argument('--fast', action='store_true', default=False, help='headless fast simulation (see ddpg.py)')
+    parser.add_argument('--sim', action='store_true', default=False, help='use the pure-Python stacking simulator instead of Unity')
+    parser.add_argument('--sim_objects', metavar='SIMOBJECTS', type=int, default=2, help='number of objects to stack in the simulator')
+
+    args = parser.parse_args()
+
+    catalog = ModelCatalog(args.log_dir)
+    entries = catalog.find(args.models, args.priors, args.obs)
+    skipped = [entry["name"] for entry in entries if entry["priors"] is None]
+    if len(skipped) > 0:
+        print("Skipping models whose names don't encode their priors:", ", ".join(skipped))
+    entries = [entry for entry in entries if entry["priors"] is not None]
+    if len(entries) == 0:
+        raise ValueError("No catalogued models to evaluate in %s" % args.log_dir)
+
+    start_time = time.time()
+    results, cache = tournament(catalog, entries, n_episodes=args.episodes, n_rounds=args.rounds, seed=args.seed,
+        cache_size=args.cache_size, environment_filename=args.env_file, worker_id=args.worker_id, sim=args.sim,
+        sim_objects=args.sim_objects, fast_simulation=args.fast)
+    print("\n===== Tournament =====")
+    print("Evaluated %s models on %s episodes each in %.2f seconds (%s model loads)" % (len(entries),
+        args.episodes * args.rounds, time.time()-start_time, cache.misses))
+    with pd.option_context("display.max_rows", None, "display.max_columns", None, "display.width", None):
+        print(results.to_string(index=False))
+    results_path = os.path.join(args.log_dir, args.output)
+    results.to_csv(results_path, index=False)
+    print("Results saved at", results_path)
+
+if __name__ == "__main__":
+    main()
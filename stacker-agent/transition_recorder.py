@@ -0,0 +1,198 @@
+import json
+import os
+
+import gym
+import numpy as np
+
+SCHEMA_FILENAME = "schema.json"
+
+class TransitionRecorder(gym.Wrapper):
+    """
+    Description:
+        Records the transitions of a StackerEnv (or any environment with Box or
+        Dict-of-Box observations) to a directory of .npy shards, as a typed
+        binary alternative to the trial data CSV files written by
+        StackingAgent.WriteOutSample.
+
+        Transitions are copied into preallocated chunks of chunk_size
+        transitions, and each full chunk is saved as one shard per field
+        (<field>-<shard #>.npy).  A schema sidecar (schema.json) lists the
+        fields with their dtypes and shapes, and the shards with their lengths;
+        it is rewritten after every shard, so a recording is readable up to the
+        last complete shard even if the run is interrupted.  The last, partial
+        chunk is saved on close().  Recording into a directory that already
+        holds a recording with the same fields appends to it.  Use
+        load_recording to read a recording.
+
+    Fields:
+        observations, actions, rewards, next_observations, dones and episodes
+        (episode # within the recording), as in trial_data.load_transitions.
+        Dict observations are stored as one field per key (e.g.,
+        observations.vector_obs, observations.visual_obs).  For terminal
+        transitions, next_observations holds the terminal observation.
+    """
+
+    def __init__(self, env, directory, chunk_size=4096, metadata=None):
+        super().__init__(env)
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.metadata = {} if metadata is None else metadata
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.fields = {}
+        for key, space in self._observation_spaces().items():
+            self.fields["observations" + key] = (space.dtype, space.shape)
+            self.fields["next_observations" + key] = (space.dtype, space.shape)
+        self.fields["actions"] = (np.dtype(np.float32), self.env.action_space.shape)
+        self.fields["rewards"] = (np.dtype(np.float32), ())
+        self.fields["dones"] = (np.dtype(bool), ())
+        self.fields["episodes"] = (np.dtype(np.int64), ())
+
+        self._chunk = {field : np.zeros((self.chunk_size,) + tuple(shape), dtype=dtype)
+            for field, (dtype, shape) in self.fields.items()}
+        self._chunk_length = 0
+        self.shard_lengths = []
+        self.num_episodes = 0
+
+        schema_path = os.path.join(self.directory, SCHEMA_FILENAME)
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                schema = json.load(f)
+            if schema["fields"] != self._schema_fields():
+                raise ValueError("%s holds a recording with different fields: %s" % (self.directory, schema["fields"]))
+            self.shard_lengths = schema["shards"]
+            self.num_episodes = schema["num_episodes"]
+
+        # the environment may reuse its observation buffers, so the observation
+        #  each step starts from is copied here
+        self._last_obs = {key : np.zeros(space.shape, dtype=space.dtype)
+            for key, space in self._observation_spaces().items()}
+        self._has_last_obs = False
+        self._action = np.zeros(self.env.action_space.shape, dtype=np.float32)
+
+    def _observation_spaces(self):
+        if isinstance(self.observation_space, gym.spaces.Dict):
+            return {"." + key : space for key, space in self.observation_space.spaces.items()}
+        return {"" : self.observation_space}
+
+    def _copy_obs(self, out, obs):
+        # out maps observation keys ("" or ".<key>") to arrays
+        if isinstance(obs, dict):
+            for key, value in obs.items():
+                self._copy_value(out["." + key], value)
+        else:
+            self._copy_value(out[""], obs)
+
+    def _chunk_obs(self, prefix, i):
+        return {key : self._chunk[prefix + key][i] for key in self._last_obs}
+
+    def _copy_value(self, out, value):
+        value = np.asarray(value)
+        if value.size != out.size:
+            # recording part of the values (or padding them) would corrupt the dataset
+            raise ValueError("Cannot record a value of shape %s in a field of shape %s; the environment's "
+                "observation or action space doesn't match what it returns" % (value.shape, out.shape))
+        np.copyto(out, value.reshape(out.shape), casting='unsafe')
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+        self._copy_obs(self._last_obs, obs)
+        self._has_last_obs = True
+        return obs
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        self._record(action, obs, reward, done)
+        return obs, reward, done, info
+
+    def step_async(self, action):
+        self._copy_value(self._action, action)
+        self.env.step_async(action)
+
+    def step_wait(self):
+        obs, reward, done, info = self.env.step_wait()
+        self._record(self._action, obs, reward, done)
+        return obs, reward, done, info
+
+    def _record(self, action, obs, reward, done):
+        i = self._chunk_length
+        for key, last_obs in self._last_obs.items():
+            if self._has_last_obs:
+                np.copyto(self._chunk["observations" + key][i], last_obs)
+            else:
+                self._chunk["observations" + key][i].fill(0)
+        self._copy_obs(self._chunk_obs("next_observations", i), obs)
+        self._copy_value(self._chunk["actions"][i], action)
+        self._chunk["rewards"][i] = reward
+        self._chunk["dones"][i] = done
+        self._chunk["episodes"][i] = self.num_episodes
+        self._chunk_length += 1
+
+        if done:
+            self.num_episodes += 1
+            self._has_last_obs = False
+        else:
+            self._copy_obs(self._last_obs, obs)
+            self._has_last_obs = True
+
+        if self._chunk_length == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Saves the transitions recorded since the last shard as a new shard."""
+        if self._chunk_length == 0:
+            return
+        shard = len(self.shard_lengths)
+        for field in self.fields:
+            np.save(os.path.join(self.directory, shard_filename(field, shard)),
+                self._chunk[field][:self._chunk_length])
+        self.shard_lengths.append(self._chunk_length)
+        self._chunk_length = 0
+        self._write_schema()
+
+    def _schema_fields(self):
+        return {field : {"dtype" : np.dtype(dtype).str, "shape" : list(shape)}
+            for field, (dtype, shape) in self.fields.items()}
+
+    def _write_schema(self):
+        schema = {
+            "fields" : self._schema_fields(),
+            "shards" : self.shard_lengths,
+            "num_transitions" : int(sum(self.shard_lengths)),
+            "num_episodes" : self.num_episodes,
+            "metadata" : self.metadata
+        }
+        path = os.path.join(self.directory, SCHEMA_FILENAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(schema, f, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        self.flush()
+        return self.env.close()
+
+def shard_filename(field, shard):
+    return "%s-%05d.npy" % (field, shard)
+
+def load_recording(directory, concatenate=False):
+    """Loads a recording written by TransitionRecorder.
+
+    Returns (schema, shards), where shards is a list with one dict per shard
+    mapping each field to a read-only memory-mapped array, so nothing is read
+    from disk until it is used.  With concatenate, shards is instead a single
+    dict of in-memory arrays with all transitions (which does copy them).
+    """
+    with open(os.path.join(directory, SCHEMA_FILENAME)) as f:
+        schema = json.load(f)
+
+    shards = [{field : np.load(os.path.join(directory, shard_filename(field, shard)), mmap_mode='r')
+        for field in schema["fields"]} for shard in range(len(schema["shards"]))]
+
+    if concatenate:
+        if len(shards) == 0:
+            return schema, {field : np.zeros([0] + spec["shape"], dtype=np.dtype(spec["dtype"]))
+                for field, spec in schema["fields"].items()}
+        return schema, {field : np.concatenate([shard[field] for shard in shards])
+            for field in schema["fields"]}
+
+    return schema, shards
@@ -0,0 +1,134 @@
+import glob
+import os
+
+import numpy as np
+import pandas
+
+# trial data written by StackingAgent.WriteOutSample, one row per placement
+TRIAL_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "analysis", "trial-data")
+
+# columns of the trial data files:
+#   0: episode #
+#   1: theme obj
+#   2: dest obj
+#   3-5: theme obj rotation at start of action
+#   6: theme obj angle offset from vertical at start of action
+#   7-8: action
+#   9-11: theme obj rotation after action
+#   12: theme obj angle offset from vertical at end of action
+#   then (28-column files only):
+#   13-15: force applied after action
+#   16-21: theme obj bounds center and size
+#   then:
+#   observation (one column per observation value)
+#   reward
+#   ep. total reward
+#   ep. mean reward
+EPISODE_COL = 0
+THEME_COL = 1
+DEST_COL = 2
+START_STATE_COLS = slice(3, 7)
+ACTION_COLS = slice(7, 9)
+END_STATE_COLS = slice(9, 13)
+
+def observation_cols(n_columns):
+    """Returns the slice of observation columns in a trial data file with
+    n_columns columns.  Files that log force and bounds (28 columns for a
+    3-value observation) have observations starting at column 22, older files
+    at column 13.  The last three columns are always the reward, episode total
+    reward and episode mean reward.
+    """
+    start = 22 if n_columns >= 26 else 13
+    return slice(start, n_columns - 3)
+
+def reward_col(n_columns):
+    return n_columns - 3
+
+def prior_columns(logged_priors, priors):
+    """Returns the indices of the observation values for priors in an
+    observation logged with logged_priors.  Observations are constructed by
+    StackingAgent in the order HGT (1 value), REL (5 values), COG (2 values).
+    """
+    sizes = {'HGT' : 1, 'REL' : 5, 'COG' : 2}
+    offsets = {}
+    offset = 0
+    for prior in ['HGT', 'REL', 'COG']:
+        if prior in logged_priors:
+            offsets[prior] = offset
+            offset += sizes[prior]
+
+    cols = []
+    for prior in ['HGT', 'REL', 'COG']:
+        if prior in priors:
+            if prior not in offsets:
+                raise ValueError("Prior %s was not logged (logged priors: %s)" % (prior, logged_priors))
+            cols += list(range(offsets[prior], offsets[prior] + sizes[prior]))
+    return cols
+
+def initial_observation(priors, obs_space_scale=1.0):
+    """The observation at the start of an episode (all objects on the ground),
+    which is not logged in the trial data: height 1, no relations and a
+    centered center of gravity."""
+    obs = []
+    if 'HGT' in priors:
+        obs.append(obs_space_scale)
+    if 'REL' in priors:
+        obs += [0.0] * 5
+    if 'COG' in priors:
+        obs += [0.0, 0.0]
+    return np.array(obs, dtype=np.float32)
+
+def load_transitions(paths=None, priors=['COG','HGT'], logged_priors=['COG','HGT'], obs_space_scale=1.0):
+    """Converts trial data rows into (obs, action, reward, next_obs, done)
+    transitions whose observations match StackerEnv's vector observation
+    space for priors.
+
+    Each row is one placement.  The observation before a placement is the
+    observation logged for the previous placement in the same episode, or
+    initial_observation for the first placement of an episode.  A placement is
+    terminal if it is the last one logged for its episode.
+
+    paths is a list of csv files (or glob patterns); by default all files in
+    TRIAL_DATA_DIR are used.
+    """
+    if paths is None:
+        paths = [os.path.join(TRIAL_DATA_DIR, "*.csv")]
+    if isinstance(paths, str):
+        paths = [paths]
+
+    filenames = sorted(set(f for path in paths for f in glob.glob(path)))
+    if len(filenames) == 0:
+        raise FileNotFoundError("No trial data found at %s" % paths)
+
+    cols = prior_columns(logged_priors, sorted(priors))
+    first_obs = initial_observation(sorted(priors), obs_space_scale)
+
+    observations, actions, rewards, next_observations, dones = [], [], [], [], []
+    for filename in filenames:
+        data = pandas.read_csv(filename, header=None).to_numpy(dtype=np.float32)
+        n_columns = data.shape[1]
+
+        next_obs = data[:, observation_cols(n_columns)][:, cols]
+        episodes = data[:, EPISODE_COL]
+        episode_start = np.ones((data.shape[0],), dtype=bool)
+        episode_start[1:] = episodes[1:] != episodes[:-1]
+        done = np.ones((data.shape[0],), dtype=bool)
+        done[:-1] = episode_start[1:]
+
+        obs = np.empty_like(next_obs)
+        obs[1:] = next_obs[:-1]
+        obs[episode_start] = first_obs
+
+        observations.append(obs)
+        actions.append(data[:, ACTION_COLS])
+        rewards.append(data[:, reward_col(n_columns)])
+        next_observations.append(next_obs)
+        dones.append(done)
+
+    return {
+        "observations" : np.concatenate(observations),
+        "actions" : np.concatenate(actions),
+        "rewards" : np.concatenate(rewards),
+        "next_observations" : np.concatenate(next_observations),
+        "dones" : np.concatenate(dones)
+    }
@@ -0,0 +1,82 @@
+import numpy as np
+from stable_baselines3.common.buffers import DictReplayBuffer
+from stable_baselines3.common.callbacks import BaseCallback
+
+import trial_data
+from prioritized_replay import PrioritizedReplayBuffer
+
+def add_transitions(replay_buffer, observations, actions, rewards, next_observations, dones):
+    """Bulk-inserts transitions into an SB3 ReplayBuffer by writing them into
+    its arrays directly (instead of one add() per transition).  Actions must
+    already be scaled to the policy's [-1, 1] range.  With several envs, the
+    transitions are spread over the envs' columns; any remainder that doesn't
+    fill a whole row is dropped.  If there are more transitions than fit, the
+    last ones are kept.  Returns the number of transitions inserted."""
+    if isinstance(replay_buffer, DictReplayBuffer):
+        raise ValueError("Trial data only has vector observations; a dict (visual + vector) replay buffer can't be warm-started")
+    if replay_buffer.optimize_memory_usage:
+        raise ValueError("Warm-starting a replay buffer with optimize_memory_usage is not supported")
+
+    n_envs = replay_buffer.n_envs
+    rows = min(len(observations) // n_envs, replay_buffer.buffer_size)
+    n = rows * n_envs
+    if n == 0:
+        return 0
+
+    def as_rows(x):
+        x = np.asarray(x)[-n:]
+        return x.reshape((rows, n_envs) + x.shape[1:])
+
+    indices = (replay_buffer.pos + np.arange(rows)) % replay_buffer.buffer_size
+    replay_buffer.observations[indices] = as_rows(observations).reshape((rows, n_envs) + replay_buffer.obs_shape)
+    replay_buffer.next_observations[indices] = as_rows(next_observations).reshape((rows, n_envs) + replay_buffer.obs_shape)
+    replay_buffer.actions[indices] = as_rows(actions).reshape((rows, n_envs, replay_buffer.action_dim))
+    replay_buffer.rewards[indices] = as_rows(rewards)
+    replay_buffer.dones[indices] = as_rows(dones)
+    if replay_buffer.handle_timeout_termination:
+        replay_buffer.timeouts[indices] = False
+    if isinstance(replay_buffer, PrioritizedReplayBuffer):
+        replay_buffer.reset_priorities(indices)
+
+    if replay_buffer.pos + rows >= replay_buffer.buffer_size:
+        replay_buffer.full = True
+    replay_buffer.pos = (replay_buffer.pos + rows) % replay_buffer.buffer_size
+    return n
+
+def warm_start_replay_buffer(model, paths=None, priors=['COG','HGT'], logged_priors=['COG','HGT'], obs_space_scale=1.0):
+    """Fills the replay buffer of an off-policy SB3 model (e.g., DDPG) with the
+    transitions logged in the trial data files in paths (see
+    trial_data.load_transitions).  Returns the number of transitions added."""
+    transitions = trial_data.load_transitions(paths, priors, logged_priors, obs_space_scale)
+
+    obs_shape = model.observation_space.shape
+    if transitions["observations"].shape[1:] != obs_shape:
+        raise ValueError("Trial data observations for priors %s have shape %s, but the model's observation space has shape %s" %
+            (sorted(priors), transitions["observations"].shape[1:], obs_shape))
+
+    # the replay buffer stores actions scaled to [-1, 1]
+    actions = model.policy.scale_action(transitions["actions"])
+
+    return add_transitions(model.replay_buffer, transitions["observations"], actions,
+        transitions["rewards"], transitions["next_observations"], transitions["dones"])
+
+class OfflinePretrainCallback(BaseCallback):
+    """Runs gradient_steps gradient steps on the replay buffer (e.g., after
+    warm-starting it) when training starts, before any environment
+    interaction.  This runs inside learn() so the model's logger is set up."""
+
+    def __init__(self, gradient_steps, batch_size=None, verbose=0):
+        super().__init__(verbose)
+        self.gradient_steps = gradient_steps
+        self.batch_size = batch_size
+
+    def _on_training_start(self):
+        if self.gradient_steps <= 0 or self.model.replay_buffer.size() == 0:
+            return
+        batch_size = self.model.batch_size if self.batch_size is None else self.batch_size
+        if self.verbose > 0:
+            print("Pretraining for %s gradient steps on %s transitions" % (self.gradient_steps, self.model.replay_buffer.size()))
+        self.model.train(gradient_steps=self.gradient_steps, batch_size=batch_size)
+
+    def _on_step(self):
+        return True